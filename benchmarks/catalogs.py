@@ -0,0 +1,101 @@
+"""Synthetic catalogs for benchmarks.
+
+Catalogs are generated with vectorized NumPy calls, a chunk at a time, so
+catalogs of 1e8 rows can be streamed into ``Connection`` without holding
+them in memory. Objects get the columns ``Connection`` expects: ``RA``,
+``DEC``, ``A_IMAGE``, ``B_IMAGE`` and ``THETA_IMAGE`` (sizes in pixels of
+0.267 arcsec), plus a ``MAG`` and a ``CLASS`` column.
+
+Three layouts are available:
+
+* ``uniform``: objects spread evenly over the area of a box.
+* ``clustered``: objects in Gaussian clusters with centres spread evenly
+  over a box, a thousand objects per cluster on average.
+* ``allsky``: objects spread evenly over the whole sky.
+"""
+import numpy as np
+import pandas as pd
+
+KINDS = ['uniform', 'clustered', 'allsky']
+# a one degree square field by default
+FIELD = (150., 1.5, 151., 2.5)
+ALL_SKY = (0., -90., 360., 90.)
+
+
+def _sky_uniform(rng, n, box):
+    """Positions spread evenly over the area of a box."""
+    (xMin, yMin, xMax, yMax) = box
+    ra = rng.uniform(xMin, xMax, n)
+    lo, hi = np.sin(np.radians([yMin, yMax]))
+    dec = np.degrees(np.arcsin(rng.uniform(lo, hi, n)))
+    return ra, dec
+
+
+def _centers(kind, box, rows, seed):
+    """Cluster centres shared by all chunks of a clustered catalog."""
+    if kind != 'clustered':
+        return None
+    rng = np.random.RandomState(seed)
+    ra, dec = _sky_uniform(rng, max(rows//1000, 1), box)
+    return np.column_stack([ra, dec])
+
+
+def _chunk(rng, n, kind, box, centers, spread):
+    """Generate ``n`` objects."""
+    if kind == 'allsky':
+        box = ALL_SKY
+    if kind == 'clustered':
+        (xMin, yMin, xMax, yMax) = box
+        sigma = spread*min(xMax-xMin, yMax-yMin)
+        member = rng.randint(0, centers.shape[0], n)
+        ra = np.clip(centers[member, 0] + rng.normal(0, sigma, n), xMin, xMax)
+        dec = np.clip(centers[member, 1] + rng.normal(0, sigma, n), yMin, yMax)
+    else:
+        ra, dec = _sky_uniform(rng, n, box)
+    a = rng.lognormal(1., 0.5, n)
+    return pd.DataFrame({
+        'RA': ra,
+        'DEC': dec,
+        'A_IMAGE': a,
+        'B_IMAGE': a*rng.uniform(0.2, 1., n),
+        'THETA_IMAGE': rng.uniform(-90., 90., n),
+        'MAG': rng.normal(22., 1.5, n),
+        'CLASS': rng.randint(0, 3, n)
+    })
+
+
+def iter_catalog(rows, kind='clustered', box=FIELD, seed=0, chunk_rows=1000000,
+                 spread=0.005):
+    """Generate a synthetic catalog in chunks.
+
+    The same arguments always give the same catalog, each chunk is drawn
+    from its own generator seeded by ``seed`` and the chunk number.
+
+    Args:
+        rows(int): Number of objects.
+        kind(str): One of ``uniform``, ``clustered`` and ``allsky``.
+            Defaults to ``clustered``.
+        box(tuple): The smallest and largest ``RA`` and ``DEC`` of the
+            field, unused for ``allsky``. Defaults to a one degree square.
+        seed(int): Seed of the random generator. Defaults to 0.
+        chunk_rows(int): Number of objects per chunk. Defaults to 1000000.
+        spread(float): Width of clusters relative to the field. Defaults to
+            0.005.
+
+    Yields:
+        A pandas dataframe for each chunk.
+
+    Raises:
+        Exception: If ``kind`` is unknown.
+    """
+    if kind not in KINDS:
+        raise Exception('Unknown catalog kind {}, use one of {}.'.format(kind, ', '.join(KINDS)))
+    centers = _centers(kind, box, rows, seed)
+    for i, start in enumerate(range(0, rows, chunk_rows)):
+        rng = np.random.RandomState([seed, i+1])
+        yield _chunk(rng, min(chunk_rows, rows-start), kind, box, centers, spread)
+
+
+def make_catalog(rows, kind='clustered', box=FIELD, seed=0, spread=0.005):
+    """Generate a synthetic catalog in one dataframe, see ``iter_catalog``."""
+    return next(iter_catalog(rows, kind, box, seed, max(rows, 1), spread))
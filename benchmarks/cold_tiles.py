@@ -0,0 +1,110 @@
+"""Compare cold tile latency of a catalog inserted in input and curve order.
+
+The same synthetic catalog is inserted in MongoDB once per order (input
+order, then sorted by Morton and Hilbert key as with
+``IngestConfig.order``), then the same random tiles are queried once each
+from every copy. For each order the script reports the median and 95th
+percentile latency of the tile queries, and the number of distinct disk
+pages the objects of a tile span, estimated from their insertion position
+and the average document size. The page count doesn't depend on the state
+of the caches, for truly cold latencies give a ``--cold`` command that
+restarts mongod and drops the OS page cache, run before each order is
+queried.
+
+Example:
+    python benchmarks/cold_tiles.py --rows 2000000 \\
+        --cold "sudo systemctl restart mongod && sync && echo 3 | sudo tee /proc/sys/vm/drop_caches"
+"""
+import argparse
+import subprocess
+import time
+import numpy as np
+import pymongo as pmg
+from vizic.storage import MongoBackend
+from vizic.storage.mongo import box_query
+from vizic.utils import cluster_order
+from catalogs import make_catalog, ALL_SKY
+
+PAGE_SIZE = 32768
+# degrees per pixel of the image sizes
+SCALE = 0.267/3600
+
+
+def make_sky(rows, seed=0):
+    """Make an all-sky catalog of clustered sources in random order, with
+    the semi axes and angle stored for objects."""
+    df = make_catalog(rows, 'clustered', ALL_SKY, seed, spread=0.5/180.)
+    df['a'] = df['A_IMAGE']*SCALE
+    df['b'] = df['B_IMAGE']*SCALE
+    df['theta'] = df['THETA_IMAGE']
+    return df
+
+
+def random_tiles(df, n, zoom, seed=1):
+    """Pick tiles at a zoom level centred on random objects."""
+    rng = np.random.RandomState(seed)
+    size = 360./2**zoom
+    rows = df.iloc[rng.randint(0, df.shape[0], n)]
+    x0 = np.floor(rows['RA'].values/size)*size
+    y0 = np.floor(rows['DEC'].values/size)*size
+    return [(x, y, x+size, y+size) for x, y in zip(x0, y0)]
+
+
+def ingest(backend, name, df, order, chunk_size=50000):
+    backend.drop(name)
+    if order is not None:
+        df = df.iloc[cluster_order(df['RA'].values, df['DEC'].values, order)]
+    for i in range(0, df.shape[0], chunk_size):
+        backend.insert(name, df.iloc[i:i+chunk_size], 0, i)
+    backend.create_indexes(name, '2d', background=False)
+
+
+def measure(backend, name, tiles, min_b):
+    db = backend.db
+    per_page = max(PAGE_SIZE//db.command('collstats', name)['avgObjSize'], 1)
+    times = []
+    pages = []
+    for box in tiles:
+        t = time.time()
+        backend.box(name, box, min_b)
+        times.append(time.time() - t)
+        ids = [x['_id'] for x in db[name].find(box_query('2d', box, min_b), {'_id': 1})]
+        pages.append(len(set(x//per_page for x in ids)))
+    times = np.array(times)*1e3
+    return np.median(times), np.percentile(times, 95), np.mean(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--db', default='vizic_bench')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--tiles', type=int, default=200)
+    parser.add_argument('--zoom', type=int, default=8)
+    parser.add_argument('--cold', help='Shell command run before each order is queried.')
+    args = parser.parse_args()
+
+    df = make_sky(args.rows)
+    tiles = random_tiles(df, args.tiles, args.zoom)
+    min_b = 0.
+    orders = [None, 'morton', 'hilbert']
+    backend = MongoBackend(pmg.MongoClient(args.host, args.port)[args.db])
+    for order in orders:
+        print('Inserting {} rows in {} order'.format(args.rows, order or 'input'))
+        ingest(backend, 'bench_{}'.format(order or 'input'), df, order)
+
+    print('{:>8} {:>12} {:>12} {:>12}'.format('order', 'median ms', 'p95 ms', 'pages/tile'))
+    for order in orders:
+        if args.cold:
+            subprocess.check_call(args.cold, shell=True)
+            backend = MongoBackend(pmg.MongoClient(args.host, args.port)[args.db])
+        med, p95, pages = measure(backend, 'bench_{}'.format(order or 'input'), tiles, min_b)
+        print('{:>8} {:>12.2f} {:>12.2f} {:>12.1f}'.format(order or 'input', med, p95, pages))
+
+    for order in orders:
+        backend.drop('bench_{}'.format(order or 'input'))
+
+
+if __name__ == '__main__':
+    main()
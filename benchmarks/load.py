@@ -0,0 +1,290 @@
+"""Load test the server extension with simulated or replayed map sessions.
+
+Simulated users pan and zoom a map of a stored catalog: each starts at a
+random view and moves one step at a time, panning by a tile, zooming in or
+zooming out, and requests the tiles of the new view it hasn't loaded yet,
+several at once as a browser does, then waits a random think time. With
+``--replay``, the requests found in logs of real sessions are sent instead,
+in order, by as many workers as the concurrency. Logs of a notebook server
+run with ``--NotebookApp.log_level=DEBUG`` list every request, of which
+only the ``GET`` requests to the extension handlers are replayed, with the
+``base_url`` of the notebook server dropped. The requests sent by simulated
+users can be saved with ``--record`` to replay them later.
+
+The load is run once per concurrency given, each run lasting ``--duration``
+seconds or until the replayed requests run out, and the latency
+percentiles, throughput and error rate of each run are reported, and
+written as JSON with ``--out``.
+
+Unless ``--url`` is given, ``benchmarks/server.py`` is started in its own
+process, serving the catalogs of the database given by the ``VIZIC_*``
+environment variables (see ``vizic.mongo_ext.extension.get_connection``),
+a local mongod by default, or files in ``VIZIC_PATH`` with
+``VIZIC_BACKEND=embedded``.
+
+Example:
+    python benchmarks/load.py --catalog bench_clustered_1000000 \\
+        --concurrency 1 4 16 64 --duration 30 --record session.log
+    python benchmarks/load.py --replay session.log --concurrency 1 4 16 64
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from collections import deque
+import numpy as np
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPError
+from tornado.ioloop import IOLoop
+
+# GET requests to the extension in notebook server logs, and in logs written
+# by --record, the base_url before the route is dropped
+JSON_ROUTES = ['tiles', 'healpix', 'mst', 'circles', 'voronoi']
+QUERY_ROUTES = ['objectPop', 'selection', 'count']
+NOTEBOOK_ROUTES = ['api', 'static', 'nbextensions', 'files', 'notebooks', 'tree', 'kernelspecs']
+LOG_REQUEST = re.compile(r'\bGET (?!\S*/(?:{})/)\S*?(/(?:(?:{})/\S+\.json|(?:{})/?(?:\?\S*)?))(?=\s|$)'.format(
+    '|'.join(NOTEBOOK_ROUTES), '|'.join(JSON_ROUTES), '|'.join(QUERY_ROUTES)))
+# parallel requests per user, as browsers make per host
+BROWSER_CONNECTIONS = 6
+
+
+class Stats(object):
+    """Outcome of the requests of a run.
+
+    Attributes:
+        latencies(list): Time taken by each request in seconds.
+        errors(dict): Number of failed requests per status code, 599 for
+            connection errors and timeouts.
+        bytes(int): Total size of the responses.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = {}
+        self.bytes = 0
+
+    def summary(self, elapsed):
+        """Summarize the run as a dictionary."""
+        n = len(self.latencies)
+        failed = sum(self.errors.values())
+        lat = np.asarray(self.latencies)*1e3 if n > 0 else np.zeros(1)
+        return {'requests': n, 'errors': failed, 'error_rate': float(failed)/max(n, 1),
+                'error_codes': {str(k): v for k, v in self.errors.items()},
+                'elapsed_s': elapsed, 'throughput': n/elapsed if elapsed > 0 else 0.,
+                'mb_per_s': self.bytes/2.**20/elapsed if elapsed > 0 else 0.,
+                'p50_ms': float(np.percentile(lat, 50)),
+                'p90_ms': float(np.percentile(lat, 90)),
+                'p99_ms': float(np.percentile(lat, 99)),
+                'max_ms': float(lat.max())}
+
+
+class Session(object):
+    """A user panning and zooming a map.
+
+    The view is ``cols`` by ``rows`` tiles around a centre tile. Each move
+    pans by one tile, zooms in or zooms out, with the probabilities in
+    ``moves``, staying within the zoom levels given.
+
+    Attributes:
+        zoom(int): The current zoom level.
+        x(int): x-coordinate of the centre tile.
+        y(int): y-coordinate of the centre tile.
+        seen(set): Tiles already loaded, which the browser keeps.
+    """
+    moves = {'pan': 0.6, 'in': 0.25, 'out': 0.15}
+
+    def __init__(self, rng, min_zoom, max_zoom, start_zoom, cols=4, rows=3):
+        self.rng = rng
+        (self.min_zoom, self.max_zoom) = (min_zoom, max_zoom)
+        (self.cols, self.rows) = (cols, rows)
+        self.zoom = start_zoom
+        n = 2**start_zoom
+        (self.x, self.y) = (rng.randint(0, n), rng.randint(0, n))
+        self.seen = set()
+
+    def view(self):
+        """Return the tiles of the current view not loaded yet."""
+        n = 2**self.zoom
+        tiles = []
+        for i in range(self.x-self.cols//2, self.x-self.cols//2+self.cols):
+            for j in range(self.y-self.rows//2, self.y-self.rows//2+self.rows):
+                tile = (self.zoom, i, j)
+                if 0 <= i < n and 0 <= j < n and tile not in self.seen:
+                    self.seen.add(tile)
+                    tiles.append(tile)
+        return tiles
+
+    def move(self):
+        """Pan or zoom, and return the tiles of the new view not loaded yet."""
+        names = sorted(self.moves.keys())
+        move = names[self.rng.choice(len(names), p=[self.moves[k] for k in names])]
+        if move == 'in' and self.zoom < self.max_zoom:
+            self.zoom += 1
+            (self.x, self.y) = (2*self.x+self.rng.randint(0, 2), 2*self.y+self.rng.randint(0, 2))
+        elif move == 'out' and self.zoom > self.min_zoom:
+            self.zoom -= 1
+            (self.x, self.y) = (self.x//2, self.y//2)
+        else:
+            n = 2**self.zoom
+            (dx, dy) = [(1, 0), (-1, 0), (0, 1), (0, -1)][self.rng.randint(0, 4)]
+            (self.x, self.y) = (min(max(self.x+dx, 0), n-1), min(max(self.y+dy, 0), n-1))
+        return self.view()
+
+
+@gen.coroutine
+def fetch(client, url, stats, timeout):
+    """Request a URL and record the outcome."""
+    start = time.time()
+    try:
+        res = yield client.fetch(url, request_timeout=timeout)
+        stats.bytes += len(res.body)
+    except HTTPError as err:
+        stats.errors[err.code] = stats.errors.get(err.code, 0) + 1
+    except Exception:
+        stats.errors[599] = stats.errors.get(599, 0) + 1
+    stats.latencies.append(time.time()-start)
+
+
+@gen.coroutine
+def simulated_user(client, base, args, session, stats, deadline, record):
+    """Move a session around until the deadline, loading each new view."""
+    tiles = session.view()
+    while time.time() < deadline:
+        paths = ['/tiles/{}/{}/{}/{}.json'.format(args.catalog, z, x, y) for z, x, y in tiles]
+        for i in range(0, len(paths), BROWSER_CONNECTIONS):
+            yield [fetch(client, base+p, stats, args.timeout) for p in paths[i:i+BROWSER_CONNECTIONS]]
+        if record is not None:
+            record.extend(paths)
+        if args.think > 0:
+            yield gen.sleep(session.rng.exponential(args.think))
+        tiles = session.move()
+
+
+@gen.coroutine
+def replay_worker(client, base, args, queue, stats, deadline):
+    """Send requests from a shared queue until it is empty or the deadline."""
+    while len(queue) > 0 and time.time() < deadline:
+        yield fetch(client, base+queue.popleft(), stats, args.timeout)
+
+
+@gen.coroutine
+def run_level(args, base, concurrency, paths, record):
+    """Run the load with a number of concurrent users or replay workers."""
+    client = AsyncHTTPClient(force_instance=True, max_clients=concurrency*BROWSER_CONNECTIONS)
+    stats = Stats()
+    start = time.time()
+    deadline = start + args.duration
+    if paths is not None:
+        queue = deque(paths)
+        yield [replay_worker(client, base, args, queue, stats, deadline)
+               for _ in range(concurrency)]
+    else:
+        users = [Session(np.random.RandomState([args.seed, concurrency, i]), args.min_zoom,
+                         args.max_zoom, args.start_zoom, args.cols, args.rows)
+                 for i in range(concurrency)]
+        yield [simulated_user(client, base, args, s, stats, deadline, record) for s in users]
+    elapsed = time.time()-start
+    client.close()
+    raise gen.Return(stats.summary(elapsed))
+
+
+def read_log(path):
+    """Read the paths of the GET requests to the extension in a server log.
+
+    Other requests of the notebook server, as to ``/api/`` or ``/static/``,
+    aren't served by ``server.py`` and are left out. Paths are relative to
+    the base URL of the server, which ``--url`` gives.
+    """
+    paths = []
+    with open(path) as f:
+        for line in f:
+            m = LOG_REQUEST.search(line)
+            if m is not None:
+                paths.append(m.group(1))
+    return paths
+
+
+def start_server(port, timeout=30.):
+    """Start ``server.py`` in its own process and wait for it to listen."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    proc = subprocess.Popen([sys.executable, script, '--port', str(port)])
+    start = time.time()
+    while time.time()-start < timeout:
+        if proc.poll() is not None:
+            raise Exception('The server exited with status {}'.format(proc.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return proc
+        except socket.error:
+            time.sleep(0.2)
+    proc.terminate()
+    raise Exception('The server did not start listening on port {}'.format(port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help='Root URL of a running server, one is started by default.')
+    parser.add_argument('--port', type=int, default=8899, help='Port of the server started.')
+    parser.add_argument('--catalog', help='The catalog simulated users browse.')
+    parser.add_argument('--replay', nargs='+', help='Server logs to replay instead.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--duration', type=float, default=30.)
+    parser.add_argument('--think', type=float, default=0.5, help='Mean seconds between moves of a user.')
+    parser.add_argument('--min-zoom', type=int, default=0)
+    parser.add_argument('--max-zoom', type=int, default=10)
+    parser.add_argument('--start-zoom', type=int, default=2)
+    parser.add_argument('--cols', type=int, default=4, help='Tiles across a view.')
+    parser.add_argument('--rows', type=int, default=3, help='Tiles down a view.')
+    parser.add_argument('--timeout', type=float, default=60.)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record', help='Save the requests of simulated users as a log.')
+    parser.add_argument('--out', help='Write the results as JSON.')
+    args = parser.parse_args()
+    if args.replay is None and args.catalog is None:
+        parser.error('give a --catalog to browse or logs to --replay')
+
+    paths = None
+    if args.replay is not None:
+        paths = [p for log in args.replay for p in read_log(log)]
+        print('Replaying {} requests'.format(len(paths)))
+    record = [] if args.record and paths is None else None
+
+    proc = None
+    base = args.url
+    if base is None:
+        proc = start_server(args.port)
+        base = 'http://127.0.0.1:{}'.format(args.port)
+    base = base.rstrip('/')
+
+    results = []
+    print('{:>6} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+        'users', 'requests', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'errors'))
+    try:
+        for n in args.concurrency:
+            result = IOLoop.current().run_sync(lambda: run_level(args, base, n, paths, record))
+            result['concurrency'] = n
+            results.append(result)
+            print('{:>6} {:>9} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>7.1%}'.format(
+                n, result['requests'], result['throughput'], result['p50_ms'],
+                result['p90_ms'], result['p99_ms'], result['error_rate']))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    if record is not None:
+        with open(args.record, 'w') as f:
+            f.writelines('GET {}\n'.format(p) for p in record)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'url': base, 'catalog': args.catalog, 'replay': args.replay,
+                       'duration': args.duration, 'results': results}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Serve the vizic server extension from a bare Tornado application.
+
+The handlers are registered by ``load_jupyter_server_extension`` as in a
+notebook server, without the rest of the notebook, so benchmarks can talk to
+the extension over HTTP without starting Jupyter. ``start_server`` runs it in
+a background thread of the calling process, and running this file serves it
+in its own process until interrupted.
+
+Example:
+    python benchmarks/server.py --port 8899
+"""
+from __future__ import print_function
+import argparse
+import logging
+import threading
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from vizic.mongo_ext.extension import load_jupyter_server_extension
+
+
+class ExtensionApp(object):
+    """The parts of a ``NotebookApp`` used to load the extension.
+
+    Attributes:
+        log: A logger.
+        web_app: The ``tornado.web.Application`` serving the handlers.
+    """
+
+    def __init__(self, base_url='/'):
+        self.log = logging.getLogger('vizic.benchmarks')
+        self.web_app = tornado.web.Application(
+            [], base_url=base_url, log=self.log, headers={},
+            allow_remote_access=True)
+        load_jupyter_server_extension(self)
+
+
+def _new_loop():
+    """Make a new IOLoop current for the calling thread."""
+    try:
+        import asyncio
+        asyncio.set_event_loop(asyncio.new_event_loop())
+    except ImportError:
+        pass
+    loop = IOLoop()
+    loop.make_current()
+    return loop
+
+
+def start_server(port=0, address='127.0.0.1'):
+    """Serve the extension handlers in a background thread.
+
+    Args:
+        port(int): The port listened on, any free port by default.
+        address(str): The address listened on. Defaults to ``127.0.0.1``.
+
+    Returns:
+        The port listened on, and a function stopping the server.
+    """
+    state = {}
+    started = threading.Event()
+
+    def run():
+        loop = _new_loop()
+        sockets = bind_sockets(port, address)
+        server = HTTPServer(ExtensionApp().web_app)
+        server.add_sockets(sockets)
+        state.update(loop=loop, port=sockets[0].getsockname()[1])
+        started.set()
+        loop.start()
+        server.stop()
+        loop.close()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    started.wait()
+
+    def stop():
+        state['loop'].add_callback(state['loop'].stop)
+        thread.join()
+
+    return state['port'], stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--address', default='127.0.0.1')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    loop = _new_loop()
+    server = HTTPServer(ExtensionApp().web_app)
+    server.listen(args.port, args.address)
+    print('Serving the vizic extension on http://{}:{}/'.format(args.address, args.port))
+    try:
+        loop.start()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
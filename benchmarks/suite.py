@@ -0,0 +1,397 @@
+"""Benchmark ingestion, tile, popup and selection queries, MSTs and Healpix
+grids on synthetic catalogs.
+
+For each catalog size a synthetic catalog (see ``catalogs.py``) is streamed
+into a storage backend the way ``Connection.from_file`` does, timing the
+formatting, insertion and index build. The server extension, started
+in-process unless ``--port`` points to a running notebook server, is then
+queried for random tiles holding objects at each zoom level, popups of
+random objects and rectangle selections of several sizes. ``get_mst`` and
+``cut_tree`` are timed on a subset of the catalog, and ``get_vert_bbox`` over
+the catalog extent. The catalog is also ingested from memory with
+``Connection.to_new``, in a fresh interpreter, with rows kept in input order
+and sorted along a Hilbert curve, reporting the peak resident memory taken.
+
+``import vizic`` is timed first in fresh interpreters, and fails the run if
+it takes longer than ``--import-budget`` seconds or loads healpy, scipy's
+graph and spatial modules, sklearn or the notebook, which are only loaded
+when first used. Give ``--rows`` with no sizes to check the import only.
+
+Results are written as JSON with one record per benchmark, keyed by
+``name``, ``rows``, ``kind``, ``backend`` and ``params``, with the median,
+95th percentile and mean times in milliseconds. Given a ``--baseline`` file
+from an earlier run, benchmarks whose median grew by more than
+``--tolerance`` are reported and the script exits with status 1.
+
+The ``embedded`` backend needs no database service, ``mongo`` needs a local
+mongod.
+
+Example:
+    python benchmarks/suite.py --rows 10000 100000 1000000 --kind clustered \\
+        --backend embedded --out results.json --baseline previous.json
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from vizic._version import __version__
+from vizic.connection import Connection, Collection
+from vizic.utils import get_mst, cut_tree, get_vert_bbox, MemoryMonitor
+from catalogs import iter_catalog, make_catalog, KINDS
+from server import start_server
+
+# modules loaded on first use only, never by import vizic
+LAZY_MODULES = ['healpy', 'sklearn', 'scipy.sparse.csgraph', 'scipy.spatial', 'notebook']
+IMPORT_CODE = ('import sys, time; start = time.time(); import vizic; '
+               'print(time.time()-start); '
+               'print(" ".join(m for m in {} if m in sys.modules))')
+
+
+def summarize(name, times, errors=0, **params):
+    """Make the record of a benchmark from its times in seconds."""
+    times = np.asarray(times)*1e3
+    return {'name': name, 'params': params, 'n': len(times), 'errors': errors,
+            'median_ms': float(np.median(times)),
+            'p95_ms': float(np.percentile(times, 95)),
+            'mean_ms': float(np.mean(times))}
+
+
+def ingest(conn, name, rows, kind, chunk_rows, seed):
+    """Stream a synthetic catalog into a new catalog collection.
+
+    Returns:
+        The ingestion record, and the first chunk of the catalog.
+    """
+    conn.rm_catalog(name, conn.storage.db_name)
+    coll = Collection()
+    coll.name = name
+    sample = []
+
+    def chunks():
+        for chunk in iter_catalog(rows, kind, seed=seed, chunk_rows=chunk_rows):
+            if len(sample) == 0:
+                sample.append(chunk)
+            yield chunk
+
+    start = time.time()
+    source = 'benchmark:{}:{}:{}'.format(kind, rows, seed)
+    manifest = conn._begin_ingest(coll, False, source, chunk_rows)
+    conn._insert_chunks(conn._prep_chunks(chunks(), coll), coll, manifest)
+    conn._finish_ingest(coll, manifest)
+    elapsed = time.time()-start
+    record = summarize('ingest', [elapsed], chunk_rows=chunk_rows)
+    prep = coll.stats.get('prep', {'time': 0., 'added': 0})
+    record.update({
+        'rows_per_s': rows/elapsed,
+        'prep_s': prep['time'],
+        'prep_added_mb': prep['added']/2.**20,
+        'insert_s': coll.stats.get('insert', {'time': 0.})['time'],
+        'index_s': coll.stats.get('index', {'time': 0.})['time']
+    })
+    return record, sample[0]
+
+
+def memory_benchmark(args, port, path, rows, order):
+    """Ingest a catalog from memory in a fresh interpreter.
+
+    The child runs ``--memory-run``, so memory left over by earlier
+    benchmarks doesn't hide the memory taken.
+
+    Returns:
+        The benchmark record, with the peak resident memory and the peak
+        above the memory held before ingesting.
+    """
+    spec = {'host': args.host, 'db_port': args.db_port, 'db': args.db, 'port': port,
+            'backend': args.backend, 'path': path, 'rows': rows, 'kind': args.kind,
+            'seed': args.seed, 'order': order}
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                   '--memory-run', json.dumps(spec)])
+    result = json.loads(out.decode().strip().split('\n')[-1])
+    record = summarize('ingest_memory', [result['time']], order=order)
+    mb = 2.**20
+    record.update({'peak_mb': result['peak']/mb if result['peak'] is not None else None,
+                   'above_start_mb': (result['peak']-result['start'])/mb
+                   if result['start'] is not None else None})
+    return record
+
+
+def memory_run(spec):
+    """Ingest a catalog with ``to_new`` and print the memory taken as JSON."""
+    spec = json.loads(spec)
+    conn = Connection(spec['host'], spec['db_port'], spec['db'], spec['port'],
+                      spec['backend'], spec['path'])
+    conn.ingest.order = spec['order']
+    df = make_catalog(spec['rows'], spec['kind'], seed=spec['seed'])
+    name = 'bench_memory_{}'.format(spec['rows'])
+    conn.rm_catalog(name, conn.storage.db_name)
+    start = time.time()
+    with MemoryMonitor() as monitor:
+        conn.to_new(df, name)
+    elapsed = time.time()-start
+    conn.rm_catalog(name, conn.storage.db_name)
+    conn.server.close()
+    result = monitor.report()
+    result['time'] = elapsed
+    print(json.dumps(result))
+
+
+def timed_requests(conn, requests):
+    """Time GET requests to the server extension.
+
+    Args:
+        conn: The ``Connection`` whose server client is used.
+        requests(list): Pairs of path and body, None for no body.
+
+    Returns:
+        The time of each request in seconds, and the number of failed ones.
+    """
+    times = []
+    errors = 0
+    for path, body in requests:
+        start = time.time()
+        try:
+            res = conn.server.get(path, data=body)
+            errors += res.status_code != 200
+        except Exception:
+            errors += 1
+        times.append(time.time()-start)
+    return times, errors
+
+
+def query_benchmarks(conn, name, sample, args):
+    """Time tile, popup and selection queries."""
+    rng = np.random.RandomState(args.seed)
+    meta = conn.read_meta(name)
+    (x0, y0) = meta._des_crs[:2]
+    records = []
+
+    picks = sample.iloc[rng.randint(0, sample.shape[0], args.requests)]
+    for zoom in range(args.max_zoom+1):
+        n = 2**zoom
+        xc = np.clip(np.floor((picks['RA'].values-x0)/meta.x_range*n), 0, n-1).astype(int)
+        yc = np.clip(np.floor((y0-picks['DEC'].values)/meta.y_range*n), 0, n-1).astype(int)
+        tiles = [('/tiles/{}/{}/{}/{}.json'.format(name, zoom, x, y), None)
+                 for x, y in zip(xc.tolist(), yc.tolist())]
+        times, errors = timed_requests(conn, tiles)
+        records.append(summarize('tile', times, errors, zoom=zoom))
+
+    popups = [('/objectPop/', {'coll': name, 'RA': repr(float(r)), 'DEC': repr(float(d))})
+              for r, d in zip(picks['RA'].values, picks['DEC'].values)]
+    times, errors = timed_requests(conn, popups)
+    records.append(summarize('popup', times, errors))
+
+    for size in args.selection_sizes:
+        (w, h) = (meta.x_range*size/2, meta.y_range*size/2)
+        boxes = [('/selection/', {'coll': name, 'swlng': r-w, 'swlat': d-h, 'nelng': r+w, 'nelat': d+h})
+                 for r, d in zip(picks['RA'].values, picks['DEC'].values)]
+        times, errors = timed_requests(conn, boxes[:args.selections])
+        records.append(summarize('selection', times, errors, size=size))
+    return records
+
+
+def compute_benchmarks(conn, name, sample, args):
+    """Time MST building and cutting, and Healpix grid vertices."""
+    records = []
+    df = sample[['RA', 'DEC']].iloc[:args.mst_rows].reset_index(drop=True)
+    times = []
+    for _ in range(args.repeat):
+        start = time.time()
+        edges, mst_index = get_mst(df, args.neighbors)
+        times.append(time.time()-start)
+    records.append(summarize('get_mst', times, rows=df.shape[0], neighbors=args.neighbors))
+    length = float(np.median(mst_index[2]))
+    times = []
+    for _ in range(args.repeat):
+        start = time.time()
+        cut_tree(mst_index, length, 10)
+        times.append(time.time()-start)
+    records.append(summarize('cut_tree', times, rows=df.shape[0], member=10))
+
+    meta = conn.read_meta(name)
+    (xMin, yMax) = meta._des_crs[:2]
+    for nside in args.nsides:
+        times = []
+        for _ in range(args.repeat):
+            start = time.time()
+            get_vert_bbox(xMin, yMax-meta.y_range, xMin+meta.x_range, yMax, nside, True)
+            times.append(time.time()-start)
+        records.append(summarize('get_vert_bbox', times, nside=nside))
+    return records
+
+
+def catalog_benchmarks(args):
+    """Run the benchmarks of each catalog size."""
+    stop = None
+    port = args.port
+    if port is None:
+        port, stop = start_server()
+    path = args.path
+    tmp = None
+    if args.backend != 'mongo' and path is None:
+        path = tmp = tempfile.mkdtemp(prefix='vizic_bench')
+    conn = Connection(args.host, args.db_port, args.db, port, args.backend, path)
+
+    results = []
+    try:
+        for rows in args.rows:
+            name = 'bench_{}_{}'.format(args.kind, rows)
+            print('Ingesting {} {} rows'.format(rows, args.kind))
+            record, sample = ingest(conn, name, rows, args.kind, args.chunk_rows, args.seed)
+            records = [record]
+            records += query_benchmarks(conn, name, sample, args)
+            records += compute_benchmarks(conn, name, sample, args)
+            for order in [None, 'hilbert']:
+                record = memory_benchmark(args, port, path, rows, order)
+                records.append(record)
+                print('{:>14} {:>10} {:<24} peak {:.1f} MB, {:.1f} MB above start'.format(
+                    'ingest_memory', rows, 'order={}'.format(order),
+                    record['peak_mb'] or 0., record['above_start_mb'] or 0.))
+            for r in records:
+                r.update({'rows': rows, 'kind': args.kind, 'backend': args.backend})
+                print('{:>14} {:>10} {:<24} {:>10.2f} ms {:>10.2f} ms p95'.format(
+                    r['name'], rows, json.dumps(r['params'], sort_keys=True),
+                    r['median_ms'], r['p95_ms']))
+            results += records
+            if not args.keep:
+                conn.rm_catalog(name, conn.storage.db_name)
+    finally:
+        conn.server.close()
+        if stop is not None:
+            stop()
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+def import_benchmark(args):
+    """Time ``import vizic`` in fresh interpreters.
+
+    The heavy modules in ``LAZY_MODULES`` loaded by the import are listed
+    under ``loaded``.
+    """
+    code = IMPORT_CODE.format(LAZY_MODULES)
+    times = []
+    for _ in range(args.repeat):
+        out = subprocess.check_output([sys.executable, '-c', code]).decode().split('\n')
+        times.append(float(out[0]))
+    record = summarize('import', times)
+    record.update({'rows': 0, 'kind': None, 'backend': None,
+                   'budget_ms': args.import_budget*1e3, 'loaded': out[1].split()})
+    print('{:>14} {:>10.2f} ms, budget {:.2f} ms'.format('import vizic', record['median_ms'], record['budget_ms']))
+    return record
+
+
+def check_import(record):
+    """Print whether ``import vizic`` kept its budget and lazy imports.
+
+    Returns:
+        The number of failed checks.
+    """
+    failed = 0
+    if record['median_ms'] > record['budget_ms']:
+        failed += 1
+        print('import vizic took {:.2f} ms, over the budget of {:.2f} ms'.format(
+            record['median_ms'], record['budget_ms']))
+    if len(record['loaded']) > 0:
+        failed += 1
+        print('import vizic loaded {}'.format(', '.join(record['loaded'])))
+    return failed
+
+
+def environment(args):
+    """Describe the code and machine the benchmarks ran on."""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode().strip()
+    except Exception:
+        commit = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit,
+            'vizic': __version__, 'python': sys.version.split()[0],
+            'numpy': np.__version__, 'platform': platform.platform(),
+            'backend': args.backend, 'seed': args.seed}
+
+
+def _key(record):
+    return json.dumps([record['name'], record['rows'], record['kind'], record['backend'],
+                       record['params']], sort_keys=True)
+
+
+def compare(results, baseline, tolerance):
+    """Print benchmarks slower than in a baseline.
+
+    Returns:
+        The number of regressions.
+    """
+    old = {_key(r): r for r in baseline['results']}
+    slower = 0
+    for record in results:
+        prev = old.get(_key(record))
+        if prev is None or prev['median_ms'] <= 0:
+            continue
+        ratio = record['median_ms']/prev['median_ms']
+        if ratio > 1+tolerance:
+            slower += 1
+            print('Regression: {} {} rows {}: {:.2f} ms, was {:.2f} ms ({:+.0%})'.format(
+                record['name'], record['rows'], json.dumps(record['params'], sort_keys=True),
+                record['median_ms'], prev['median_ms'], ratio-1))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, nargs='*', default=[10000, 100000, 1000000],
+                        help='Catalog sizes, none to check the import time only.')
+    parser.add_argument('--kind', choices=KINDS, default='clustered')
+    parser.add_argument('--backend', choices=['mongo', 'embedded', 'columnar'], default='mongo')
+    parser.add_argument('--path', help='Directory for the embedded and columnar backends, a temporary one by default.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=27017)
+    parser.add_argument('--db', default='vizic_bench')
+    parser.add_argument('--port', type=int, help='Port of a running notebook server, one is started in-process by default.')
+    parser.add_argument('--chunk-rows', type=int, default=1000000)
+    parser.add_argument('--max-zoom', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100, help='Requests per tile zoom and for popups.')
+    parser.add_argument('--selections', type=int, default=20)
+    parser.add_argument('--selection-sizes', type=float, nargs='+', default=[0.01, 0.05, 0.2])
+    parser.add_argument('--mst-rows', type=int, default=100000)
+    parser.add_argument('--neighbors', type=int, default=15)
+    parser.add_argument('--nsides', type=int, nargs='+', default=[64, 256, 1024])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='benchmark.json')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--keep', action='store_true', help='Keep the benchmark catalogs.')
+    parser.add_argument('--import-budget', type=float, default=1.,
+                        help='Seconds import vizic may take.')
+    parser.add_argument('--memory-run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.memory_run is not None:
+        memory_run(args.memory_run)
+        return
+
+    results = [import_benchmark(args)]
+    over = check_import(results[0])
+    if len(args.rows) > 0:
+        results += catalog_benchmarks(args)
+
+    with open(args.out, 'w') as f:
+        json.dump({'environment': environment(args), 'results': results}, f, indent=1)
+    print('Results written to {}'.format(args.out))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        over += compare(results, baseline, args.tolerance)
+    if over:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@ require('leaflet/scripts/L.DesCRS');
 require('leaflet/scripts/L.SvgTile');
 require('leaflet/scripts/L.CusOverLay');
 require('leaflet/scripts/L.SciOveLay');
+require('leaflet/scripts/L.HealpixTile');
 require('leaflet/scripts/L.Control.MousePosition');
 require('leaflet-fullscreen');
 
@@ -20,6 +21,17 @@ function camel_case(input) {
         return group1.toUpperCase();
     });
 }
+// binary buffers arrive as DataView, read them byte by byte
+function unpack_bitmask(value) {
+    if (value === null || value === undefined) {
+        return null;
+    }
+    if (value instanceof DataView) {
+        return new Uint8Array(value.buffer, value.byteOffset, value.byteLength);
+    }
+    return new Uint8Array(value.buffer || value);
+}
+
 var colorMaps={
     1: d3SC.interpolateSpectral,
     2: d3SC.interpolateBrBG,
@@ -180,33 +192,18 @@ var LeafletMstLayerView = LeafletOverlayView.extend({
         var that = this;
 
         this.listenTo(this.model, 'change:_cut_count', function() {
-            // var visible = that.model.get('visible');
-            var count = this.model.get('_cut_count');
-            console.log(count);
             var max = this.model.get('max_len');
-            var idx = this.model.get('line_idx');
-            var json_cp = this.obj._json;
+            var mask = this.model.get('line_mask');
 
-            function comp(a, b) {
-                return a.line_index - b.line_index;
+            // bit i of the packed mask (msb first) tells if line i is saved
+            function display(d) {
+                var i = d.line_index;
+                return (mask[i >> 3] >> (7 - (i & 7))) & 1 ? 'initial' : 'none';
             }
-
-            // key_func() is used to get the position of a line in the whole tree
-            function key_func(d) {
-                return d.line_index;
-            }
-            json_cp.sort(comp);
-            var new_data = [];
-            // After the tree cut, pick wanted lines from ordered tree lines
-            for (var i = 0; i < idx.length; i++) {
-                new_data.push(json_cp[idx[i]]);
-            }
-            if (max === 0) {
-                d3.select(this.obj._el).selectAll('path').attr('display', none);
+            if (max === 0 || mask === null) {
+                d3.select(this.obj._el).selectAll('path').attr('display', 'none');
             } else {
-                var selection = d3.select(this.obj._el).selectAll('path').data(new_data, key_func); /*key_func tells d3 to order grabbed paths*/
-                selection.exit().attr('display', 'none');
-                selection.attr('display', 'initial');
+                d3.select(this.obj._el).selectAll('path').attr('display', display);
             }
 
         }, this);
@@ -225,10 +222,25 @@ var LeafletDelaunayLayerView = LeafletOverlayView.extend({
     },
 });
 
-var LeafletHealpixLayerView = LeafletOverlayView.extend({
+var LeafletHealpixLayerView = LeafletLayerView.extend({
     create_obj: function() {
-        this.obj = new Healpix(this.model.get('_healpix_url'), this.get_options());
+        this.obj = L.healpixTile(this.model.get('_healpix_url'), this.get_options());
     },
+    model_events: function() {
+        this.listenTo(this.model, 'change:color', function() {
+            this.obj.setColor(this.model.get('color'));
+        }, this);
+    }
+});
+
+var LeafletHealpixDensityLayerView = LeafletHealpixLayerView.extend({
+    model_events: function() {
+        LeafletHealpixDensityLayerView.__super__.model_events.apply(this, arguments);
+        this.listenTo(this.model, 'change:stat change:c_map change:c_min_max change:fill_opacity', function() {
+            this.obj.setFill(this.model.get('stat'), this.model.get('c_map'),
+                this.model.get('c_min_max'), this.model.get('fill_opacity'));
+        }, this);
+    }
 });
 
 var LeafletCirclesLayerView = LeafletOverlayView.extend({
@@ -247,6 +259,7 @@ var LeafletGridLayerView = LeafletRasterLayerView.extend({
     },
     model_events: function() {
         var that = this;
+        this.listenTo(this.model, 'msg:custom', this.handle_msg, this);
         function single_cTile(key, color, callback) {
             d3.select(that.obj._cTiles[key].el).selectAll('ellipse').attr('fill', color);
             callback(null);
@@ -481,6 +494,13 @@ var LeafletGridLayerView = LeafletRasterLayerView.extend({
                 });
             });
         });
+    },
+    handle_msg: function(content) {
+        switch (content.method) {
+            case 'refresh':
+                this.obj.refreshBoxes(content.boxes);
+                break;
+        }
     }
 });
 
@@ -1144,8 +1164,15 @@ var LeafletMstLayerModel = LeafletLayerModel.extend({
         svg_zoom: 5,
         color: '#0459e2',
         shape: 'path',
-        __cut_count: 0
+        line_mask: null,
+        _cut_count: 0
     })
+}, {
+    serializers: _.extend({
+        line_mask: {
+            deserialize: unpack_bitmask
+        }
+    }, widgets.WidgetModel.serializers)
 });
 
 var LeafletVoronoiLayerModel = LeafletLayerModel.extend({
@@ -1187,6 +1214,18 @@ var LeafletHealpixLayerModel = LeafletLayerModel.extend({
     })
 });
 
+var LeafletHealpixDensityLayerModel = LeafletHealpixLayerModel.extend({
+    defaults: _.extend({}, LeafletHealpixLayerModel.prototype.defaults, {
+        _view_name: 'LeafletHealpixDensityLayerView',
+        _model_name: 'LeafletHealpixDensityLayerModel',
+
+        stat: 'count',
+        c_map: 1,
+        c_min_max: [],
+        fill_opacity: 0.6
+    })
+});
+
 var LeafletCirclesLayerModel = LeafletLayerModel.extend({
     defaults: _.extend({}, LeafletLayerModel.prototype.defaults, {
         _view_name: 'LeafletCirclesLayerView',
@@ -1480,10 +1519,12 @@ module.exports = {
     LeafletVoronoiLayerView: LeafletVoronoiLayerView,
     LeafletDelaunayLayerView: LeafletDelaunayLayerView,
     LeafletHealpixLayerView: LeafletHealpixLayerView,
+    LeafletHealpixDensityLayerView: LeafletHealpixDensityLayerView,
     LeafletCirclesLayerView: LeafletCirclesLayerView,
     // models
     LeafletCirclesLayerModel: LeafletCirclesLayerModel,
     LeafletHealpixLayerModel: LeafletHealpixLayerModel,
+    LeafletHealpixDensityLayerModel: LeafletHealpixDensityLayerModel,
     LeafletDelaunayLayerModel: LeafletDelaunayLayerModel,
     LeafletMstLayerModel: LeafletMstLayerModel,
     LeafletVoronoiLayerModel: LeafletVoronoiLayerModel,
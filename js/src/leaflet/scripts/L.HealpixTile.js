@@ -0,0 +1,94 @@
+var d3 = require("d3");
+L.HealpixTile = L.GridLayer.extend({
+
+    options: {
+        pane: 'overlayPane',
+        color: 'white',
+        lineWidth: 1,
+        // choropleth options, pixels are only filled if stat is given
+        stat: undefined,
+        cMap: 1,
+        cMinMax: [],
+        fillOpacity: 0.6,
+    },
+
+    initialize: function (url, options){
+        L.setOptions(this, options);
+        this._url = url;
+    },
+
+    createTile: function (coords, done){
+        var tile = L.DomUtil.create('div', 'leaflet-tile');
+        var that = this;
+        var tile_url = L.Util.template(this._url, {
+            x: coords.x,
+            y: coords.y,
+            z: coords.z
+        });
+
+        d3.json(tile_url, function (error, json){
+            if (error) {
+                done(error, tile);
+                return console.log(error);
+            }
+            // project the four vertices of each pixel into the tile
+            json.forEach(function (d){
+                var arr = [];
+                for (var i=0; i<4; i++){
+                    var latlng = new L.LatLng(d.dec[i], d.ra[i]);
+                    var point = that._map.project(latlng, coords.z);
+                    arr.push([point.x-coords.x*256, point.y-coords.y*256]);
+                }
+                d.pts = arr;
+            });
+            that._drawPolygons(json, tile);
+            done(null, tile);
+        });
+        return tile;
+    },
+
+    _drawPolygons: function (polys, tile){
+        var svg_pane = d3.select(tile).append('svg')
+            .attr('viewBox', '0 0 256 256')
+            .attr('fill', 'none')
+            .style('overflow', 'visible');
+
+        var paths = svg_pane.append('g').selectAll('path')
+            .data(polys)
+            .enter()
+            .append('path')
+            .attr('d', function (d){ return "M" + d.pts.join("L") + "Z";})
+            .attr('stroke', this.options.color)
+            .attr('stroke-width', this.options.lineWidth)
+            .attr('vector-effect', 'non-scaling-stroke');
+        this._fill(paths);
+    },
+
+    _fill: function (paths){
+        var stat = this.options.stat;
+        if (stat === undefined){
+            return;
+        }
+        var interpolate = d3.scaleSequential(L.SvgTile.prototype.colorMaps[this.options.cMap])
+            .domain(this.options.cMinMax);
+        paths.attr('fill', function (d){ return interpolate(d[stat]);})
+            .attr('fill-opacity', this.options.fillOpacity);
+    },
+
+    setColor: function (color){
+        this.options.color = color;
+        d3.select(this._container).selectAll('path').attr('stroke', color);
+    },
+
+    setFill: function (stat, cMap, cMinMax, fillOpacity){
+        this.options.stat = stat;
+        this.options.cMap = cMap;
+        this.options.cMinMax = cMinMax;
+        this.options.fillOpacity = fillOpacity;
+        this._fill(d3.select(this._container).selectAll('path'));
+    }
+});
+
+L.healpixTile = function (url, options){
+    return new L.HealpixTile(url, options);
+};
@@ -66,30 +66,6 @@ Delaunay = Voronoi.extend({
     },
 });
 
-Healpix = L.CusOverLay.Polygons.extend({
-
-    _drawSvg: function() {
-        L.CusOverLay.prototype._drawSvg.call(this, 'svg_h');
-    },
-
-	_projectData: function(json, map) {
-        var init_z = this.options.svgZoom;
-		var new_j = [];
-		// console.log(json);
-        json.forEach(function(d) {
-			var arr = [];
-			for (var i=0; i<4; i++){
-				var latlng = new L.LatLng(d.dec[i], d.ra[i]);
-	            var point = map.project(latlng, init_z);
-				arr.push([point.x, point.y]);
-			}
-			new_j.push(arr);
-        });
-
-        return new_j;
-    },
-});
-
 MST = L.CusOverLay.Lines.extend({
 	_drawSvg: function() {
         L.CusOverLay.prototype._drawSvg.call(this, 'svg_mst');
@@ -150,6 +150,37 @@ L.SvgTile = L.GridLayer.extend({
                     delete that._cTiles[d_key];
                 }
             },
+            refreshBoxes: function (boxes){
+                // reload tiles overlapping [xMin, yMin, xMax, yMax] boxes, all if none given
+                var key;
+                if (!this._map) { return; }
+                if (!boxes) {
+                    for (key in this._cTiles){
+                        this._removeCTile(key);
+                    }
+                    return this.redraw();
+                }
+                var bounds = boxes.map(function (b){
+                    return L.latLngBounds([b[1], b[0]], [b[3], b[2]]);
+                });
+                var that = this;
+                function overlaps(coords){
+                    var tileBounds = that._tileCoordsToBounds(coords);
+                    return bounds.some(function (b){ return b.intersects(tileBounds); });
+                }
+                for (key in this._cTiles){
+                    if (overlaps(this._keyToTileCoords(key))){
+                        this._removeCTile(key);
+                    }
+                }
+                for (key in this._tiles){
+                    if (overlaps(this._tiles[key].coords)){
+                        this._removeTile(key);
+                    }
+                }
+                this._update();
+            },
+
             _resetView: function (e) {
                 var animating = e && (e.pinch || e.flyTo);
                 this._setView(this._map.getCenter(), this._map.getZoom(), animating, animating);
@@ -140,7 +140,7 @@ setup_args = {
         'motor>=1.0', 'pandas', 'numpy', 'uuid', 'ipywidgets>=6.0.0',
         'requests', 'scipy', 'astropy==1.2.1', 'sklearn', 'healpy'
     ],
-    'packages': find_packages(),
+    'packages': find_packages(exclude=['tests']),
     'zip_safe': False,
     'cmdclass': {
         'build_py': js_prerelease(build_py),
@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+from vizic.sketch import QuantileSketch, CountPyramid
+
+
+def bins(values, level):
+    """Count values in bins of width ``2**level`` directly."""
+    return np.unique(np.floor(values/2.**level).astype(np.int64), return_counts=True)
+
+
+def test_merge_is_exact():
+    rng = np.random.RandomState(0)
+    # different spreads, so the sketches start at different widths
+    a = rng.normal(0., 1., 20000)
+    b = rng.normal(5., 30., 30000)
+    sketch = QuantileSketch().add(a)
+    other = QuantileSketch().add(b)
+    assert sketch.level != other.level
+    sketch.merge(other)
+    values = np.concatenate([a, b])
+    index, counts = bins(values, sketch.level)
+    assert np.array_equal(sketch.index, index)
+    assert np.array_equal(sketch.counts, counts)
+    assert sketch.count == len(values)
+    assert (sketch.min, sketch.max) == (values.min(), values.max())
+
+
+def test_merge_capped():
+    rng = np.random.RandomState(1)
+    parts = [rng.standard_cauchy(5000) for i in range(8)]
+    sketch = QuantileSketch(max_bins=512)
+    for part in parts:
+        sketch.merge(QuantileSketch(max_bins=512).add(part))
+    assert len(sketch.index) <= 512
+    index, counts = bins(np.concatenate(parts), sketch.level)
+    assert np.array_equal(sketch.index, index)
+    assert np.array_equal(sketch.counts, counts)
+
+
+def test_merge_order():
+    rng = np.random.RandomState(2)
+    parts = [rng.lognormal(0., s, 10000) for s in [0.1, 1., 2.]]
+    forward = QuantileSketch()
+    backward = QuantileSketch()
+    for part in parts:
+        forward.merge(QuantileSketch().add(part))
+    for part in parts[::-1]:
+        backward.merge(QuantileSketch().add(part))
+    assert forward.to_dict() == backward.to_dict()
+
+
+def test_quantile_against_percentile():
+    rng = np.random.RandomState(3)
+    parts = [rng.normal(m, 1., 20000) for m in [-3., 0., 4.]]
+    sketch = QuantileSketch()
+    for part in parts:
+        sketch.merge(QuantileSketch().add(part))
+    values = np.concatenate(parts)
+    q = np.linspace(0.01, 0.99, 99)
+    width = 2.**sketch.level
+    assert np.abs(sketch.quantile(q) - np.percentile(values, q*100)).max() < width
+    assert sketch.quantile(0.) == values.min()
+    assert sketch.quantile(1.) == values.max()
+
+
+def test_skips_nan():
+    sketch = QuantileSketch().add([1., np.nan, 2., np.inf, 3.])
+    assert sketch.count == 3
+    assert QuantileSketch().add([np.nan]).level is None
+    assert np.isnan(QuantileSketch().quantile(0.5))
+
+
+def test_dict_round_trip():
+    sketch = QuantileSketch().add(np.random.RandomState(4).normal(0., 1., 1000))
+    again = QuantileSketch.from_dict(sketch.to_dict())
+    assert again.to_dict() == sketch.to_dict()
+
+
+def objects(n, seed):
+    rng = np.random.RandomState(seed)
+    ra = rng.uniform(0., 360., n)
+    dec = rng.uniform(-90., 90., n)
+    b = 2.**rng.uniform(-12., -2., n)
+    return ra, dec, b
+
+
+def brute_count(ra, dec, b, box, min_b=0.):
+    (xMin, yMin, xMax, yMax) = box
+    return int(((ra >= xMin) & (ra < xMax) & (dec >= yMin) & (dec < yMax) & (b >= min_b)).sum())
+
+
+def cell_box(x0, y0, x1, y1, level):
+    """A box on the edges of cells at a level, from cell ``(x0, y0)`` to
+    cell ``(x1, y1)`` included."""
+    (w, h) = (360./2**level, 180./2**level)
+    return (x0*w, y0*h-90., (x1+1)*w, (y1+1)*h-90.)
+
+
+@pytest.mark.parametrize('cells', [(0, 0, 0, 0), (3, 5, 9, 20), (0, 0, 63, 63), (40, 10, 41, 62)])
+@pytest.mark.parametrize('min_b', [0., 2.**-8, 2.**-4])
+def test_count_aligned(cells, min_b):
+    # boxes on cell edges are counted exactly, and so are powers of two in size
+    ra, dec, b = objects(100000, 5)
+    counts = CountPyramid(level=6).add(ra, dec, b)
+    box = cell_box(*cells, level=6)
+    assert counts.count(box, min_b) == brute_count(ra, dec, b, box, min_b)
+
+
+def test_count_coarsened():
+    ra, dec, b = objects(50000, 6)
+    counts = CountPyramid(level=8, max_cells=256)
+    for i in range(0, len(ra), 10000):
+        counts.merge(CountPyramid(level=8, max_cells=256).add(ra[i:i+10000], dec[i:i+10000],
+                                                              b[i:i+10000]))
+    assert len(counts.keys) <= 256
+    assert counts.total() == len(ra)
+    box = cell_box(2, 3, 9, 12, counts.level)
+    assert counts.count(box) == brute_count(ra, dec, b, box)
+
+
+def test_count_estimate():
+    # boxes off cell edges are estimated from the area inside edge cells
+    ra, dec, b = objects(400000, 7)
+    counts = CountPyramid(level=5).add(ra, dec, b)
+    for box in [(12.3, -41.7, 97.1, 3.9), (200.2, 10.1, 251.9, 39.8)]:
+        n = brute_count(ra, dec, b, box)
+        assert abs(counts.count(box) - n) < 0.05*n
+
+
+def test_pyramid_merge():
+    ra, dec, b = objects(20000, 8)
+    whole = CountPyramid(level=7).add(ra, dec, b)
+    parts = CountPyramid(level=7).add(ra[:5000], dec[:5000], b[:5000])
+    parts.merge(CountPyramid(level=7).add(ra[5000:], dec[5000:], b[5000:]))
+    assert np.array_equal(parts.keys, whole.keys)
+    assert np.array_equal(parts.counts, whole.counts)
+    again = CountPyramid.from_dict(parts.to_dict())
+    assert np.array_equal(again.counts, whole.counts)
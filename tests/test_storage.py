@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+from vizic.storage import EmbeddedBackend, ColumnarBackend
+
+
+def make_chunk(n, seed):
+    """A formatted catalog chunk of random objects."""
+    rng = np.random.RandomState(seed)
+    b = 10**rng.uniform(-4, -1, n)
+    return pd.DataFrame({'RA': rng.uniform(0., 360., n),
+                         'DEC': np.degrees(np.arcsin(rng.uniform(-1., 1., n))),
+                         'a': b*rng.uniform(1., 3., n), 'b': b,
+                         'theta': rng.uniform(0., 180., n),
+                         'mag': rng.normal(20., 2., n),
+                         'name': ['obj{}'.format(seed*n + i) for i in range(n)]})
+
+
+@pytest.fixture
+def backends(tmpdir):
+    """An embedded and a columnar backend holding the same catalog,
+    ingested in two rounds of chunks."""
+    embedded = EmbeddedBackend(str(tmpdir.join('embedded')))
+    # a small block, so the columnar bucket sort runs over several blocks
+    columnar = ColumnarBackend(str(tmpdir.join('columnar')), block=1000)
+    for storage in [embedded, columnar]:
+        first_id = 0
+        for rank, seeds in [(1, [1, 2, 3]), (2, [4])]:
+            for seed in seeds:
+                chunk = make_chunk(2000, seed)
+                storage.insert('cat', chunk, rank, first_id)
+                first_id += chunk.shape[0]
+            storage.finalize('cat')
+    return embedded, columnar
+
+
+def by_name(records):
+    return sorted(records, key=lambda r: r['name'])
+
+
+def test_count(backends):
+    embedded, columnar = backends
+    assert embedded.count('cat') == columnar.count('cat') == 8000
+    assert embedded.count('missing') == columnar.count('missing') == 0
+
+
+@pytest.mark.parametrize('box', [(10., -20., 50., 15.), (0., -90., 360., 90.),
+                                 (359., 89., 360., 90.), (120.5, 3.2, 120.7, 3.3)])
+@pytest.mark.parametrize('min_b', [0., 1e-3])
+def test_box_parity(backends, box, min_b):
+    embedded, columnar = backends
+    found = embedded.box('cat', box, min_b)
+    assert by_name(found) == by_name(columnar.box('cat', box, min_b))
+    # and against a plain cut on all objects
+    df = embedded.scan('cat', ['RA', 'DEC', 'b', 'name'])
+    inside = ((df.RA >= box[0]) & (df.RA <= box[2]) & (df.DEC >= box[1]) &
+              (df.DEC <= box[3]) & (df.b >= min_b))
+    assert sorted(r['name'] for r in found) == sorted(df.name[inside])
+
+
+def test_box_exclude(backends):
+    box = (10., -20., 50., 15.)
+    for storage in backends:
+        records = storage.box('cat', box, 0., exclude=['theta', 'mag'])
+        assert len(records) > 0
+        assert set(records[0].keys()) == set(['RA', 'DEC', 'a', 'b', 'name', 'cat_rank'])
+
+
+def test_popup_parity(backends):
+    embedded, columnar = backends
+    df = embedded.scan('cat', ['RA', 'DEC', 'name'])
+    for i in [0, 17, 4321, 7999]:
+        (ra, dec) = (df.RA.iloc[i], df.DEC.iloc[i])
+        found = embedded.popup('cat', ra, dec)
+        assert [r['name'] for r in found] == [df.name.iloc[i]]
+        assert found == columnar.popup('cat', ra, dec)
+    assert embedded.popup('cat', 1e-7, 1e-7) == columnar.popup('cat', 1e-7, 1e-7) == []
+
+
+@pytest.mark.parametrize('dec_range', [None, (-30., 10.), (89., 91.)])
+def test_scan_parity(backends, dec_range):
+    embedded, columnar = backends
+    fields = ['RA', 'DEC', 'mag', 'name', 'cat_rank']
+    a = embedded.scan('cat', fields, dec_range)
+    b = columnar.scan('cat', fields, dec_range)
+    assert len(a) == len(b)
+    if dec_range is not None:
+        assert ((a.DEC >= dec_range[0]) & (a.DEC < dec_range[1])).all()
+    a = a[fields].sort_values('name').reset_index(drop=True)
+    b = b[fields].sort_values('name').reset_index(drop=True)
+    pd.testing.assert_frame_equal(a, b)
+
+
+def test_delete_rank_parity(backends):
+    embedded, columnar = backends
+    for storage in backends:
+        storage.delete_rank('cat', 2)
+        assert storage.count('cat') == 6000
+    box = (0., -90., 360., 90.)
+    assert by_name(embedded.box('cat', box, 0.)) == by_name(columnar.box('cat', box, 0.))
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+from vizic.utils import (tile_key, hilbert_key, tile_key_ranges, cluster_order, cut_mask,
+                         cut_tree)
+
+
+def cell_centers(level):
+    """RA and DEC at the center of every cell at a level, and the cells."""
+    n = 2**level
+    x, y = np.meshgrid(np.arange(n), np.arange(n))
+    (x, y) = (x.ravel(), y.ravel())
+    return (x+0.5)*360./n, (y+0.5)*180./n-90., x, y
+
+
+@pytest.mark.parametrize('level', [1, 2, 5, 8])
+def test_hilbert_adjacent(level):
+    ra, dec, x, y = cell_centers(level)
+    key = hilbert_key(ra, dec, level)
+    # every cell gets its own index
+    assert np.array_equal(np.sort(key), np.arange(4**level))
+    order = np.argsort(key)
+    step = np.abs(np.diff(x[order])) + np.abs(np.diff(y[order]))
+    assert (step == 1).all()
+
+
+def test_hilbert_nested():
+    # a cell holds the indices of its four children
+    ra, dec, x, y = cell_centers(6)
+    assert np.array_equal(hilbert_key(ra, dec, 6) >> 2, hilbert_key(ra, dec, 5))
+
+
+def test_cluster_order():
+    rng = np.random.RandomState(0)
+    ra = rng.uniform(0., 360., 1000)
+    dec = rng.uniform(-90., 90., 1000)
+    for order, key in [('hilbert', hilbert_key), ('morton', tile_key)]:
+        idx = cluster_order(ra, dec, order)
+        assert (np.diff(key(ra, dec)[idx]) >= 0).all()
+    with pytest.raises(Exception):
+        cluster_order(ra, dec, 'peano')
+
+
+def covered(keys, ranges):
+    low = np.array([r[0] for r in ranges])
+    high = np.array([r[1] for r in ranges])
+    i = np.searchsorted(low, keys, side='right') - 1
+    return (i >= 0) & (keys < high[np.maximum(i, 0)])
+
+
+@pytest.mark.parametrize('box', [(10., -20., 50., 15.), (0., -90., 360., 90.),
+                                 (359.9, 89.9, 360., 90.), (120.5, 3.2, 120.7, 3.3),
+                                 (0., -1., 1., 1.), (179., -89., 181., 89.)])
+@pytest.mark.parametrize('level', [16, 10])
+@pytest.mark.parametrize('max_cells', [1, 4, 64])
+def test_tile_key_ranges_cover(box, level, max_cells):
+    rng = np.random.RandomState(1)
+    (xMin, yMin, xMax, yMax) = box
+    ra = np.concatenate([rng.uniform(xMin, xMax, 2000), [xMin, xMax, xMin, xMax]])
+    dec = np.concatenate([rng.uniform(yMin, yMax, 2000), [yMin, yMax, yMax, yMin]])
+    ranges = tile_key_ranges(xMin, yMin, xMax, yMax, max_cells, level)
+    assert len(ranges) <= max_cells
+    # sorted, not overlapping and not touching
+    bounds = np.ravel(ranges)
+    assert (np.diff(bounds) > 0).all()
+    assert covered(tile_key(ra, dec, level), ranges).all()
+
+
+def test_tile_key_ranges_tight():
+    # the cover only holds cells touching the box
+    rng = np.random.RandomState(2)
+    # few enough cells at level 8, 1.4 by 0.7 degrees, to cover the box
+    ranges = tile_key_ranges(10., -20., 12., -18., max_cells=64, level=8)
+    ra = rng.uniform(0., 360., 100000)
+    dec = rng.uniform(-90., 90., 100000)
+    near = (ra > 10.-1.5) & (ra < 12.+1.5) & (dec > -20.-1.) & (dec < -18.+1.)
+    assert not covered(tile_key(ra[~near], dec[~near], 8), ranges).any()
+
+
+def old_cut_tree(mst_index, length, member):
+    """``cut_tree`` as it was written with pandas, the reference for
+    ``cut_mask``."""
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components as cp
+    index = mst_index
+    node_num = index[0].shape[0]+1
+    lines = pd.DataFrame({'row':index[0], 'col':index[1], 'val':index[2]})
+
+    cutted = lines[lines.val < length]  # get lines after cut
+    # make csr matrix for finding connected components
+    ccm = csr_matrix((cutted['val'].values,(cutted['row'].values, cutted['col'].values)),shape=(node_num, node_num))
+    labels = cp(ccm, directed=False)[1]  # find connected components and get labels
+
+    # sort out labels with small group members
+    s = pd.Series(labels)
+    df_s = s.reset_index(name='group')
+    gb = df_s.groupby('group')
+    df_rt = gb.count()
+    label_cnts = df_rt['index']
+    label_cnts = label_cnts[label_cnts < member+1]
+
+    rm_gps = label_cnts.index.values.tolist()
+    node_ls = df_s[df_s.group.isin(rm_gps)]['index'].tolist()
+    lines_rt = lines[(~lines.col.isin(node_ls))]
+    return lines_rt.index.values.tolist()
+
+
+@pytest.fixture(scope='module')
+def mst_index():
+    from scipy.sparse import find
+    from scipy.sparse.csgraph import minimum_spanning_tree
+    from scipy.spatial.distance import pdist, squareform
+    rng = np.random.RandomState(3)
+    # clusters of different sizes on a sparse background
+    points = [rng.normal(c, 0.05, (n, 2)) for c, n in [(0., 50), (1., 5), (2., 2)]]
+    points.append(rng.uniform(-1., 3., (40, 2)))
+    return find(minimum_spanning_tree(squareform(pdist(np.vstack(points)))))
+
+
+@pytest.mark.parametrize('length', [0.01, 0.1, 0.3, 10.])
+@pytest.mark.parametrize('member', [0, 1, 3, 10, 100])
+def test_cut_mask(mst_index, length, member):
+    expected = old_cut_tree(mst_index, length, member)
+    mask = cut_mask(mst_index, length, member)
+    assert mask.dtype == bool
+    assert np.flatnonzero(mask).tolist() == expected
+    assert cut_tree(mst_index, length, member) == expected
@@ -3,13 +3,18 @@ from traitlets import *
 from ipywidgets import *
 from .leaflet import Map, RasterLayer, Layer
 import pymongo as pmg
+import gridfs
 import pandas as pd
 import numpy as np
 import uuid
+from itertools import islice
 import json
-import requests
-from notebook.utils import url_path_join
-from .utils import cut_tree, get_mst, get_m_index, get_vert_bbox
+from .utils import (
+    cut_mask, pack_mask, get_mst, get_m_index, dump_m_index, load_m_index,
+    get_vert_bbox, get_center, bin_healpix_chunks, healpix_docs, url_path_join,
+    MemoryMonitor
+)
+from .sketch import estimate_count
 from .connection import Collection
 
 
@@ -135,6 +140,13 @@ class GridLayer(RasterLayer):
             catalog when size information is provided. Defaults to 2.
         scale_r(float): A float number indicating the scaling ratio for
             visualized objects. Defaults to 1.0.
+        percentiles(list): Lower and upper percentiles, e.g. ``[1, 99]``,
+            clipping the ranges used to color and filter objects. Defaults
+            to the full min/max.
+        keep_df(bool): Whether to keep ``df`` once it is ingested. With
+            False, the layer drops its reference to the dataframe once the
+            data is in the database, so the memory is released when no other
+            reference, e.g. a notebook variable, is left. Defaults to True.
 
     """
     _view_name = Unicode('LeafletGridLayerView').tag(sync=True)
@@ -143,6 +155,9 @@ class GridLayer(RasterLayer):
     bottom = Bool(False).tag(sync=True)
     _des_crs = List().tag(Sync=True)
     df = Instance(pd.DataFrame, allow_none=True)
+    keep_df = Bool(True, help='Keep the dataframe once ingested')
+    # resident memory of the kernel while ingesting df
+    memory = Dict(help='Start, peak and end resident memory in bytes, and the ingestion order')
     min_zoom = Int(0).tag(sync=True, o=True)
     max_zoom = Int(8).tag(sync=True, o=True)
     # tile_size = Int(256).tag(sync=True, o=True)
@@ -161,6 +176,7 @@ class GridLayer(RasterLayer):
     df_rad = Int(2).tag(sync=True, o=True)
     scale_r = Float(1.0).tag(sync=True, o=True)
     c_lock = Bool(False, help='Lock on objects coloring method.').tag(sync=True)
+    cat_ct = Int(1, help='Number of additions to the catalog').tag(sync=True, o=True)
 
     # color by catalogs
     c_by_c = Bool(False, help='Color the map by different catalogs').tag(sync=True, o=True)
@@ -170,7 +186,13 @@ class GridLayer(RasterLayer):
     filter_range = List().tag(sync=True)
     center = List().tag(sync=True)
     obj_catalog = Instance(pd.Series, allow_none=True)
+    # clip color and filter ranges to percentiles
+    percentiles = List(help='Lower and upper percentiles bounding color and filter ranges')
+    # warn before fetching bigger selections
+    selection_warn = Int(1000000, help='Estimated size of selections warned about')
     __minMax = {}
+    __sketches = {}
+    __counts = None
     _popup_callbacks = Instance(CallbackDispatcher, ())
 
     @observe('c_by_c')
@@ -201,7 +223,7 @@ class GridLayer(RasterLayer):
     @observe('c_field')
     def _update_c_min_max(self, change):
         if self.custom_c is True and self.c_field in self.get_fields():
-            self.c_min_max = self.__minMax[change['new']]
+            self.c_min_max = self.get_range(change['new'])
         elif self.custom_c is False and change['new'] == '':
             pass
         else:
@@ -211,7 +233,7 @@ class GridLayer(RasterLayer):
     @observe('filter_obj')
     def _update_filter(self, change):
         if change['new'] is True and self.filter_property in self.get_fields():
-            self.filter_range = self.__minMax[self.filter_property]
+            self.filter_range = self.get_range(self.filter_property)
         elif change['new'] is False:
             self.filter_range = []
             # self.filter_property = ''
@@ -219,10 +241,17 @@ class GridLayer(RasterLayer):
     @observe('filter_property')
     def _update_property(self, change):
         if self.filter_obj is True and self.filter_property in self.get_fields():
-            self.filter_range = self.__minMax[change['new']]
+            self.filter_range = self.get_range(change['new'])
         elif self.filter_property not in self.get_fields():
             self.filter_property = ''
 
+    @observe('percentiles')
+    def _update_percentiles(self, change):
+        if self.custom_c is True and self.c_field in self.get_fields():
+            self.c_min_max = self.get_range(self.c_field)
+        if self.filter_obj is True and self.filter_property in self.get_fields():
+            self.filter_range = self.get_range(self.filter_property)
+
     def __init__(self, connection, coll_name=None, map_dict=None, **kwargs):
         """
         Args:
@@ -237,14 +266,17 @@ class GridLayer(RasterLayer):
         except:
             raise Exception('Mongodb connection error! Check connection object!')
 
-        if map_dict is not None:
-            for k in map_dict.keys():
-                self.df[k] = self.df[map_dict[k]]
-
         self.connection = connection
         self._server_url = connection._url
-        self._checkInput(coll_name, map_dict)
-        self.push_data(self._server_url)
+        ingest = self.collection == '' and self.df is not None
+        with MemoryMonitor() as monitor:
+            self._checkInput(coll_name, map_dict)
+        if ingest:
+            self.memory = dict(monitor.report(), order=connection.ingest.order)
+            self._print_memory()
+            if not self.keep_df:
+                self.df = None
+        self._push_meta()
         self._popup_callbacks.register_callback(self._query_obj, remove=False)
         self.on_msg(self._handle_leaflet_event)
 
@@ -266,39 +298,26 @@ class GridLayer(RasterLayer):
         """
 
         coll = Collection()
-        exist_colls = self.db.collection_names()
+        exist_colls = self.connection.show_catalogs(self.connection.storage.db_name)
 
         if not self.collection == '':
             if self.collection not in exist_colls:
                 raise Exception('Provided collection does not exist!')
             coll = self.connection.read_meta(self.collection)
         elif self.df is not None:
-            clms = [x.upper() for x in list(self.df.columns)]
-
-            if not set(['RA', 'DEC']).issubset(set(clms)):
-                raise Exception("RA, DEC is required for visualization!")
-            if not set(['A_IMAGE', 'B_IMAGE', 'THETA_IMAGE']).issubset(set(clms)):
-                print('No shape information provided')
-                if 'RADIUS' in clms:
-                    print('Will use radius for filtering!')
-                    coll.radius = True
-                else:
-                    print('Object as point, slow performance!')
-                    coll.point = True
+            # mapped columns go to a copy, self.df is left as given
+            df = self.connection._map_columns(self.df, map_dict)
+            self.connection._check_columns(df, coll)
 
             if coll_name is not None and coll_name in exist_colls:
                 raise Exception('Collectoin name already exists, try to use a different name or use existing collection.')
-            df_r, coll._des_crs = self.connection._data_prep(self.df, coll)
+            df_r, coll._des_crs = self.connection._data_prep(df, coll)
+            del df
             coll.x_range = coll._des_crs[2]*256
             coll.y_range = coll._des_crs[3]*256
 
             # drop created mapped columns before ingecting data
-            if map_dict is not None:
-                col_keys = [x.upper() for x in map_dict.keys()
-                            if x.upper() not in ['RA', 'DEC']]
-                df_r.drop(col_keys,axis=1, inplace=True)
-                for k in col_keys:
-                    coll._minMax.pop(k, None)
+            self.connection._drop_mapped(df_r, coll, map_dict)
 
             # check if name given, if not using uuid
             if coll_name is not None:
@@ -311,13 +330,31 @@ class GridLayer(RasterLayer):
         else:
             raise Exception('Need to provide a collection name or a pandas dataframe!')
 
-        # now assign collection object values to GridLayer
+        self._assign_coll(coll)
+
+    def _print_memory(self):
+        """Private method printing the kernel memory used by the ingestion."""
+        mb = 2.**20
+        (start, peak) = (self.memory['start'], self.memory['peak'])
+        if peak is None:
+            return
+        order = self.memory['order'] or 'input'
+        if start is None:
+            print('Peak memory {:.1f} MB, rows in {} order'.format(peak/mb, order))
+        else:
+            print('Peak memory {:.1f} MB, {:.1f} MB above start, rows in {} order'.format(
+                peak/mb, (peak-start)/mb, order))
+
+    def _assign_coll(self, coll):
+        """Assign meta information in a collection object to the layer."""
         self._des_crs = coll._des_crs
         self.x_range = coll.x_range
         self.y_range = coll.y_range
         self.point = coll.point
         self.radius = coll.radius
         self.__minMax = coll._minMax
+        self.__sketches = coll._sketches
+        self.__counts = coll._counts
         self.cat_ct = coll.cat_ct
         self.collection = coll.name
 
@@ -328,10 +365,15 @@ class GridLayer(RasterLayer):
         """Update server extension with newly displayed catalog.
 
         Send basic information of this tileLayer using Rest API to the server
-        for directing data request from the front-end.
+        for directing data request from the front-end. The request is sent
+        in the background over the connection's server client.
 
         Args:
-            url(str): The Jupyter server address.
+            url(str): The Jupyter server address, which the server client
+                of the connection already points to.
+
+        Returns:
+            A ``concurrent.futures.Future`` for the response.
         """
 
         mRange = (self.x_range + self.y_range)/2
@@ -340,23 +382,43 @@ class GridLayer(RasterLayer):
             'mrange': mRange,
             'maxzoom': self.max_zoom
         }
-        push_url = url_path_join(url, '/rangeinfo/')
-        req = requests.post(push_url, data=body)
+        return self.connection.server.submit('POST', '/rangeinfo/', data=body)
+
+    def _push_meta(self):
+        """Private method pushing the layer to the server and waiting for it,
+        so that tiles are only requested once the server knows the catalog.
+
+        Raises:
+            Exception: If the server did not accept it.
+        """
+        res = self.push_data(self._server_url).result()
+        if res.status_code != 200:
+            raise Exception('Server failed to register {} ({})!'.format(self.collection, res.status_code))
 
     def update_meta(self):
-        """Update meta information after new data added."""
+        """Update meta information after new data added.
 
-        coll = self.connection.read_meta(self.collection)
-        self._des_crs = coll._des_crs
-        self.x_range = coll.x_range
-        self.y_range = coll.y_range
-        self.__minMax = coll._minMax
-        self.cat_ct = coll.cat_ct
-        # update info at Jupyter server
-        self.push_data(self._server_url)
+        If the extent of the catalog is unchanged, only the tiles overlapping
+        the recorded changes since the layer was last updated are reloaded,
+        otherwise all tiles are.
+        """
+        old_ct = self.cat_ct
+        coll = self._read_meta()
+        changes = [c for c in coll._changes if c['catCt'] > old_ct]
+        self._assign_coll(coll)
+        # update info at Jupyter server before tiles are reloaded
+        self._push_meta()
         # update the AstroMap meta
-        self._map.center = self.center = [self._des_crs[1]-self.y_range/2, self._des_crs[0]+self.x_range/2]
+        self._map.center = self.center
         self._map._des_crs = self._des_crs
+        boxes = None
+        if len(changes) == coll.cat_ct - old_ct and not any(c['extent'] for c in changes):
+            boxes = [b for c in changes for b in c['boxes']]
+        self.send({'method': 'refresh', 'boxes': boxes})
+
+    def _read_meta(self):
+        """Private method reading the meta information of the catalog."""
+        return self.connection.read_meta(self.collection)
 
     def _handle_leaflet_event(self, _, content, buffers):
         """Handle leaflet events trigged."""
@@ -366,8 +428,7 @@ class GridLayer(RasterLayer):
     def _query_obj(self, **kwargs):
         """Query database for clicked object."""
         body = {'coll': self.collection,'RA': kwargs['RA'], 'DEC': kwargs['DEC']}
-        popup_url = url_path_join(self._server_url, '/objectPop/')
-        result = requests.get(popup_url, data=body)
+        result = self.connection.server.get('/objectPop/', data=body)
         pop_dict = json.loads(result.text[1:-1])
         self.obj_catalog = pd.Series(pop_dict)
 
@@ -391,6 +452,92 @@ class GridLayer(RasterLayer):
         else:
             raise Exception('Error: {} not in database!'.format(field))
 
+    def _get_sketch(self, field):
+        """Private method returning the sketch of a property."""
+        field = field.upper()
+        if field not in self.__sketches:
+            raise Exception('Error: no distribution of {} in database!'.format(field))
+        return self.__sketches[field]
+
+    def get_percentiles(self, field, lower=1., upper=99.):
+        """Return the values of a catalog property at two percentiles.
+
+        Percentiles are read from the sketch made at ingestion, without
+        querying the catalog, and are off by less than 1/256 of the range
+        of the property.
+
+        Args:
+            field: The name of the specified property.
+            lower(float): The lower percentile. Defaults to 1.
+            upper(float): The upper percentile. Defaults to 99.
+
+        Raises:
+            Exception: If the catalog has no sketch of the property.
+        """
+        return self._get_sketch(field).percentile_range(lower, upper)
+
+    def get_histogram(self, field, bins=64, range=None):
+        """Return a histogram of a catalog property.
+
+        Args:
+            field: The name of the specified property.
+            bins(int): Number of bins. Defaults to 64.
+            range(list): The lower and upper edge of the bins. Defaults to
+                the 0.5 and 99.5 percentiles.
+
+        Returns:
+            A dictionary with the ``range`` and the ``counts`` in each bin,
+            and the number of objects ``below`` and ``above`` the range.
+
+        Raises:
+            Exception: If the catalog has no sketch of the property.
+        """
+        return self._get_sketch(field).histogram(bins, range)
+
+    def get_range(self, field):
+        """Return the range used to color and filter by a property.
+
+        This is the range between ``percentiles`` when set and the property
+        is sketched, so that a few outliers don't stretch the color map,
+        otherwise the min/max.
+
+        Args:
+            field: The name of the specified property.
+        """
+        if len(self.percentiles) == 2 and field.upper() in self.__sketches:
+            return self.get_percentiles(field, *self.percentiles)
+        return self.get_min_max(field)
+
+    def estimate_count(self, box=None, zoom=None, filters=None):
+        """Estimate the number of objects in a box, without a query.
+
+        The estimate comes from the count pyramid and field sketches made at
+        ingestion, see ``vizic.sketch.estimate_count``.
+
+        Args:
+            box(tuple): The smallest and largest ``RA`` and ``DEC``. Defaults
+                to the whole catalog.
+            zoom(int): Count only objects drawn at this zoom level, all
+                objects by default.
+            filters(dict): Lower and upper bound for fields. Defaults to the
+                filter of the layer when filtering.
+
+        Returns:
+            float: The estimated count, None for catalogs imported by earlier
+                versions.
+        """
+        if self.__counts is None:
+            return None
+        if box is None:
+            box = (self._des_crs[0], self._des_crs[1]-self.y_range,
+                   self._des_crs[0]+self.x_range, self._des_crs[1])
+        if filters is None and self.filter_obj and len(self.filter_range) == 2:
+            filters = {self.filter_property: self.filter_range}
+        min_b = 0.
+        if zoom is not None:
+            min_b = (self.x_range + self.y_range)/2/(256*2**int(zoom))*0.3
+        return estimate_count(self.__counts, self.__sketches, box, min_b, filters)
+
     def _query_selection(self):
         """Query selected objects.
 
@@ -398,9 +545,12 @@ class GridLayer(RasterLayer):
         frond-end. The query result is parsed into a pandas dataframe and
         assigned to ``select_data`` attribute.
         """
-        selection_url = url_path_join(self._server_url, '/selection/')
         if self._map.s_bounds != []:
             bounds = self._map.s_bounds
+            n = self.estimate_count((bounds[0], bounds[2], bounds[1], bounds[3]),
+                                    self.max_zoom, {})
+            if n is not None and n > self.selection_warn:
+                print('Selection holds about {:.0f} objects, this may take a while.'.format(n))
             body = {
                 'coll': self.collection,
                 'swlng': bounds[0],
@@ -408,13 +558,102 @@ class GridLayer(RasterLayer):
                 'nelng': bounds[1],
                 'nelat': bounds[3],
             }
-            res = requests.get(selection_url, data=body)
+            res = self.connection.server.get('/selection/', data=body)
             selection_dict = json.loads(res.text)
             self.select_data = pd.DataFrame(selection_dict)
         else:
             print('bounds for selection is empty')
 
 
+class CompositeLayer(GridLayer):
+    """Several stored catalogs shown as one tileLayer.
+
+    Each tile of all catalogs is fetched in one request, the server querying
+    the catalogs concurrently and returning their objects together, so
+    stacking N catalogs costs one request per tile instead of N. Objects
+    carry ``catalog``, the name of their catalog, in tiles and selections
+    alike, and ``cat_rank`` follows on across catalogs, so ``c_by_c`` colors
+    each catalog, and each addition to it, apart. Selections and popups
+    cover all catalogs. The catalogs must all be drawn the same way, with
+    shapes, radii or as points. The composite is stored with the catalogs,
+    so it is served again after the server restarts.
+
+    Keyword Args:
+        collections(list): The names of the catalog collections.
+        Other keyword arguments are as for ``GridLayer``.
+    """
+    collections = List()
+
+    def __init__(self, connection, collections, name=None, **kwargs):
+        """
+        Args:
+            connection: A wrapper for MongoDB connections.
+            collections(list): The names of the catalog collections.
+            name(str): The name the composite is served by. Defaults to a
+                name generated by ``uuid``.
+            **kwargs: Arbitrary keyword arguments.
+        """
+        kwargs['collections'] = list(collections)
+        super(CompositeLayer, self).__init__(connection, name, **kwargs)
+
+    def _checkInput(self, coll_name, map_dict):
+        """Read and combine the meta information of the catalogs."""
+        if len(self.collections) < 2:
+            raise Exception('A composite layer needs at least two catalogs!')
+        exist_colls = self.connection.show_catalogs(self.connection.storage.db_name)
+        for name in self.collections:
+            if name not in exist_colls:
+                raise Exception('Provided collection {} does not exist!'.format(name))
+        coll = self._read_meta()
+        if coll_name is not None:
+            coll.name = coll_name
+        elif self.collection != '':
+            coll.name = self.collection
+        else:
+            coll.name = 'composite-{}'.format(uuid.uuid4())
+        self._assign_coll(coll)
+
+    def _read_meta(self):
+        """Private method combining the meta information of the catalogs."""
+        colls = [self.connection.read_meta(x) for x in self.collections]
+        for c in colls[1:]:
+            if (c.radius, c.point) != (colls[0].radius, colls[0].point):
+                raise Exception('Catalogs of a composite layer must all be drawn with shapes, radii or as points!')
+        coll = colls[0]
+        for c in colls[1:]:
+            self.connection._merge_coll(coll, c)
+        coll.cat_ct = sum(c.cat_ct for c in colls)
+        coll.name = self.collection
+        # changes of members aren't tracked, tiles are all reloaded
+        coll._changes = []
+        return coll
+
+    def push_data(self, url):
+        """Store the composite and register it with the server extension.
+
+        Args:
+            url(str): The Jupyter server address, which the server client
+                of the connection already points to.
+
+        Returns:
+            A ``concurrent.futures.Future`` for the response.
+        """
+        # stored so that the server serves the composite after a restart
+        self.connection.storage.save_composite(self.collection, {
+            'members': self.collections, 'adjust': self._des_crs,
+            'xRange': self.x_range, 'yRange': self.y_range})
+        body = {
+            'collection': self.collection,
+            'members': json.dumps(self.collections),
+            'adjust': json.dumps(self._des_crs),
+            'xrange': self.x_range,
+            'yrange': self.y_range,
+            'mrange': (self.x_range + self.y_range)/2,
+            'maxzoom': self.max_zoom
+        }
+        return self.connection.server.submit('POST', '/composite/', data=body)
+
+
 class VoronoiLayer(Layer):
     """Voronoi Diagram Layer.
 
@@ -498,6 +737,11 @@ class HealpixLayer(Layer):
     Using the catalog data displayed by a given tileLayer to compute
     and display Healpix pixelization grid.
 
+    The grid is stored one document per pixel for ``nside`` and each coarser
+    resolution (halving ``nside``) down to a handful of pixels. Tiles are
+    served with only the pixels in view, at a resolution picked for the
+    zoom level.
+
     Keyword Args:
         color(str): Color for the overlayed Healpix grid. Defaults to white.
         svg_zoom(int): Initial zoom for projecting Healpix grid onto the screen.
@@ -534,26 +778,155 @@ class HealpixLayer(Layer):
         if 'nest' in kwargs:
             self.nest = bool(kwargs["nest"])
         # '_id' field for this particular healpix grid data in Mongodb
-        document_id = gridLayer.collection+'_'+str(self.nside)+'_'+str(self.nest)
+        document_id = self._document_id(gridLayer)
         try:
             self.db = gridLayer.db
         except:
             raise Exception('Mongodb connection error! Check connection object!')
+        if self.db is None:
+            raise Exception('HealpixLayer requires the mongo storage backend!')
         # print(self.collection)
+        # grids stored in a single document are computed again
+        self.db['healpix'].delete_one({'_id':document_id, 'levels':{'$exists':False}})
         if self.db['healpix'].find({'_id':document_id}).count() < 1:
             self.inject_data(gridLayer, document_id)
 
         self._server_url = gridLayer._server_url
-        self._healpix_url = url_path_join(self._server_url, '/healpix/{}.json'.format(document_id))
+        self._healpix_url = url_path_join(self._server_url, '/healpix/{}/{{z}}/{{x}}/{{y}}.json'.format(document_id))
+
+    def _document_id(self, gridLayer):
+        """The '_id' of the stored grid for given catalog and resolution."""
+        return gridLayer.collection+'_'+str(self.nside)+'_'+str(self.nest)
 
     def inject_data(self, gridLayer, document_id):
         """Import computed Healpix grid into the database"""
         # [xmin, xmax, ymin, ymax]
         self.bbox = [gridLayer._des_crs[0],gridLayer._des_crs[1]-gridLayer.y_range, gridLayer._des_crs[0]+gridLayer.x_range, gridLayer._des_crs[1]]
-        all_v = get_vert_bbox(self.bbox[0], self.bbox[1], self.bbox[2], self.bbox[3], self.nside, self.nest)
-        polys = [{'ra':x[0].tolist(), 'dec': x[1].tolist()} for x in all_v]
-        # inject data into mongodb
-        self.db['healpix'].insert_one({'_id':document_id, 'data':polys})
+        pix_coll = self.db['healpix_pix']
+        pix_coll.delete_many({'grid':document_id})
+
+        levels = []
+        nside = self.nside
+        while nside >= 1:
+            pix, ra, dec = get_vert_bbox(self.bbox[0], self.bbox[1], self.bbox[2], self.bbox[3], nside, self.nest)
+            if pix.shape[0] == 0:
+                break
+            ra_c, dec_c = get_center(pix, nside, self.nest)
+            # flat vertices, four per pixel
+            ra = ra.reshape(-1, 4).tolist()
+            dec = dec.reshape(-1, 4).tolist()
+            docs = [{'grid':document_id, 'nside':nside, 'pix':p, 'loc':[x, y],
+                     'ra':r, 'dec':d}
+                    for p, x, y, r, d in zip(pix.tolist(), ra_c.tolist(), dec_c.tolist(), ra, dec)]
+            # inject data into mongodb
+            pix_coll.insert_many(docs, ordered=False)
+            levels.append(nside)
+            if pix.shape[0] < 4:
+                break
+            nside //= 2
+
+        pix_coll.create_index([('loc', pmg.GEO2D), ('grid', pmg.ASCENDING), ('nside', pmg.ASCENDING)], name='geo_loc_grid', min=-90, max=360)
+        self.db['healpix'].insert_one({'_id':document_id, 'coll':gridLayer.collection, 'nside':self.nside, 'nest':self.nest, 'levels':levels})
+
+
+class HealpixDensityLayer(HealpixLayer):
+    """Healpix density and property-aggregate Layer.
+
+    Bins the catalog displayed by a given tileLayer into Healpix pixels and
+    shows the object counts, or the mean/median of a catalog property, per
+    pixel as a choropleth. Only non-empty pixels are stored, and the result
+    is cached per catalog, ``nside``, ``nest`` and ``field``.
+
+    Keyword Args:
+        color(str): Color for the pixel outlines. Defaults to white.
+        nside(int) : Healpix resolution used for binning, dafaults to 64.
+        nest(bool): Pixelization schema, True: Nested Schema, False: Ring
+            Schema. Defaults to True.
+        field(str): The float property to aggregate. Defaults to none, in
+            which case only counts are available.
+        stat(str): The value shown, one of ``count``, ``mean`` and
+            ``median``. Defaults to ``count``.
+        c_map(int): Colormap used for the choropleth, see ``ColorMap``.
+            Defaults to 1 (Spectral).
+        fill_opacity(float): Opacity of the filled pixels. Defaults to 0.6.
+        chunk_size(int): Number of objects read from the database and
+            binned at a time. Defaults to 100000.
+    """
+    _view_name = Unicode('LeafletHealpixDensityLayerView').tag(sync=True)
+    _model_name = Unicode('LeafletHealpixDensityLayerModel').tag(sync=True)
+    nside = Int(64)
+    field = Unicode()
+    stat = Unicode('count').tag(sync=True, o=True)
+    c_map = Int(1).tag(sync=True, o=True)
+    c_min_max = List().tag(sync=True, o=True)
+    fill_opacity = Float(0.6).tag(sync=True, o=True)
+    chunk_size = Int(100000, help='Objects read and binned at a time')
+
+    def __init__(self, gridLayer, **kwargs):
+        """
+        Args:
+            gridLayer: A gridLayer instance.
+            **kwargs: Arbitrary keyword arguments.
+
+        Raises:
+            Exception: If the field is not a float property of the catalog.
+        """
+        field = kwargs.pop('field', '').upper()
+        if field != '' and field not in list(gridLayer.get_fields()):
+            raise Exception('Error: {} not in database!'.format(field))
+        self.field = field
+        super(HealpixDensityLayer, self).__init__(gridLayer, **kwargs)
+        grid = self.db['healpix'].find_one({'_id': self._document_id(gridLayer)}, {'range': 1})
+        self._ranges = grid['range']
+        self.c_min_max = self._ranges[self.stat]
+
+    @validate('stat')
+    def _valid_stat(self, proposal):
+        stats = ['count'] if self.field == '' else ['count', 'mean', 'median']
+        if proposal['value'] not in stats:
+            raise TraitError('stat must be one of {}'.format(stats))
+        return proposal['value']
+
+    @observe('stat')
+    def _update_stat(self, change):
+        if hasattr(self, '_ranges'):
+            self.c_min_max = self._ranges[change['new']]
+
+    def _document_id(self, gridLayer):
+        """The '_id' of the stored aggregate for given catalog, resolution
+        and field."""
+        return '{}_{}_{}_density_{}'.format(gridLayer.collection, self.nside, self.nest, self.field)
+
+    def _read_chunks(self, coll_name, proj):
+        """Private generator reading a catalog ``chunk_size`` rows at a
+        time."""
+        cursor = self.db[coll_name].find({}, proj, batch_size=self.chunk_size)
+        while True:
+            rows = list(islice(cursor, self.chunk_size))
+            if len(rows) == 0:
+                break
+            yield pd.DataFrame(rows)
+
+    def inject_data(self, gridLayer, document_id):
+        """Bin the catalog and import the aggregates into the database"""
+        proj = {'_id': 0, 'RA': 1, 'DEC': 1}
+        if self.field != '':
+            proj[self.field] = 1
+        agg = bin_healpix_chunks(self._read_chunks(gridLayer.collection, proj),
+                                 self.nside, self.nest, self.field)
+
+        stats = [x for x in ['count', 'mean', 'median'] if x in agg]
+        docs = healpix_docs(document_id, self.nside, self.nest, agg)
+
+        pix_coll = self.db['healpix_pix']
+        pix_coll.delete_many({'grid':document_id})
+        if len(docs) > 0:
+            pix_coll.insert_many(docs, ordered=False)
+        pix_coll.create_index([('loc', pmg.GEO2D), ('grid', pmg.ASCENDING), ('nside', pmg.ASCENDING)], name='geo_loc_grid', min=-90, max=360)
+        ranges = {x: [float(agg[x].min()), float(agg[x].max())] if len(docs) > 0 else [0, 1]
+                  for x in stats}
+        levels = [self.nside] if len(docs) > 0 else []
+        self.db['healpix'].insert_one({'_id':document_id, 'coll':gridLayer.collection, 'nside':self.nside, 'nest':self.nest, 'field':self.field, 'levels':levels, 'range':ranges})
 
 
 class CirclesOverLay(Layer):
@@ -599,6 +972,8 @@ class CirclesOverLay(Layer):
             self.db = gridLayer.db
         except:
             raise Exception('Mongodb connection error! Check connection object!')
+        if self.db is None:
+            raise Exception('CirclesOverLay requires the mongo storage backend!')
         self.document_id = name
 
         if self.db['circles'].find({'_id':name}).count() < 1:
@@ -641,7 +1016,7 @@ class MstLayer(Layer):
     visible = Bool(False).tag(sync=True)
     color = Unicode('#0459e2').tag(sync=True, o=True)
     svg_zoom = Int(5).tag(sync=True, o=True)
-    line_idx = List().tag(sync=True)
+    line_mask = Bytes(help='Packed bitmask of saved edges').tag(sync=True)
     _cut_count = Int(0).tag(sync=True)
 
     def __init__(self, gridLayer, neighbors=15, **kwargs):
@@ -666,6 +1041,8 @@ class MstLayer(Layer):
             self.db = gridLayer.db
         except:
             raise Exception('Mongodb connection error! Check connection object!')
+        if self.db is None:
+            raise Exception('MstLayer requires the mongo storage backend!')
         self.document_id = gridLayer.collection
 
         if self.db['mst'].find({'_id':self.document_id}).count() < 1:
@@ -679,29 +1056,52 @@ class MstLayer(Layer):
     def inject_data(self, neighbors):
         """Calculate and import MST data into the database."""
         coll = self.db[self.document_id]
-        cur_ls = list(coll.find({'_id':{'$ne':'meta'}},{'_id':0,'RA':1,'DEC':1}))
+        cur_ls = list(coll.find({},{'_id':0,'RA':1,'DEC':1}))
         df_pos = pd.DataFrame(cur_ls)
         m, index = get_mst(df_pos, neighbors)
         self.index = index
         mst_lines = m.to_dict(orient='records')
         self.db['mst'].insert_one({'_id':self.document_id, 'tree':mst_lines})
+        self._save_index()
 
     def get_index(self):
-        """Retrive the index of the saved MST matrix"""
+        """Retrive the index of the saved MST matrix.
+
+        The index is read from its binary copy in GridFS. MSTs saved without
+        one are rebuilt from the stored edges once, and cached afterwards.
+        """
+        fs = gridfs.GridFS(self.db, collection='mst_index')
+        grid_out = fs.find_one({'filename': self.document_id})
+        if grid_out is not None:
+            self.index = load_m_index(grid_out.read())
+            return
+
         coll = self.db['mst']
         cur_ls = list(coll.find({'_id':self.document_id}))
         # lines_ls = cur_ls['tree']
         df_pos = pd.DataFrame(cur_ls[0]['tree'])
         self.index = get_m_index(df_pos)
+        self._save_index()
+
+    def _save_index(self):
+        """Store the index of the MST matrix in GridFS as ``.npy`` bytes."""
+        fs = gridfs.GridFS(self.db, collection='mst_index')
+        for grid_out in fs.find({'filename': self.document_id}):
+            fs.delete(grid_out._id)
+        fs.put(dump_m_index(self.index), filename=self.document_id)
 
     def cut(self, length, members):
         """Cut the MST.
 
+        The saved edges are sent to the front-end as a packed bitmask in a
+        binary buffer, one bit per edge.
+
         Args:
             length(float): Maximum edge length.
             members(int): The minimum number of edges in each saved branch.
         """
-        self.line_idx = cut_tree(self.index, length, members)
+        self.mask = cut_mask(self.index, length, members)
+        self.line_mask = pack_mask(self.mask)
         self.max_len = float(length)
         self._cut_count += 1
 
@@ -1,10 +1,24 @@
 from __future__ import print_function
+import concurrent.futures as cfs
+import multiprocessing
+import os
+import time
+import warnings
+from collections import deque
 import requests
-from pymongo.errors import AutoReconnect, ConnectionFailure
-from notebook.utils import url_path_join
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from pymongo.errors import ConnectionFailure
 import numpy as np
 import pandas as pd
 import pymongo as pmg
+from .storage import MongoBackend, EmbeddedBackend, ColumnarBackend
+from .storage.mongo import INDEXES
+from .utils import (
+    cluster_order, match_positions, tile_key, tile_key_boxes, url_path_join,
+    CHANGE_LEVEL
+)
+from .sketch import QuantileSketch, CountPyramid
 
 
 class Collection(object):
@@ -17,7 +31,146 @@ class Collection(object):
         self.x_range = 0
         self.y_range = 0
         self._minMax = {}
+        self._sketches = {}
+        self._counts = CountPyramid()
+        self._touched = np.zeros(0, dtype=np.int64)
+        self._changes = []
         self.cat_ct = 1
+        self.index = '2d'
+        self.stats = {}
+
+
+class IngestConfig(object):
+    """Settings for ingesting catalogs into the database.
+
+    Attributes:
+        chunk_size(int): Number of rows inserted per chunk. Defaults to
+            100000.
+        workers(int): Number of chunks inserted concurrently, each over its
+            own pooled connection. Defaults to 4.
+        retries(int): Number of times a chunk is retried after a network
+            error. Defaults to 3.
+        checkpoint(int): Number of landed chunks recorded in the ingestion
+            manifest at a time, so that an interrupted ingestion can be
+            resumed. Defaults to 1.
+        progress: A callable taking the number of inserted rows and the
+            total, called whenever a chunk lands. Defaults to None.
+        index(str): Index strategy for new catalogs, one of ``2d`` (a 2d
+            index on ``loc`` and one on ``b``), ``2d_compound`` (a compound
+            2d index on ``loc`` and ``b``), ``2dsphere`` (a compound
+            2dsphere index on a GeoJSON ``sky`` point and ``b``) and
+            ``tilekey`` (a compound index on the Morton key of the position
+            and the first zoom level an object is drawn at). Defaults to
+            ``2d``.
+        index_build(str): ``after`` to build indexes once all data is
+            loaded, or ``before`` to build them on the empty collection.
+            Defaults to ``after``.
+        index_background(bool): Build indexes in the background, without
+            locking the database. Defaults to True.
+        order(str): Sort rows along a space filling curve over ``RA`` and
+            ``DEC`` before inserting them, ``hilbert`` or ``morton``, so
+            objects close on the sky are stored close on disk and tile
+            queries read fewer pages. When streaming from a file each chunk
+            read is sorted on its own. Defaults to None, keeping the input
+            order.
+    """
+
+    def __init__(self):
+        self.chunk_size = 100000
+        self.workers = 4
+        self.retries = 3
+        self.checkpoint = 1
+        self.progress = None
+        self.index = '2d'
+        self.index_build = 'after'
+        self.index_background = True
+        self.order = None
+
+
+class ServerClient(object):
+    """HTTP client for the REST API of the Jupyter server extension.
+
+    Requests share a pool of keep-alive connections, have a timeout and are
+    retried with backoff after connection errors and gateway errors. All
+    requests to the server extension are idempotent, so retrying is safe.
+
+    Attributes:
+        url(str): The Jupyter server address.
+        timeout: Connect and read timeouts in seconds, as accepted by
+            ``requests``.
+        session: The ``requests.Session`` holding the connection pool.
+    """
+
+    def __init__(self, url, timeout=(3.05, 60), retries=3, pool_size=8, workers=4):
+        """
+        Args:
+            url(str): The Jupyter server address.
+            timeout: Connect and read timeouts in seconds. Defaults to
+                ``(3.05, 60)``.
+            retries(int): Number of retries. Defaults to 3.
+            pool_size(int): Number of pooled connections. Defaults to 8.
+            workers(int): Number of threads for asynchronous requests.
+                Defaults to 4.
+        """
+        self.url = url
+        self.timeout = timeout
+        self._workers = workers
+        self._executor = None
+        kwargs = {'total': retries, 'backoff_factor': 0.2,
+                  'status_forcelist': (502, 503, 504)}
+        try:
+            retry = Retry(allowed_methods=None, **kwargs)
+        except TypeError:
+            # urllib3 older than 1.26
+            retry = Retry(method_whitelist=False, **kwargs)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, **kwargs):
+        """Send a request to the server extension.
+
+        Args:
+            method(str): The HTTP method.
+            path(str): The path of the handler, relative to ``url``.
+            **kwargs: Keyword arguments for ``requests.Session.request``.
+
+        Returns:
+            A ``requests.Response``.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url_path_join(self.url, path), **kwargs)
+
+    def get(self, path, **kwargs):
+        """Send a GET request, see ``request``."""
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        """Send a POST request, see ``request``."""
+        return self.request('POST', path, **kwargs)
+
+    def submit(self, method, path, **kwargs):
+        """Send a request without waiting for the response.
+
+        Args:
+            method(str): The HTTP method.
+            path(str): The path of the handler, relative to ``url``.
+            **kwargs: Keyword arguments for ``requests.Session.request``.
+
+        Returns:
+            A ``concurrent.futures.Future`` for the ``requests.Response``.
+        """
+        if self._executor is None:
+            self._executor = cfs.ThreadPoolExecutor(max_workers=self._workers)
+        return self._executor.submit(self.request, method, path, **kwargs)
+
+    def close(self):
+        """Close pooled connections and wait for pending requests."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.session.close()
 
 
 class Connection(object):
@@ -26,9 +179,25 @@ class Connection(object):
     This object establish connections to the given database. Error will be
     thrown if fails, otherwise push the database information to the server
     through REST API.
+
+    Catalogs are stored through a storage backend, MongoDB by default, an
+    embedded engine keeping catalogs as files in a directory, for which no
+    database service is needed, or memory-mapped column files for catalogs
+    too big for memory. Overlays other than ``VoronoiLayer`` and
+    ``DelaunayLayer`` store their data in MongoDB and need the ``mongo``
+    backend.
+
+    Attributes:
+        ingest: An ``IngestConfig`` with the settings used when importing
+            catalogs.
+        server: A ``ServerClient`` shared by all requests to the server
+            extension.
+        storage: The ``vizic.storage.StorageBackend`` holding catalogs.
+        db: The pymongo database, None for the ``embedded`` backend.
     """
 
-    def __init__(self, dbHost="localhost", dbPort=27017, db="vis", sevrPort=None):
+    def __init__(self, dbHost="localhost", dbPort=27017, db="vis", sevrPort=None,
+                 backend='mongo', path=None):
         """
         Args:
             dbHost(str): The host name or address. Defaults to ``localhost``.
@@ -38,6 +207,11 @@ class Connection(object):
                 ``vis``.
             sevrPort(int): The port that Jupyter server listens on. Defaults to
                 8888. By default the server is running on the localhost.
+            backend(str): The storage backend, ``mongo``, ``embedded`` or
+                ``columnar``. Defaults to ``mongo``.
+            path(str): The directory holding catalogs for the ``embedded``
+                and ``columnar`` backends, which has to be readable by the
+                Jupyter server.
 
         Raises:
             Exception: If initiating connection to specified database fails.
@@ -48,27 +222,57 @@ class Connection(object):
         if sevrPort is not None and isinstance(sevrPort, int):
             self.sevrPort = sevrPort
         self._url = "http://localhost:{}/".format(self.sevrPort)
-        try:
-            self.client = pmg.MongoClient(dbHost, dbPort)
-            self.db = self.client[db]
+        self.ingest = IngestConfig()
+        self.server = ServerClient(self._url)
+        self.backend = backend
+        self.client = None
+        self.db = None
+        if backend in ['embedded', 'columnar']:
+            if path is None:
+                raise Exception('A path is required for the {} backend!'.format(backend))
+            self.path = os.path.abspath(path)
             self.change_db(db)
-        except ConnectionFailure as err:
-            print('Error: Connection to MongoDB instance is refused!')
-            raise Exception('Check database info before initialize connection!')
+        elif backend == 'mongo':
+            try:
+                self.client = pmg.MongoClient(dbHost, dbPort)
+                self.db = self.client[db]
+                self.change_db(db)
+            except ConnectionFailure as err:
+                print('Error: Connection to MongoDB instance is refused!')
+                raise Exception('Check database info before initialize connection!')
+        else:
+            raise Exception('Unknown storage backend {}, use mongo, embedded or columnar.'.format(backend))
 
     def change_db(self, db):
         """Change the database used for ``Vizic``"""
-        self.db = self.client[db]
-        body = {
-            'host': self.host,
-            'port': self.port,
-            'db': db
-        }
-        path = url_path_join(self._url, '/connection/')
-        req = requests.post(path, data=body)
+        if self.backend in ['embedded', 'columnar']:
+            if self.backend == 'embedded':
+                self.storage = EmbeddedBackend(self.path, db)
+            else:
+                self.storage = ColumnarBackend(self.path, db)
+            body = {
+                'backend': self.backend,
+                'path': self.path,
+                'db': db
+            }
+        else:
+            self.db = self.client[db]
+            self.storage = MongoBackend(self.db)
+            body = {
+                'host': self.host,
+                'port': self.port,
+                'db': db
+            }
+        req = self.server.post('/connection/', data=body)
         if req.status_code != 200:
             raise Exception('Change database failed!')
 
+    def _storage(self, db):
+        """Private method returning the storage backend for a database."""
+        if db == self.storage.db_name:
+            return self.storage
+        return self.storage.database(db)
+
     def rm_catalog(self, collection, db='vis'):
         """Remove all data associated with given catalog collection.
 
@@ -77,10 +281,7 @@ class Connection(object):
             db(str): The database that the collections are stored. Defaults to
                 ``vis``.
         """
-        db = self.client[db]
-        db.drop_collection(collection)
-        db['mst'].delete_one({'_id':collection})
-        db['healpix'].delete_one({'_id':collection})
+        self._storage(db).drop(collection)
 
     def rm_circles(self, circles_id, db='vis'):
         """Remove stored data for a CirclesOverLay.
@@ -89,6 +290,8 @@ class Connection(object):
             circles_id(str): The name given to this particular CirclesOverLay.
             db(str): The database that the data is stored. Defaults to ``vis``.
         """
+        if self.client is None:
+            return
         db = self.client[db]
         db['circles'].delete_one({'_id':circles_id})
 
@@ -101,11 +304,7 @@ class Connection(object):
         Returns:
             A list of catalog collection names.
         """
-        reserved = ['mst', 'circles', 'healpix']  # reserved for other use
-        catalogs = self.client[db].collection_names(include_system_collections=False)
-        catalogs = [x for x in catalogs if x not in reserved]
-
-        return catalogs
+        return self._storage(db).catalogs()
 
     def show_circles(self):
         """Show CirclesOverLay data stored in database.
@@ -113,12 +312,14 @@ class Connection(object):
         Returns:
             A list of CirclesOverLay ids.
         """
+        if self.db is None:
+            return []
         circles = list(self.db['circles'].find({},{'_id':1}))
         circles = [x['_id'] for x in circles]
 
         return circles
 
-    def to_new(self, df, coll_name, map_dict=None):
+    def to_new(self, df, coll_name, map_dict=None, resume=False):
         """Import new catalog without creating a map layer.
 
         Args:
@@ -126,45 +327,30 @@ class Connection(object):
             coll_name(str): A string for naming the data collection in DB.
             map_dict(dict): A dictionary to assign different names to
                 existing columns.
+            resume(bool): Continue an interrupted import of the same
+                dataframe, skipping chunks already inserted. Defaults to
+                False.
         """
 
         exist_colls = self.show_catalogs()
-        if coll_name in exist_colls:
+        if coll_name in exist_colls and not resume:
             raise Exception('Provided collection name already exists, use a different name or use function to_exists().')
 
         coll = Collection()
         coll.name = coll_name
 
-        if map_dict is not None:
-            for k in map_dict.keys():
-                df[k] = df[map_dict[k]]
-
-        clms = [x.upper() for x in list(df.columns)]
-        if not set(['RA', 'DEC']).issubset(set(clms)):
-            raise Exception("RA, DEC is required for visualization!")
-        if not set(['A_IMAGE', 'B_IMAGE', 'THETA_IMAGE']).issubset(set(clms)):
-            print('No shape information provided')
-            if 'RADIUS' in clms:
-                print('Will use radius for filtering!')
-                coll.radius = True
-            else:
-                print('Object as point, slow performance!')
-                coll.point = True
+        df = self._map_columns(df, map_dict)
+        self._check_columns(df, coll)
         df_r, coll._des_crs = self._data_prep(df, coll)
         coll.x_range = coll._des_crs[2]*256
         coll.y_range = coll._des_crs[3]*256
 
         # drop created mapped columns before ingecting data
-        if map_dict is not None:
-            col_keys = [x.upper() for x in map_dict.keys()
-                        if x.upper() not in ['RA', 'DEC']]
-            df_r.drop(col_keys,axis=1, inplace=True)
-            for k in col_keys:
-                coll._minMax.pop(k, None)
+        self._drop_mapped(df_r, coll, map_dict)
 
-        self._insert_data(df_r, coll)
+        self._insert_data(df_r, coll, resume)
 
-    def to_exists(self, df, coll_name, map_dict=None):
+    def to_exists(self, df, coll_name, map_dict=None, resume=False):
         """Add new data to existing catalog collection.
 
         Args:
@@ -172,6 +358,9 @@ class Connection(object):
             coll_name(str): The name of the existing collection.
             map_dict(dict): A dictionary to assign different names to
                 existing columns.
+            resume(bool): Continue an interrupted import of the same
+                dataframe, skipping chunks already inserted. Defaults to
+                False.
         """
         exist_colls = self.show_catalogs()
         if coll_name in exist_colls:
@@ -181,39 +370,352 @@ class Connection(object):
 
         coll = Collection()
         coll.name = coll_name
-        if map_dict is not None:
-            for k in map_dict.keys():
-                df[k] = df[map_dict[k]]
-
-        clms = [x.upper() for x in list(df.columns)]
-        if not set(['RA', 'DEC']).issubset(set(clms)):
-            raise Exception("RA, DEC is required for visualization!")
-        if set(['A_IMAGE', 'B_IMAGE', 'THETA_IMAGE']).issubset(set(clms)) and \
-                (not db_meta.radius and not db_meta.point):
-            print('Will use shape information for filtering')
-        elif ('RADIUS' not in clms and
-                not set(['A_IMAGE', 'B_IMAGE', 'THETA_IMAGE']).issubset(set(clms))) or  \
-                db_meta.point:
-
-            coll.point = True
-            print('Objects as points, slow performance')
-        else:
-            coll.radius = True
-            print('Use raidus to filter objects')
+        df = self._map_columns(df, map_dict)
+        self._check_columns(df, coll, db_meta)
         df_r, coll._des_crs = self._data_prep(df, coll)
         coll.x_range = coll._des_crs[2]*256
         coll.y_range = coll._des_crs[3]*256
         self._update_coll(coll, db_meta)
 
         # drop created mapped columns before ingecting data
+        self._drop_mapped(df_r, coll, map_dict)
+
+        self._insert_data(df_r, coll, resume)
+
+    def from_file(self, path, coll_name, fmt=None, map_dict=None, append=False,
+                  chunk_rows=1000000, resume=False, **kwargs):
+        """Import a catalog from a file, streaming it in chunks.
+
+        The file is read ``chunk_rows`` rows at a time, each chunk is
+        formatted and inserted before the next one is read, so the catalog
+        never has to fit in memory. Extent and field ranges are accumulated
+        over the chunks and the meta information is written once at the end.
+
+        Args:
+            path(str): Path to a CSV, Parquet or FITS table file.
+            coll_name(str): The name of the data collection in DB.
+            fmt(str): One of ``csv``, ``parquet`` and ``fits``. Guessed from
+                the file extension by default.
+            map_dict(dict): A dictionary to assign different names to
+                existing columns.
+            append(bool): Add the data to an existing catalog collection
+                instead of creating a new one. Defaults to False.
+            chunk_rows(int): Number of rows read at a time. Defaults to
+                1000000.
+            resume(bool): Continue an interrupted import of the same file.
+                The file is read again, but chunks already inserted are
+                skipped. Defaults to False.
+            **kwargs: Keyword arguments for the reader, ``pandas.read_csv``
+                for CSV files, and ``hdu`` (defaults to 1) for FITS files.
+        """
+        exist_colls = self.show_catalogs()
+        db_meta = None
+        if append:
+            if coll_name not in exist_colls:
+                raise Exception('Provided collection name does not exist, use append=False')
+            db_meta = self.read_meta(coll_name)
+        elif coll_name in exist_colls and not resume:
+            raise Exception('Provided collection name already exists, use a different name or use append=True.')
+
+        coll = Collection()
+        coll.name = coll_name
+        if db_meta is not None:
+            coll.cat_ct = db_meta.cat_ct + 1
+            coll.index = db_meta.index
+
+        source = 'file:{}'.format(os.path.abspath(path))
+        manifest = self._begin_ingest(coll, resume, source, chunk_rows)
+        chunks = self._read_chunks(path, fmt, manifest['chunkRows'], **kwargs)
+        self._insert_chunks(self._prep_chunks(chunks, coll, map_dict, db_meta), coll, manifest)
+        if len(coll._des_crs) == 0:
+            raise Exception('No data found in {}'.format(path))
+        if db_meta is not None:
+            self._merge_coll(coll, db_meta)
+
+        self._finish_ingest(coll, manifest)
+
+    def crossmatch(self, coll_a, coll_b, radius, nearest=True, coll_name=None,
+                   workers=None, zone_rows=1000000):
+        """Cross-match two stored catalogs by position.
+
+        The sky is cut in ``DEC`` zones of about ``zone_rows`` objects of
+        ``coll_a``, from the ``DEC`` distribution sketched in its meta
+        information. For each zone, positions and ids of ``coll_a`` in the
+        zone and of ``coll_b`` in the zone widened by ``radius`` are read with
+        a range query, and matched in a pool of processes, each with a KD-tree
+        on unit vectors (see ``vizic.utils.match_positions``). At most two
+        zones per process are read ahead, so memory is bounded by the size of
+        the zones, not of the catalogs. Matches are streamed into
+        ``coll_name`` as zones finish if given, a catalog that can be shown
+        with a ``GridLayer``, otherwise they are returned, and can be marked
+        on a map by passing them as ``df`` to a ``CirclesOverLay``.
+
+        Args:
+            coll_a(str): The first catalog.
+            coll_b(str): The second catalog.
+            radius(float): The largest separation matched, in arcsec.
+            nearest(bool): Keep only the nearest match in ``coll_b`` of each
+                object in ``coll_a``, otherwise all pairs within ``radius``.
+                Defaults to True.
+            coll_name(str): The name of a new catalog to store matches in.
+                Defaults to None, returning them.
+            workers(int): Number of processes. Defaults to the number of
+                CPUs.
+            zone_rows(int): Number of objects of ``coll_a`` per zone.
+                Defaults to 1000000.
+
+        Returns:
+            A pandas dataframe with the ``_id`` of matched objects as
+            ``ID_A`` and ``ID_B``, the position in ``coll_a`` as ``RA`` and
+            ``DEC``, the position in ``coll_b`` as ``RA_B`` and ``DEC_B`` and
+            the separation ``SEP`` in arcsec. The number of matches if they
+            are stored in ``coll_name``.
+        """
+        exist_colls = self.show_catalogs()
+        for name in [coll_a, coll_b]:
+            if name not in exist_colls:
+                raise Exception('Collection {} does not exist!'.format(name))
+        if coll_name is not None and coll_name in exist_colls:
+            raise Exception('Provided collection name already exists, use a different name.')
+
+        start = time.time()
+        zones = self._dec_zones(coll_a, zone_rows)
+        frames = (df for df in self._match_zones(coll_a, coll_b, zones, radius/3600., nearest, workers)
+                  if df.shape[0] > 0)
+
+        if coll_name is None:
+            frames = list(frames)
+            if len(frames) == 0:
+                return pd.DataFrame(columns=['ID_A', 'ID_B', 'RA', 'DEC', 'RA_B', 'DEC_B', 'SEP'])
+            return pd.concat(frames, ignore_index=True)
+
+        coll = Collection()
+        coll.name = coll_name
+        source = 'crossmatch:{}:{}:{}:{}'.format(coll_a, coll_b, radius, nearest)
+        manifest = self._begin_ingest(coll, False, source)
+        self._insert_chunks(self._prep_chunks(frames, coll), coll, manifest)
+        if len(coll._des_crs) == 0:
+            self.discard_ingest(coll_name)
+            raise Exception('No matches found between {} and {}.'.format(coll_a, coll_b))
+        self._finish_ingest(coll, manifest)
+        print('Matched {} pairs in {:.1f} s'.format(coll._counts.total(), time.time()-start))
+        return coll._counts.total()
+
+    def _dec_zones(self, coll_name, zone_rows):
+        """Private method cutting the sky in ``DEC`` zones of about
+        ``zone_rows`` objects of a catalog.
+
+        The number of objects comes from the ``DEC`` sketch, or from the
+        storage backend for catalogs imported without sketches, whose zones
+        are of equal area.
+
+        Returns:
+            A list of the lower and upper ``DEC`` of each zone, upper bounds
+            excluded.
+        """
+        meta = self.read_meta(coll_name)
+        sketch = meta._sketches.get('DEC')
+        if sketch is not None and sketch.count > 0:
+            rows = sketch.count
+        else:
+            sketch = None
+            rows = self.storage.count(coll_name)
+        n = max(int(np.ceil(float(rows)/zone_rows)), 1)
+        if sketch is not None:
+            edges = sketch.quantile(np.arange(1, n)/float(n))
+        else:
+            # zones of equal area
+            edges = np.degrees(np.arcsin(np.linspace(-1., 1., n+1)[1:-1]))
+        edges = [-90.] + sorted(set(float(x) for x in np.atleast_1d(edges) if -90. < x < 90.))
+        edges.append(float(np.nextafter(90., 91.)))
+        return list(zip(edges[:-1], edges[1:]))
+
+    def _match_zones(self, coll_a, coll_b, zones, radius, nearest, workers):
+        """Private generator matching two catalogs zone by zone.
+
+        Args:
+            coll_a(str): The first catalog.
+            coll_b(str): The second catalog.
+            zones(list): The lower and upper ``DEC`` of each zone.
+            radius(float): The largest separation matched, in degrees.
+            nearest(bool): Keep only the nearest match of each object in
+                ``coll_a``.
+            workers(int): Number of processes, None for the number of CPUs.
+
+        Yields:
+            A pandas dataframe of the matches of each zone, in ``DEC`` order.
+        """
+        fields = ['RA', 'DEC', '_id']
+        workers = workers or multiprocessing.cpu_count()
+
+        def matches(a, b, future):
+            (ia, ib, sep) = future.result()
+            return pd.DataFrame({'ID_A': a['_id'].values[ia], 'ID_B': b['_id'].values[ib],
+                                 'RA': a['RA'].values[ia], 'DEC': a['DEC'].values[ia],
+                                 'RA_B': b['RA'].values[ib], 'DEC_B': b['DEC'].values[ib],
+                                 'SEP': sep*3600.})
+
+        pool = cfs.ProcessPoolExecutor(workers)
+        try:
+            pending = deque()
+            for (lo, hi) in zones:
+                a = self.storage.scan(coll_a, fields, (lo, hi))
+                if a.shape[0] == 0:
+                    continue
+                b = self.storage.scan(coll_b, fields, (lo - radius, hi + radius))
+                if b.shape[0] == 0:
+                    continue
+                future = pool.submit(match_positions, a['RA'].values, a['DEC'].values,
+                                     b['RA'].values, b['DEC'].values, radius, nearest)
+                pending.append((a, b, future))
+                if len(pending) >= 2*workers:
+                    yield matches(*pending.popleft())
+            while len(pending) > 0:
+                yield matches(*pending.popleft())
+        finally:
+            pool.shutdown()
+
+    def _read_chunks(self, path, fmt, chunk_rows, **kwargs):
+        """Private generator reading a table file in chunks of rows.
+
+        Args:
+            path(str): Path to a CSV, Parquet or FITS table file.
+            fmt(str): One of ``csv``, ``parquet`` and ``fits``, or None to
+                guess from the file extension.
+            chunk_rows(int): Number of rows per chunk.
+            **kwargs: Keyword arguments for the reader.
+
+        Yields:
+            A pandas dataframe for each chunk.
+        """
+        if fmt is None:
+            name = path.lower()
+            for ext in ['.gz', '.bz2', '.zip', '.xz']:
+                if name.endswith(ext):
+                    name = name[:-len(ext)]
+            ext = name.rsplit('.', 1)[-1]
+            fmt = {'csv': 'csv', 'txt': 'csv', 'parquet': 'parquet', 'pq': 'parquet',
+                   'fits': 'fits', 'fit': 'fits', 'fts': 'fits'}.get(ext)
+        if fmt == 'csv':
+            for chunk in pd.read_csv(path, chunksize=chunk_rows, **kwargs):
+                yield chunk
+        elif fmt == 'parquet':
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise Exception('pyarrow is required to read Parquet files!')
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+                yield batch.to_pandas()
+        elif fmt == 'fits':
+            from astropy.io import fits
+            from astropy.table import Table
+            with fits.open(path, memmap=True) as hdul:
+                data = hdul[kwargs.get('hdu', 1)].data
+                for i in range(0, len(data), chunk_rows):
+                    yield Table(data[i:i+chunk_rows]).to_pandas()
+        else:
+            raise Exception('Unknown file format for {}, give one of csv, parquet and fits.'.format(path))
+
+    def _prep_chunks(self, chunks, coll, map_dict=None, db_meta=None):
+        """Private generator formatting streamed chunks of a catalog.
+
+        The extent and field ranges of each chunk are merged into ``coll`` as
+        the chunk is handed out for insertion.
+
+        Args:
+            chunks: An iterable of pandas dataframes.
+            coll: The collection object accumulating meta information.
+            map_dict(dict): A dictionary to assign different names to
+                existing columns.
+            db_meta: A collection object for the existing catalog when
+                appending, otherwise None.
+
+        Yields:
+            A formatted pandas dataframe for each chunk.
+        """
+        for i, chunk in enumerate(chunks):
+            chunk = self._map_columns(chunk, map_dict)
+            if i == 0:
+                self._check_columns(chunk, coll, db_meta)
+            part = Collection()
+            (part.radius, part.point) = (coll.radius, coll.point)
+            df_r, part._des_crs = self._data_prep(chunk, part)
+            part.x_range = part._des_crs[2]*256
+            part.y_range = part._des_crs[3]*256
+            self._drop_mapped(df_r, part, map_dict)
+
+            if len(coll._des_crs) == 0:
+                coll._des_crs = part._des_crs
+                (coll.x_range, coll.y_range) = (part.x_range, part.y_range)
+                coll._minMax = part._minMax
+                coll._sketches = part._sketches
+                coll._counts = part._counts
+                coll._touched = part._touched
+            else:
+                self._merge_coll(coll, part)
+            prep = coll.stats.setdefault('prep', {'time': 0., 'added': 0})
+            prep['time'] += part.stats['prep']['time']
+            prep['added'] = max(prep['added'], part.stats['prep']['added'])
+            yield df_r
+
+    def _map_columns(self, df, map_dict):
+        """Private method adding columns under the names in ``map_dict``.
+
+        The input dataframe is not modified, the returned one shares its
+        columns.
+        """
+        if map_dict is not None:
+            df = df.copy(deep=False)
+            for k in map_dict.keys():
+                df[k] = df[map_dict[k]]
+        return df
+
+    def _drop_mapped(self, df_r, coll, map_dict):
+        """Private method dropping mapped columns, except for ``RA/DEC``."""
         if map_dict is not None:
             col_keys = [x.upper() for x in map_dict.keys()
                         if x.upper() not in ['RA', 'DEC']]
             df_r.drop(col_keys, axis=1, inplace=True)
             for k in col_keys:
                 coll._minMax.pop(k, None)
+                coll._sketches.pop(k, None)
+
+    def _check_columns(self, df, coll, db_meta=None):
+        """Private method checking the columns of a catalog.
 
-        self._insert_data(df_r, coll)
+        Whether objects are drawn with their shapes, with a radius or as
+        points is decided here, and stored in ``coll``.
+
+        Args:
+            df: A pandas dataframe containning the catalog.
+            coll: The Collection object for the catalog.
+            db_meta: A collection object for the existing catalog when adding
+                data to it, otherwise None.
+
+        Raises:
+            Exception: If ``RA`` or ``DEC`` is missing.
+        """
+        clms = set([x.upper() for x in list(df.columns)])
+        shape = set(['A_IMAGE', 'B_IMAGE', 'THETA_IMAGE']).issubset(clms)
+        if not set(['RA', 'DEC']).issubset(clms):
+            raise Exception("RA, DEC is required for visualization!")
+        if db_meta is None:
+            if not shape:
+                print('No shape information provided')
+                if 'RADIUS' in clms:
+                    print('Will use radius for filtering!')
+                    coll.radius = True
+                else:
+                    print('Object as point, slow performance!')
+                    coll.point = True
+        elif shape and (not db_meta.radius and not db_meta.point):
+            print('Will use shape information for filtering')
+        elif ('RADIUS' not in clms and not shape) or db_meta.point:
+            coll.point = True
+            print('Objects as points, slow performance')
+        else:
+            coll.radius = True
+            print('Use raidus to filter objects')
 
     def _update_coll(self, new, old):
         """Private method to update collection meta data.
@@ -222,6 +724,18 @@ class Connection(object):
             new: A collection object for the updated dataset.
             old: A collection object for the existing catalog collection.
         """
+        self._merge_coll(new, old)
+        new.cat_ct = old.cat_ct + 1
+        new.index = old.index
+
+    def _merge_coll(self, new, old):
+        """Private method merging extent, field ranges, sketches, counts
+        and touched cells of two datasets.
+
+        Args:
+            new: A collection object, updated to cover both datasets.
+            old: A collection object for the other dataset.
+        """
 
         xMin = new._des_crs[0] if new._des_crs[0] < old._des_crs[0] \
             else old._des_crs[0]
@@ -247,7 +761,20 @@ class Connection(object):
         for k in old._minMax.keys():
             if k not in com_keys:
                 new._minMax[k] = old._minMax[k]
-        new.cat_ct = old.cat_ct + 1
+
+        # catalogs imported by earlier versions have no counts
+        if new._counts is not None and old._counts is not None:
+            new._counts.merge(old._counts)
+        else:
+            new._counts = None
+
+        for k, sketch in old._sketches.items():
+            if k in new._sketches:
+                new._sketches[k].merge(sketch)
+            else:
+                new._sketches[k] = sketch
+
+        new._touched = np.union1d(new._touched, old._touched)
 
     def read_meta(self, coll_name):
         """Read meta information from a existing catalog collection and stores in
@@ -262,13 +789,23 @@ class Connection(object):
         """
 
         coll = Collection()
-        meta = self.db[coll_name].find_one({'_id': 'meta'})
+        meta = self.storage.get_meta(coll_name)
+        if meta is None or 'adjust' not in meta:
+            raise Exception('Ingestion of {} is unfinished, resume it with resume=True or call discard_ingest().'.format(coll_name))
         coll.name = coll_name
         coll._des_crs = meta['adjust']
         coll.x_range = meta['xRange']
         coll.y_range = meta['yRange']
         coll._minMax = meta['minmax']
+        coll._sketches = {k: QuantileSketch.from_dict(v)
+                          for k, v in meta.get('sketch', {}).items()}
+        if 'counts' in meta:
+            coll._counts = CountPyramid.from_dict(meta['counts'])
+        else:
+            coll._counts = None
         coll.cat_ct = meta['catCt']
+        coll._changes = meta.get('changes', [])
+        coll.index = meta.get('index', {}).get('strategy', '2d')
         (coll.radius, coll.point) = (meta['radius'], meta['point'])
 
         return coll
@@ -281,6 +818,13 @@ class Connection(object):
         inserted into the dataframe, so as the mapped coordinates and
         shapes/sizes for the objects.
 
+        Field distributions are sketched, objects counted by position and
+        size, and the cells at ``CHANGE_LEVEL`` holding objects recorded, into
+        ``coll``. The input dataframe is not copied nor modified, the returned
+        one shares its columns. Time taken and the size in bytes of the added
+        columns are reported in ``coll.stats['prep']``, not the memory of the
+        kernel.
+
         Args:
             df: A pandas dataframe containning the catalog.
             coll: The Collection object storing meta information for the
@@ -291,51 +835,341 @@ class Connection(object):
             the coordinate scale.
 
         """
-        dff = df.copy()
+        start = time.time()
+        dff = df.copy(deep=False)
         dff.columns = [x.upper() for x in dff.columns]
-        (xMax, xMin) = (dff['RA'].max(), dff['RA'].min())
-        (yMax, yMin) = (dff['DEC'].max(), dff['DEC'].min())
+        ra = dff['RA'].values
+        dec = dff['DEC'].values
+        (xMax, xMin) = (np.nanmax(ra), np.nanmin(ra))
+        (yMax, yMin) = (np.nanmax(dec), np.nanmin(dec))
         x_range = xMax - xMin
         y_range = yMax - yMin
 
-        # find field min and max
-        for col in dff.columns:
-            if dff[col].dtype.kind == 'f':
-                coll._minMax[col] = [dff[col].min(), dff[col].max()]
+        # find field min and max, and sketch the distributions
+        coll._minMax.update(self._float_min_max(dff))
+        coll._sketches.update(self._field_sketches(dff))
 
+        scale = 0.267/3600
+        added = ['b', 'theta']
         if coll.radius:
-            dff.loc[:, 'b'] = dff.loc[:, 'RADIUS'].apply(lambda x: x*0.267/3600)
+            dff['b'] = dff['RADIUS'].values*scale
             dff['theta'] = 0
         elif coll.point:
             dff['b'] = 360
             dff['theta'] = 0
         else:
-            dff.loc[:, 'a'] = dff.loc[:, 'A_IMAGE'].apply(lambda x: x*0.267/3600)
-            dff.loc[:, 'b'] = dff.loc[:, 'B_IMAGE'].apply(lambda x: x*0.267/3600)
-            dff.loc[:, 'theta'] = dff.loc[:, 'THETA_IMAGE']
+            dff['a'] = dff['A_IMAGE'].values*scale
+            dff['b'] = dff['B_IMAGE'].values*scale
+            dff['theta'] = dff['THETA_IMAGE']
+            added = ['a', 'b']
+        coll._counts.add(ra, dec, dff['b'].values)
+        coll._touched = np.unique(tile_key(ra, dec, CHANGE_LEVEL))
 
-        # assign 'loc' columns for geoIndex in Mongo
-        dff['loc'] = list(zip(dff.RA, dff.DEC))
+        coll.stats['prep'] = {
+            'time': time.time()-start,
+            'added': int(dff[added].memory_usage(index=False).sum())
+        }
 
         xScale = x_range/256
         yScale = y_range/256
         return dff, [xMin, yMax, xScale, yScale]
 
-    def _insert_data(self, df, coll):
+    def _float_min_max(self, df, step=1 << 20):
+        """Private method finding min and max for all float columns.
+
+        Float columns are stacked ``step`` rows at a time, so that all of
+        them are reduced together while the temporary copy stays small.
+
+        Args:
+            df: A pandas dataframe.
+            step(int): The number of rows reduced at a time.
+
+        Returns:
+            A dictionary of ``[min, max]`` for each float column.
+        """
+        cols = [x for x in df.columns if df[x].dtype.kind == 'f']
+        if len(cols) == 0:
+            return {}
+        values = [df[x].values for x in cols]
+        mins = np.full(len(cols), np.nan)
+        maxs = np.full(len(cols), np.nan)
+        with warnings.catch_warnings():
+            # all-NaN slices are expected, fmin/fmax skip them
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for i in range(0, df.shape[0], step):
+                block = np.column_stack([v[i:i+step] for v in values])
+                mins = np.fmin(mins, np.nanmin(block, axis=0))
+                maxs = np.fmax(maxs, np.nanmax(block, axis=0))
+
+        return {c: [float(mins[i]), float(maxs[i])] for i, c in enumerate(cols)}
+
+    def _field_sketches(self, df):
+        """Private method sketching the distribution of all numeric columns.
+
+        Args:
+            df: A pandas dataframe.
+
+        Returns:
+            A dictionary of ``QuantileSketch`` for each numeric column.
+        """
+        return {c: QuantileSketch().add(df[c].values) for c in df.columns
+                if df[c].dtype.kind in 'fiu'}
+
+    def _insert_data(self, df, coll, resume=False):
         """Private method to insert a catalog into database.
 
         Args:
             df: A pandas dataframe with correctly formatted catalog.
             coll: The collection object storing meta information for the
                 corresponding catalog.
+            resume(bool): Continue an interrupted ingestion of the same
+                dataframe. Defaults to False.
+        """
+
+        source = 'dataframe:{}'.format(df.shape[0])
+        manifest = self._begin_ingest(coll, resume, source)
+        self._insert_chunks([df], coll, manifest, df.shape[0])
+        self._finish_ingest(coll, manifest)
+
+    def _begin_ingest(self, coll, resume, source, chunk_rows=None):
+        """Private method starting or resuming an ingestion.
+
+        The ingestion manifest is kept under ``ingest`` in the meta document
+        of the catalog until every chunk has landed. It holds the ids of the
+        chunks inserted so far, and the chunk sizes and ``cat_rank`` that fix
+        which rows make up each chunk, and the order rows are sorted in. For a
+        new catalog the index strategy is chosen here, and indexes are built
+        if ``ingest.index_build`` is ``before``.
+
+        Args:
+            coll: The collection object for the new data, its ``cat_ct`` is
+                taken from the manifest when resuming.
+            resume(bool): Whether to resume an unfinished ingestion.
+            source(str): A description of the data being ingested, which has
+                to match when resuming.
+            chunk_rows(int): Number of rows read at a time from a file, if
+                ingesting from a file.
+
+        Returns:
+            The manifest as a dictionary, with ``done`` as a set.
+
+        Raises:
+            Exception: If an unfinished ingestion exists and ``resume`` is
+                False, or if there is nothing matching to resume.
         """
+        meta = self.storage.get_meta(coll.name)
+        manifest = meta.get('ingest') if meta is not None else None
+        if manifest is None:
+            if resume:
+                raise Exception('No unfinished ingestion of {} to resume.'.format(coll.name))
+            if self.ingest.order not in [None, 'hilbert', 'morton']:
+                raise Exception('Unknown order {}, use hilbert or morton.'.format(self.ingest.order))
+            if coll.cat_ct == 1:
+                if self.ingest.index not in INDEXES:
+                    raise Exception('Unknown index strategy {}, use one of {}.'.format(
+                        self.ingest.index, ', '.join(sorted(INDEXES.keys()))))
+                coll.index = self.ingest.index
+            manifest = {'catCt': coll.cat_ct, 'chunkSize': self.ingest.chunk_size,
+                        'chunkRows': chunk_rows, 'source': source, 'done': [],
+                        'strategy': coll.index, 'order': self.ingest.order}
+            self.storage.update_meta(coll.name, {'ingest': manifest})
+            if coll.cat_ct == 1 and self.ingest.index_build == 'before':
+                manifest['index'] = self._create_indexes(coll, 'before')
+                self.storage.update_meta(coll.name, {'ingest.index': manifest['index']})
+        elif not resume:
+            raise Exception('Ingestion of {} is unfinished, resume it with resume=True or call discard_ingest().'.format(coll.name))
+        elif manifest['source'] != source:
+            raise Exception('Unfinished ingestion of {} was from {}, not {}.'.format(coll.name, manifest['source'], source))
+        else:
+            coll.cat_ct = manifest['catCt']
+            coll.index = manifest['strategy']
+            print('Resuming ingestion of {}, {} chunks already inserted'.format(coll.name, len(manifest['done'])))
+        manifest['done'] = set(manifest['done'])
+        return manifest
+
+    def _finish_ingest(self, coll, manifest):
+        """Private method finalizing an ingestion once every chunk landed.
 
-        df['cat_rank'] = coll.cat_ct
-        data_d = df.to_dict(orient='records')
-        collection = self.db[coll.name]
-        collection.insert_many(data_d, ordered=False)
-        collection.update_one({'_id': 'meta'}, {'$set':{'adjust': coll._des_crs, 'xRange': coll.x_range, 'yRange': coll.y_range, 'minmax': coll._minMax, 'radius':coll.radius,'point':coll.point, 'catCt':coll.cat_ct}}, upsert=True)
+        The storage backend makes the new data queryable, then indexes are
+        built, unless built before loading, ahead of writing the
+        meta information, which also drops the ingestion manifest. The
+        server is then told to reload the meta information.
 
+        When data is appended, the boxes of the cells it landed in are
+        recorded under ``changes`` in the meta information, and the storage
+        backend invalidates the data derived from the catalog over those
+        boxes only, so displayed layers refresh the tiles they overlap.
+        """
+        self.storage.finalize(coll.name, coll.index)
+        change = None
         if coll.cat_ct == 1:
-            collection.create_index([('loc', pmg.GEO2D)], name='geo_loc_2d', min=-90, max=360)
-            collection.create_index([('b', pmg.ASCENDING)], name='semi_axis')
+            index = manifest.get('index')
+            if index is None:
+                index = self._create_indexes(coll, 'after')
+            coll.stats['index'] = index
+        else:
+            change = self._record_change(coll)
+        self._write_meta(coll)
+        if change is not None:
+            self.storage.invalidate(coll.name, change['boxes'], change['extent'])
+        self._report(coll)
+        self.server.submit('POST', '/rangeinfo/', data={'collection': coll.name})
+
+    def _record_change(self, coll, keep=16):
+        """Private method recording where appended data landed.
+
+        The ``keep`` latest changes are saved under ``changes`` in the meta
+        information, each with the ``catCt`` of the data, the boxes of the
+        cells it landed in and whether the extent of the catalog grew.
+
+        Returns:
+            The new change as a dictionary.
+        """
+        meta = self.storage.get_meta(coll.name)
+        extent = not np.allclose(meta['adjust'], coll._des_crs)
+        change = {'catCt': coll.cat_ct, 'extent': extent,
+                  'boxes': [list(x) for x in tile_key_boxes(coll._touched, CHANGE_LEVEL)]}
+        self.storage.update_meta(coll.name, {'changes': (meta.get('changes', []) + [change])[-keep:]})
+        return change
+
+    def discard_ingest(self, coll_name):
+        """Discard an unfinished ingestion into a catalog collection.
+
+        Objects inserted by the ingestion are removed. A catalog that was
+        being created is dropped altogether.
+
+        Args:
+            coll_name(str): The name of the catalog collection.
+        """
+        meta = self.storage.get_meta(coll_name)
+        if meta is None or 'ingest' not in meta:
+            raise Exception('No unfinished ingestion of {} to discard.'.format(coll_name))
+        if 'adjust' not in meta:
+            self.storage.drop(coll_name)
+        else:
+            self.storage.delete_rank(coll_name, meta['ingest']['catCt'])
+            self.storage.update_meta(coll_name, unset=['ingest'])
+
+    def _write_meta(self, coll):
+        """Private method writing the meta information of a catalog.
+
+        Index sizes are refreshed, as they grow when data is added. Field
+        sketches are saved under ``sketch``, with a histogram of each field
+        over its 0.5 to 99.5 percentiles under ``hist`` for display, and the
+        count pyramid under ``counts``.
+        """
+        meta = {'adjust': coll._des_crs, 'xRange': coll.x_range, 'yRange': coll.y_range, 'minmax': coll._minMax, 'radius':coll.radius,'point':coll.point, 'catCt':coll.cat_ct}
+        meta['sketch'] = {k: v.to_dict() for k, v in coll._sketches.items()}
+        meta['hist'] = {k: v.histogram() for k, v in coll._sketches.items()}
+        if coll._counts is not None:
+            meta['counts'] = coll._counts.to_dict()
+        if 'index' in coll.stats:
+            meta['index'] = coll.stats['index']
+        else:
+            meta['index.size'] = self.storage.index_size(coll.name, coll.index)
+        self.storage.update_meta(coll.name, meta, unset=['ingest'])
+
+    def _create_indexes(self, coll, build):
+        """Private method creating the indexes of a new catalog.
+
+        Args:
+            coll: The collection object of the catalog, ``coll.index`` gives
+                the index strategy.
+            build(str): ``before`` or ``after`` loading the data.
+
+        Returns:
+            A dictionary with the strategy, build time in seconds and index
+            sizes in bytes.
+        """
+        start = time.time()
+        self.storage.create_indexes(coll.name, coll.index, self.ingest.index_background)
+        return {'strategy': coll.index, 'build': build,
+                'background': self.ingest.index_background,
+                'time': time.time()-start,
+                'size': self.storage.index_size(coll.name, coll.index)}
+
+    def _report(self, coll):
+        """Private method printing the time and memory taken to ingest."""
+        prep = coll.stats.get('prep', {'time': 0., 'added': 0})
+        insert = coll.stats.get('insert', {'time': 0., 'rows': 0, 'skipped': 0})
+        print('Prepared {} objects in {:.2f} s, {:.1f} MB of added columns, inserted in {:.2f} s'.format(
+            insert['rows'], prep['time'], prep['added']/2.**20, insert['time']))
+        if insert.get('skipped'):
+            print('{} objects were already inserted before resuming'.format(insert['skipped']))
+        if 'index' in coll.stats:
+            index = coll.stats['index']
+            print('Built {} indexes {} loading in {:.2f} s, {:.1f} MB'.format(
+                index['strategy'], index['build'], index['time'],
+                sum(index['size'].values())/2.**20))
+
+    def _insert_chunks(self, frames, coll, manifest, total=None):
+        """Private method inserting a formatted catalog chunk by chunk.
+
+        Chunks of ``chunkSize`` rows from the manifest are inserted into the
+        storage backend concurrently by ``ingest.workers`` threads, sharing
+        the client's connection pool with Mongo. At most two chunks per worker
+        are built ahead, so memory stays bounded. Chunks are numbered in order
+        over all frames, those listed as done in the manifest are skipped, and
+        the others are added to it as they land. If the manifest gives an
+        order, the rows of each frame are sorted by it, taking each chunk's
+        rows in turn. Time taken is reported in ``coll.stats['insert']``.
+
+        Args:
+            frames: An iterable of pandas dataframes with correctly formatted
+                catalog, consumed lazily.
+            coll: The collection object storing meta information for the
+                corresponding catalog.
+            manifest(dict): The ingestion manifest from ``_begin_ingest``.
+            total(int): The total number of rows if known, passed on to
+                ``ingest.progress``.
+        """
+        cfg = self.ingest
+        size = manifest['chunkSize']
+        state = {'done': 0, 'skipped': 0, 'landed': []}
+        start = time.time()
+
+        def checkpoint(force=False):
+            if len(state['landed']) >= cfg.checkpoint or (force and state['landed']):
+                self.storage.add_done(coll.name, state['landed'])
+                manifest['done'].update(state['landed'])
+                state['landed'] = []
+
+        def land(finished):
+            for f in finished:
+                state['done'] += f.result()
+                state['landed'].append(chunk_ids.pop(f))
+                checkpoint()
+                if cfg.progress is not None:
+                    cfg.progress(state['done'], total)
+
+        chunk_ids = {}
+        chunk_id = 0
+        row = 0
+        with cfs.ThreadPoolExecutor(max_workers=cfg.workers) as pool:
+            pending = set()
+            for df in frames:
+                order = None
+                if manifest.get('order') is not None:
+                    order = cluster_order(df['RA'].values, df['DEC'].values, manifest['order'])
+                for i in range(0, df.shape[0], size):
+                    # rows are taken in order a chunk at a time, the frame isn't copied
+                    chunk = df.iloc[i:i+size] if order is None else df.iloc[order[i:i+size]]
+                    if chunk_id in manifest['done']:
+                        state['done'] += chunk.shape[0]
+                        state['skipped'] += chunk.shape[0]
+                    else:
+                        if len(pending) >= 2*cfg.workers:
+                            finished, pending = cfs.wait(pending, return_when=cfs.FIRST_COMPLETED)
+                            land(finished)
+                        first_id = (coll.cat_ct << 40) + row
+                        f = pool.submit(self.storage.insert, coll.name, chunk, coll.cat_ct,
+                                        first_id, coll.index, cfg.retries)
+                        chunk_ids[f] = chunk_id
+                        pending.add(f)
+                    chunk_id += 1
+                    row += chunk.shape[0]
+            land(cfs.wait(pending)[0])
+            checkpoint(True)
+
+        coll.stats['insert'] = {'time': time.time()-start, 'rows': state['done'],
+                                'skipped': state['skipped']}
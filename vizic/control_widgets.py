@@ -191,7 +191,8 @@ class ColorMap(Dropdown):
 class FilterSlider(FloatRangeSlider):
     """RangeSlider widget for filering displayed objects.
 
-    Ranges for selected field are automatically displayed on the slider. Move
+    The slider spans the min/max of the selected field, with the bars set
+    at the ``percentiles`` of the layer if set, otherwise at the ends. Move
     the bars to filter out unwanted objects.
 
     Attributes:
@@ -214,7 +215,7 @@ class FilterSlider(FloatRangeSlider):
         self.property = field.upper()
         self.min, self.max = (-1e6, 1e6)
         self.min, self.max = self._layer.get_min_max(field)
-        self.value = [self.min, self.max]
+        self.value = list(self._layer.get_range(field))
         self.step = 0.0001
         self.layout.width = '100%'
         # self.link()
@@ -223,7 +224,7 @@ class FilterSlider(FloatRangeSlider):
         self.property = field.upper()
         self.min, self.max = (-1e6, 1e6)
         self.min, self.max = self._layer.get_min_max(field)
-        self.value = [self.min, self.max]
+        self.value = list(self._layer.get_range(field))
 
     def link(self):
         """Link slider values with the ``filter_range`` from tileLayer."""
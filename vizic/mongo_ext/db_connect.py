@@ -1,28 +1,60 @@
 import motor
 from tornado import gen
 import concurrent.futures as cfs
+import math
 import time
 from pymongo import MongoClient
 from bson.json_util import dumps
+from ..utils import META_COLLECTION
+from ..sketch import QuantileSketch, CountPyramid, estimate_count
+from ..storage import MongoBackend, EmbeddedBackend, ColumnarBackend
+from ..storage.mongo import box_query, INDEX_FIELDS
 # executor = cfs.ThreadPoolExecutor(max_workers=20)
 
 
 class MongoConnect(object):
     """MongoDB utility wrapper.
 
+    The meta information of all catalogs in the database is kept in a
+    registry, loaded when connecting and reloaded for a catalog when it is
+    requested but unknown, or when its meta information is pushed. The
+    server never writes meta information: that of catalogs imported by
+    earlier versions, still inside the catalog collection, is read from
+    there, and moved to the meta collection by the kernel's ``Connection``
+    when it reads the catalog.
+
     Attributes:
         range_dict(dict): Geographical coverage, represented as the value
             ranges in ``RA`` and ``DEC``, for catalog collections displayed
             in the notebooks.
         zoom_dict(dict): Maximum zooms for catalog collections displayed in
             Jupyter notebooks.
+        meta_dict(dict): Meta information for catalog collections.
+        healpix_dict(dict): Catalog collection and stored resolutions for
+            requested Healpix grids.
+        count_dict(dict): Count pyramid and field sketches of catalogs,
+            loaded from the meta information when first needed.
+        composite_dict(dict): Member catalogs and their ``cat_rank``
+            offsets for composites of catalogs served as one tile layer.
+        missing_dict(dict): When requested catalogs were last found
+            unknown.
+        default_zoom(int): Maximum zoom used for catalogs not displayed yet.
+        missing_ttl(float): Seconds an unknown catalog isn't looked up
+            again for.
     """
     range_dict = {}
     zoom_dict = {}
     meta_dict = {}
+    healpix_dict = {}
+    count_dict = {}
+    composite_dict = {}
+    missing_dict = {}
+    default_zoom = 8
+    missing_ttl = 10.
 
     def __init__(self, host, port, db):
-        """Initiate an asynchronous client and a static client.
+        """Initiate an asynchronous client and a static client, and load the
+        catalog registry.
 
         Args:
             host(str): MongoDB host name or address.
@@ -33,6 +65,113 @@ class MongoConnect(object):
         self.db = self.client[db]
         self.stat_client = MongoClient(host, port)
         self.stat_db = self.stat_client[db]
+        self.meta_dict.clear()
+        self.range_dict.clear()
+        self.healpix_dict.clear()
+        self.count_dict.clear()
+        self.composite_dict.clear()
+        self.missing_dict.clear()
+        self.loadMeta()
+
+    def loadMeta(self, coll=None):
+        """Load meta information of catalogs into the registry.
+
+        Catalogs with an unfinished ingestion are left out. Catalogs missing
+        from the meta collection are looked up for meta information stored
+        inside the catalog collection by earlier versions. Composites stored
+        by ``CompositeLayer`` are loaded too.
+
+        Args:
+            coll(str): The catalog to load, all catalogs by default.
+
+        Returns:
+            bool: Whether any catalog was loaded.
+        """
+        if coll is None:
+            metas = list(self.stat_db[META_COLLECTION].find())
+            known = set(x['_id'] for x in metas)
+            for name in MongoBackend(self.stat_db).catalogs():
+                if name not in known:
+                    metas.append(self._legacyMeta(name))
+        else:
+            meta = self.stat_db[META_COLLECTION].find_one({'_id': coll})
+            metas = [meta if meta is not None else self._legacyMeta(coll)]
+        metas = [x for x in metas if x is not None]
+        composites = {x['_id']: x['composite'] for x in metas if 'composite' in x}
+        return self._register([x for x in metas if 'composite' not in x], composites)
+
+    def _legacyMeta(self, coll):
+        """Private method reading the meta information kept inside a catalog
+        collection by earlier versions, without moving it."""
+        meta = self.stat_db[coll].find_one({'_id': 'meta'})
+        if meta is not None:
+            meta['_id'] = coll
+        return meta
+
+    def _register(self, metas, composites=None):
+        """Private method adding meta documents to the registry.
+
+        Composites are added once their member catalogs are, and those
+        already registered with a member added again are updated, so that
+        ``cat_rank`` offsets follow the number of additions to each member.
+
+        Args:
+            metas(list): Meta documents of catalogs.
+            composites(dict): Stored composites by name.
+
+        Returns:
+            bool: Whether any catalog or composite was added.
+        """
+        loaded = False
+        names = set()
+        for meta in metas:
+            if 'adjust' not in meta:
+                continue
+            name = meta.pop('_id')
+            self.meta_dict[name] = meta
+            self.missing_dict.pop(name, None)
+            self.count_dict.pop(name, None)
+            # grids of the catalog may have been binned again
+            for grid in [k for k, v in self.healpix_dict.items() if v['coll'] == name]:
+                del self.healpix_dict[grid]
+            self.range_dict[name] = float(meta['xRange'] + meta['yRange'])/2
+            self.zoom_dict.setdefault(name, self.default_zoom)
+            names.add(name)
+            loaded = True
+
+        composites = dict(composites or {})
+        for name, composite in self.composite_dict.items():
+            if name not in composites and names.intersection(composite['members']):
+                meta = self.meta_dict[name]
+                composites[name] = {'members': composite['members'], 'adjust': meta['adjust'],
+                                    'xRange': meta['xRange'], 'yRange': meta['yRange']}
+        for name, c in composites.items():
+            if self.addComposite(name, c['members'], c['adjust'], c['xRange'], c['yRange']):
+                loaded = True
+        return loaded
+
+    def hasCatalog(self, coll):
+        """Check a catalog is in the registry, loading it if needed.
+
+        A catalog not found is not looked up again for ``missing_ttl``
+        seconds, unless its meta information is pushed, so requests for a
+        dropped or mistyped catalog don't each query the database.
+
+        Args:
+            coll(str): The catalog collection name.
+
+        Returns:
+            bool: Whether the catalog is known.
+        """
+        if coll in self.meta_dict:
+            return True
+        missed = self.missing_dict.get(coll)
+        if missed is not None and time.time()-missed < self.missing_ttl:
+            return False
+        if self.loadMeta(coll):
+            return True
+        self.missing_dict[coll] = time.time()
+        return False
 
     def close(self):
         """Close existing clients."""
@@ -50,25 +189,177 @@ class MongoConnect(object):
             yc(int): y-coordinate the required tile.
             zoom(int): Zoom level for the required tile.
 
+        Returns:
+            A list of objects, empty if the catalog is unknown.
         """
+        if not self.hasCatalog(coll):
+            raise gen.Return([])
+        if coll in self.composite_dict:
+            tiles = yield self.getCompositeTile(coll, xc, yc, zoom)
+            raise gen.Return(tiles)
         result = self.getCoordRange(int(xc), int(yc), int(zoom), coll)
         minR = self.getMinRadius(zoom, self.range_dict[coll])
-        cursor = self.db[coll].find({'$and':[
-            {
-                'loc': {
-                    '$geoWithin':{
-                        '$box': [
-                            [result[0],result[1]],
-                            [result[2],result[3]]
-                        ]
-                    }
-                }
-            },
-            {'b': {'$gte': minR*0.3}}
-        ]},
-            {'_id':0, 'loc': 0}
-        )
-        return cursor
+        tiles = yield self.getBoxData(coll, result, minR*0.3)
+        raise gen.Return(tiles)
+
+    @gen.coroutine
+    def getBoxData(self, coll, box, min_b):
+        """Query the database for objects in a box at least ``min_b`` in size.
+
+        Args:
+            coll(str): The name of collection storing the requested catalog.
+            box(tuple): The smallest and largest coordinate in both x and y
+                direction.
+            min_b(float): The smallest semi-minor axis returned.
+
+        Returns:
+            A list of objects.
+        """
+        proj = {x: 0 for x in INDEX_FIELDS}
+        proj['_id'] = 0
+        cursor = self.db[coll].find(box_query(self.getStrategy(coll), box, min_b), proj)
+        objects = yield cursor.to_list(length=100000000)
+        raise gen.Return(objects)
+
+    def addComposite(self, name, members, adjust, x_range, y_range):
+        """Register a composite of catalogs served as one tile layer.
+
+        Args:
+            name(str): The name the composite is requested by.
+            members(list): The catalog collection names.
+            adjust(list): The coordinate scale of the composite, covering all
+                catalogs.
+            x_range(float): The range in ``RA`` of the composite.
+            y_range(float): The range in ``DEC`` of the composite.
+
+        Returns:
+            bool: Whether all catalogs are known, and the composite added.
+        """
+        offsets = []
+        cat_ct = 0
+        for m in members:
+            if not self.hasCatalog(m):
+                return False
+            offsets.append(cat_ct)
+            cat_ct += self.meta_dict[m]['catCt']
+        self.composite_dict[name] = {'members': members, 'offsets': offsets}
+        self.meta_dict[name] = {'adjust': adjust, 'xRange': x_range,
+                                'yRange': y_range, 'catCt': cat_ct}
+        self.range_dict[name] = float(x_range + y_range)/2
+        self.zoom_dict.setdefault(name, self.default_zoom)
+        return True
+
+    def getMembers(self, coll):
+        """Return the catalogs of a composite, or the catalog itself."""
+        if coll in self.composite_dict:
+            return self.composite_dict[coll]['members']
+        return [coll]
+
+    @gen.coroutine
+    def getCompositeTile(self, name, xc, yc, zoom):
+        """Query all catalogs of a composite for a tile, concurrently.
+
+        Objects are tagged with ``catalog``, the name of their catalog as in
+        selections, and ``cat_rank`` is offset so that ranks follow on
+        across catalogs.
+
+        Args:
+            name(str): The name of the composite.
+            xc(int): x-coordinate the required tile.
+            yc(int): y-coordinate the required tile.
+            zoom(int): Zoom level for the required tile.
+
+        Returns:
+            A list of objects of all catalogs.
+        """
+        composite = self.composite_dict[name]
+        box = self.getCoordRange(int(xc), int(yc), int(zoom), name)
+        minR = self.getMinRadius(zoom, self.range_dict[name])
+        results = yield [self.getBoxData(m, box, minR*0.3) for m in composite['members']]
+        tiles = []
+        for member, objects, offset in zip(composite['members'], results, composite['offsets']):
+            for d in objects:
+                d['catalog'] = member
+                d['cat_rank'] = d.get('cat_rank', 1) + offset
+            tiles += objects
+        raise gen.Return(tiles)
+
+    def getStrategy(self, coll):
+        """Return the index strategy of a catalog."""
+        return self.meta_dict[coll].get('index', {}).get('strategy', '2d')
+
+    def getBoxQuery(self, coll, box, zoom):
+        """Build the query for objects in a box drawn at a zoom level.
+
+        The shape of the query follows the index strategy of the catalog,
+        see ``vizic.storage.mongo.box_query``. Objects smaller than a third
+        of a pixel are left out.
+
+        Args:
+            coll(str): The name of collection storing the requested catalog.
+            box(tuple): The smallest and largest coordinate in both x and y
+                direction, as returned by ``getCoordRange``.
+            zoom(int): The zoom level objects are drawn at.
+
+        Returns:
+            A dictionary for ``find``.
+        """
+        minR = self.getMinRadius(zoom, self.range_dict[coll])
+        return box_query(self.getStrategy(coll), box, minR*0.3)
+
+    def getCounts(self, coll):
+        """Return the count pyramid and field sketches of a catalog.
+
+        Returns:
+            A tuple of the ``CountPyramid`` and a dictionary of
+            ``QuantileSketch``, the pyramid is None for catalogs imported by
+            earlier versions.
+        """
+        if coll not in self.count_dict:
+            meta = self.meta_dict[coll]
+            counts = CountPyramid.from_dict(meta['counts']) if 'counts' in meta else None
+            sketches = {k: QuantileSketch.from_dict(v) for k, v in meta.get('sketch', {}).items()}
+            self.count_dict[coll] = (counts, sketches)
+        return self.count_dict[coll]
+
+    def estimateCount(self, coll, box, zoom=None, filters=None):
+        """Estimate the number of objects in a box, without a query.
+
+        The estimate comes from the count pyramid built at ingestion, scaled
+        by the fraction of objects within each filter range given by the
+        field sketches, see ``vizic.sketch.estimate_count``.
+
+        Args:
+            coll(str): The name of collection storing the requested catalog.
+            box(tuple): The smallest and largest ``RA`` and ``DEC``.
+            zoom(int): Count only objects drawn at this zoom level, all
+                objects by default.
+            filters(dict): Lower and upper bound for fields.
+
+        Returns:
+            float: The estimated count, 0 if the catalog is unknown and None
+                if it has no count pyramid.
+        """
+        if not self.hasCatalog(coll):
+            return 0.
+        counts, sketches = self.getCounts(coll)
+        if counts is None:
+            return None
+        min_b = 0.
+        if zoom is not None:
+            min_b = self.getMinRadius(zoom, self.range_dict[coll])*0.3
+        return estimate_count(counts, sketches, box, min_b, filters)
+
+    def estimateTileCount(self, coll, xc, yc, zoom, filters=None):
+        """Estimate the number of objects drawn in a tile, without a query.
+
+        Returns:
+            float: The estimated count, see ``estimateCount``.
+        """
+        if not self.hasCatalog(coll):
+            return 0.
+        box = self.getCoordRange(int(xc), int(yc), int(zoom), coll)
+        return self.estimateCount(coll, box, int(zoom), filters)
 
     # remeber to exclude the meta document
     @gen.coroutine
@@ -82,15 +373,16 @@ class MongoConnect(object):
             collection(str): Collection name for the required catalog.
 
         Returns:
-            A cursor object with the required data.
+            A list of positions.
         """
         coll = self.db[collection]
-        cursor = coll.find({'_id':{'$ne':'meta'}}, {
+        cursor = coll.find({}, {
             '_id': 0,
             'RA': 1,
             'DEC': 1,
         })
-        return cursor
+        positions = yield cursor.to_list(length=1000000000)
+        raise gen.Return(positions)
 
     def getCoordRange(self, xc, yc, zoom, collection):
         """Determine the projection of a tile on the maximum zoom level.
@@ -146,23 +438,77 @@ class MongoConnect(object):
                 requested MST.
 
         Returns:
-            A cursor object
+            The list of MST edges, or None if not found.
         """
-        cusor_m = self.db['mst'].find({'_id': coll}, {'_id': 0, 'tree': 1})
-        return cusor_m
+        mst = yield self.db['mst'].find_one({'_id': coll}, {'_id': 0, 'tree': 1})
+        raise gen.Return(mst['tree'] if mst is not None else None)
 
     @gen.coroutine
-    def getHealpix(self, coll):
-        """Retrive previously calcuated Healpix grid.
+    def getHealpixTile(self, grid, xc, yc, zoom):
+        """Query the database for Healpix pixels in a particular tile.
 
         Args:
-            coll(str): Associated catalog collection name for the
-                requested Healpix grid.
+            grid(str): The ID of the requested Healpix grid.
+            xc(int): x-coordinate the required tile.
+            yc(int): y-coordinate the required tile.
+            zoom(int): Zoom level for the required tile.
+
         Returns:
-            A cursor object
+            A list of pixels, empty if the grid has no stored pixels or its
+            catalog is unknown.
         """
-        cursor_h = self.db['healpix'].find({'_id':coll}, {'_id':0, 'data':1})
-        return cursor_h
+        grid_meta = self.healpix_dict.get(grid)
+        if grid_meta is None:
+            grid_meta = self.stat_db['healpix'].find_one({'_id':grid}, {'_id':0})
+            if grid_meta is None:
+                raise gen.Return([])
+            self.healpix_dict[grid] = grid_meta
+        if len(grid_meta['levels']) < 1:
+            raise gen.Return([])
+
+        coll = grid_meta['coll']
+        if not self.hasCatalog(coll):
+            raise gen.Return([])
+        result = self.getCoordRange(int(xc), int(yc), int(zoom), coll)
+        nside = self.getHealpixNside(int(zoom), self.range_dict[coll], grid_meta['levels'])
+        cursor = self.db['healpix_pix'].find({'$and':[
+            {
+                'loc': {
+                    '$geoWithin':{
+                        '$box': [
+                            [result[0],result[1]],
+                            [result[2],result[3]]
+                        ]
+                    }
+                }
+            },
+            {'grid': grid},
+            {'nside': nside}
+        ]},
+            {'_id':0, 'grid': 0, 'nside': 0, 'pix': 0, 'loc': 0}
+        )
+        pixels = yield cursor.to_list(length=100000000)
+        raise gen.Return(pixels)
+
+    def getHealpixNside(self, zoom, mapSizeV, levels, min_px=8):
+        """Pick the stored Healpix resolution to draw at a zoom level.
+
+        The finest stored resolution with pixels at least ``min_px`` screen
+        pixels wide is used, or the coarsest one if none is that wide.
+
+        Args:
+            zoom(int): The projected zoom level.
+            mapSizeV(float): The size of the map in vertial direction.
+            levels(list): The stored nside values.
+            min_px(int): Minimum size of a Healpix pixel on screen.
+
+        Returns:
+            int: The nside to draw.
+        """
+        # a Healpix pixel is about sqrt(pi/3)/nside radians wide
+        max_nside = math.degrees(math.sqrt(math.pi/3))/(min_px*self.getMinRadius(zoom, mapSizeV))
+        fit = [n for n in levels if n <= max_nside]
+        return max(fit) if fit else min(levels)
 
     @gen.coroutine
     def getCircles(self, coll):
@@ -172,10 +518,10 @@ class MongoConnect(object):
             coll(str): Associated catalog collection name for the
                 requested circles layer.
         Returns:
-            A cursor object
+            The list of circles, or None if not found.
         """
-        cursor_c = self.db['circles'].find({'_id':coll}, {'_id':0, 'data':1})
-        return cursor_c
+        circles = yield self.db['circles'].find_one({'_id':coll}, {'_id':0, 'data':1})
+        raise gen.Return(circles['data'] if circles is not None else None)
 
     def getOjbectByPos(self, coll, ra, dec):
         """Query the data for a particular object.
@@ -193,7 +539,8 @@ class MongoConnect(object):
         dec = float(dec)
         pop_cursor = self.stat_db[coll].find({
             '$and':[{'RA':ra},{'DEC':dec}]},
-            {'_id': 0, 'a': 0, 'b': 0, 'loc':0, 'theta':0}
+            {'_id': 0, 'a': 0, 'b': 0, 'loc':0, 'theta':0, 'sky': 0,
+             'tilekey': 0, 'minzoom': 0}
         )
         return dumps(pop_cursor)
 
@@ -218,21 +565,86 @@ class MongoConnect(object):
         swLng = float(swLng)
         neLat = float(neLat)
         neLng = float(neLng)
-        minR = self.getMinRadius(self.zoom_dict[coll], self.range_dict[coll])
-        cursor = self.stat_db[coll].find({'$and':[
-            {
-                'loc': {
-                    '$geoWithin':{
-                        '$box': [
-                            [swLng,swLat],
-                            [neLng,neLat]
-                        ]
-                    }
-                }
-            },
-            {'b': {'$gte': minR*0.3}}
-        ]},
-            {'_id':0, 'a': 0, 'b': 0, 'loc':0, 'theta':0}
+        if not self.hasCatalog(coll):
+            return []
+        query = self.getBoxQuery(coll, (swLng, swLat, neLng, neLat), self.zoom_dict[coll])
+        cursor = self.stat_db[coll].find(query,
+            {'_id':0, 'a': 0, 'b': 0, 'loc':0, 'theta':0, 'sky': 0,
+             'tilekey': 0, 'minzoom': 0}
         )
 
         return list(cursor)
+
+
+class EmbeddedConnect(MongoConnect):
+    """Server access to catalogs of the embedded or columnar storage backend.
+
+    Queries are answered in process from the catalog files written by
+    ``vizic.storage.EmbeddedBackend`` or ``vizic.storage.ColumnarBackend``,
+    with no database service. Overlays
+    stored in MongoDB (MST, circles and Healpix grids) are not available.
+    """
+
+    def __init__(self, path, db, backend='embedded'):
+        """Open the catalog directory and load the catalog registry.
+
+        Args:
+            path(str): The directory holding the databases.
+            db(str): The database name.
+            backend(str): ``embedded`` or ``columnar``. Defaults to
+                ``embedded``.
+        """
+        if backend == 'columnar':
+            self.storage = ColumnarBackend(path, db)
+        else:
+            self.storage = EmbeddedBackend(path, db)
+        self.meta_dict.clear()
+        self.range_dict.clear()
+        self.healpix_dict.clear()
+        self.count_dict.clear()
+        self.composite_dict.clear()
+        self.missing_dict.clear()
+        self.loadMeta()
+
+    def close(self):
+        """Nothing to close for the embedded backend."""
+        pass
+
+    def loadMeta(self, coll=None):
+        names = self.storage.catalogs() if coll is None else [coll]
+        metas = [self.storage.get_meta(x) for x in names]
+        composites = {k: v for k, v in self.storage.composites().items()
+                      if coll is None or k == coll}
+        return self._register([x for x in metas if x is not None], composites)
+
+    @gen.coroutine
+    def getBoxData(self, coll, box, min_b):
+        raise gen.Return(self.storage.box(coll, box, min_b))
+
+    @gen.coroutine
+    def getVoronoi(self, collection):
+        df = self.storage.scan(collection, ['RA', 'DEC'])
+        raise gen.Return(df.to_dict(orient='records'))
+
+    @gen.coroutine
+    def getMst(self, coll):
+        raise gen.Return(None)
+
+    @gen.coroutine
+    def getCircles(self, coll):
+        raise gen.Return(None)
+
+    @gen.coroutine
+    def getHealpixTile(self, grid, xc, yc, zoom):
+        raise gen.Return([])
+
+    def getOjbectByPos(self, coll, ra, dec):
+        return dumps(self.storage.popup(coll, float(ra), float(dec),
+                                        exclude=('a', 'b', 'theta')))
+
+    def getRectSelection(self, coll, swLng, swLat, neLng, neLat):
+        if not self.hasCatalog(coll):
+            return []
+        box = (float(swLng), float(swLat), float(neLng), float(neLat))
+        minR = self.getMinRadius(self.zoom_dict[coll], self.range_dict[coll])
+        return self.storage.box(coll, box, minR*0.3, exclude=('a', 'b', 'theta'))
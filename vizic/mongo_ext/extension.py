@@ -1,32 +1,62 @@
 from notebook.utils import url_path_join
 from notebook.base.handlers import IPythonHandler
 # from . import db_util as du
-from .db_connect import MongoConnect
+from .db_connect import MongoConnect, EmbeddedConnect
+from .profiling import ProfiledHandler, ProfileSession, profiler
 from tornado import gen
 import json
+import os
 import tornado.web
 
 connection = None
 
 
-class tileHandler(IPythonHandler):
+def get_connection():
+    """Return the database connection, connecting with defaults if needed.
+
+    Until a kernel pushes its connection, the server connects to the
+    database given by the ``VIZIC_DB_HOST``, ``VIZIC_DB_PORT`` and
+    ``VIZIC_DB`` environment variables, by default ``vis`` at
+    ``localhost:27017``, so stored catalogs are served after a restart. With
+    ``VIZIC_BACKEND`` set to ``embedded`` or ``columnar``, catalogs are read
+    from the directory given by ``VIZIC_PATH`` instead.
+
+    Returns:
+        A MongoConnect object, or None if connecting failed.
+    """
+    global connection
+    if connection is None:
+        db = os.environ.get('VIZIC_DB', 'vis')
+        try:
+            backend = os.environ.get('VIZIC_BACKEND', 'mongo')
+            if backend in ['embedded', 'columnar']:
+                connection = EmbeddedConnect(os.environ['VIZIC_PATH'], db, backend)
+            else:
+                connection = MongoConnect(os.environ.get('VIZIC_DB_HOST', 'localhost'),
+                                          int(os.environ.get('VIZIC_DB_PORT', 27017)),
+                                          db)
+        except Exception:
+            connection = None
+    return connection
+
+
+class tileHandler(ProfiledHandler):
     """Handler for tiled catalogs requests."""
     @gen.coroutine
     def get(self, coll, zoom, xc, yc):
-        global connection
+        connection = get_connection()
         if connection is None:
             self.set_status(403)
             self.write({'msg': 'error'})
         else:
-            tile_gen = yield connection.getTileData(coll, xc, yc, zoom)
-            tile_list = yield tile_gen.to_list(length=100000000)
+            tile_list = yield connection.getTileData(coll, xc, yc, zoom)
             tile_json = json.dumps(tile_list)
             self.set_status(200)
             self.set_header('Content-Type', 'application/json')
             self.write(tile_json)
 
 
-class dbHandler(IPythonHandler):
+class dbHandler(ProfiledHandler):
     """Handler for request on database change."""
 
     def check_xsrf_cookie(self):
@@ -35,15 +65,17 @@ class dbHandler(IPythonHandler):
     @tornado.web.asynchronous
     def post(self):
         arguments = {k.lower(): self.get_argument(k) for k in self.request.arguments}
-        host = arguments['host']
-        port = int(arguments['port'])
         db = arguments['db']
         global connection
 
         if connection is not None:
             connection.close()
         try:
-            connection = MongoConnect(host, port, db)
+            backend = arguments.get('backend', 'mongo')
+            if backend in ['embedded', 'columnar']:
+                connection = EmbeddedConnect(arguments['path'], db, backend)
+            else:
+                connection = MongoConnect(arguments['host'], int(arguments['port']), db)
         except Exception as e:
             self.set_status(403)
             self.write({'status': 'error', 'message': 'check connection info'})
@@ -56,26 +88,62 @@ class dbHandler(IPythonHandler):
         self.finish()
 
 
-class rangeHandler(IPythonHandler):
-    """Handler for updates on catalog metadata."""
+class rangeHandler(ProfiledHandler):
+    """Handler for updates on catalog metadata.
+
+    The meta information of the catalog is reloaded into the registry, the
+    map range and maximum zoom are optional.
+    """
 
     def check_xsrf_cookie(self):
         pass
 
     def post(self):
-        global connection
+        connection = get_connection()
+        if connection is None:
+            self.set_status(403)
+            self.write({'msg': 'error'})
+            return
         arguments = {k.lower(): self.get_argument(k) for k in self.request.arguments}
         collection = arguments['collection']
-        mRange = arguments['mrange']
-        maxZoom = arguments['maxzoom']
-        connection.range_dict[collection] = float(mRange)
-        connection.zoom_dict[collection] = int(maxZoom)
+        connection.loadMeta(collection)
+        if 'mrange' in arguments:
+            connection.range_dict[collection] = float(arguments['mrange'])
+        if 'maxzoom' in arguments:
+            connection.zoom_dict[collection] = int(arguments['maxzoom'])
+
 
-        meta = connection.stat_db[collection].find_one({'_id':'meta'})
-        connection.meta_dict[collection] = meta
+class compositeHandler(ProfiledHandler):
+    """Handler registering a composite of catalogs served as one tile layer.
 
+    ``members``, the catalog names, and ``adjust`` are JSON lists.
+    """
+
+    def check_xsrf_cookie(self):
+        pass
 
-class popupHandler(IPythonHandler):
+    def post(self):
+        connection = get_connection()
+        if connection is None:
+            self.set_status(403)
+            self.write({'msg': 'error'})
+            return
+        arguments = {k.lower(): self.get_argument(k) for k in self.request.arguments}
+        collection = arguments['collection']
+        added = connection.addComposite(collection, json.loads(arguments['members']),
+                                        json.loads(arguments['adjust']),
+                                        float(arguments['xrange']), float(arguments['yrange']))
+        if not added:
+            self.set_status(404)
+            self.write({'msg': 'unknown catalog in {}'.format(arguments['members'])})
+            return
+        if 'mrange' in arguments:
+            connection.range_dict[collection] = float(arguments['mrange'])
+        if 'maxzoom' in arguments:
+            connection.zoom_dict[collection] = int(arguments['maxzoom'])
+
+
+class popupHandler(ProfiledHandler):
     """Handler for data request on clicked object."""
 
     def get(self):
@@ -83,13 +151,18 @@ class popupHandler(IPythonHandler):
         coll = arguments['coll']
         ra = arguments['ra']
         dec = arguments['dec']
-        content = connection.getOjbectByPos(coll, ra, dec)
+        connection = get_connection()
+        # the first catalog of a composite holding an object there
+        for member in connection.getMembers(coll):
+            content = connection.getOjbectByPos(member, ra, dec)
+            if json.loads(content):
+                break
         self.set_status(200)
         self.set_header('Content-Type', 'application/json')
         self.write(content)
 
 
-class selectionHandler(IPythonHandler):
+class selectionHandler(ProfiledHandler):
     """Handler for data request on selected objects by selection tool."""
 
     def get(self):
@@ -99,44 +172,86 @@ class selectionHandler(IPythonHandler):
         neLng = arguments['nelng']
         swLat = arguments['swlat']
         neLat = arguments['nelat']
-        content = connection.getRectSelection(coll, swLng, swLat, neLng, neLat)
+        connection = get_connection()
+        members = connection.getMembers(coll)
+        content = []
+        for member in members:
+            objects = connection.getRectSelection(member, swLng, swLat, neLng, neLat)
+            if len(members) > 1:
+                for d in objects:
+                    d['catalog'] = member
+            content += objects
         json_str = json.dumps(content)
         self.set_status(200)
         self.set_header('Content-Type', 'application/json')
         self.write(json_str)
 
 
-class mstHandler(IPythonHandler):
+class countHandler(ProfiledHandler):
+    """Handler for count estimates of a box or a tile.
+
+    The box is given by ``swlng``, ``swlat``, ``nelng`` and ``nelat``, or
+    the tile by ``xc``, ``yc`` and ``zoom``. ``zoom`` alone restricts a box
+    to the objects drawn at that zoom level, and ``filters`` is a JSON
+    object of lower and upper bounds for fields.
+    """
+
+    def get(self):
+        connection = get_connection()
+        if connection is None:
+            self.set_status(403)
+            self.write({'msg': 'error'})
+            return
+        arguments = {k.lower(): self.get_argument(k) for k in self.request.arguments}
+        coll = arguments['coll']
+        filters = json.loads(arguments['filters']) if 'filters' in arguments else None
+        if 'xc' in arguments:
+            count = connection.estimateTileCount(coll, arguments['xc'], arguments['yc'],
+                                                 arguments['zoom'], filters)
+        else:
+            box = tuple(float(arguments[k]) for k in ['swlng', 'swlat', 'nelng', 'nelat'])
+            zoom = int(arguments['zoom']) if 'zoom' in arguments else None
+            count = connection.estimateCount(coll, box, zoom, filters)
+        if count is None:
+            self.set_status(404)
+            self.write({'msg': 'no counts for {}'.format(coll)})
+        else:
+            self.set_status(200)
+            self.write({'count': count})
+
+
+class mstHandler(ProfiledHandler):
     """Handler for MST data request."""
     @gen.coroutine
     def get(self, coll):
-        global connection
+        connection = get_connection()
         if connection is None:
             self.set_status(403)
             self.write({'msg': 'error'})
         else:
-            mst_gen = yield connection.getMst(coll)
-            mst_list = yield mst_gen.to_list(length=1000000000)
-            mst_json = json.dumps(mst_list[0]['tree'])
-            self.set_status(200)
-            self.set_header('Content-Type', 'application/json')
-            self.write(mst_json)
+            mst_tree = yield connection.getMst(coll)
+            if mst_tree is None:
+                self.set_status(404)
+                self.write({'msg': 'not found'})
+            else:
+                self.set_status(200)
+                self.set_header('Content-Type', 'application/json')
+                self.write(json.dumps(mst_tree))
 
         self.flush()
         self.finish()
 
 
-class voronoiHandler(IPythonHandler):
+class voronoiHandler(ProfiledHandler):
     """Hanlder for request on voronoi diagram data."""
     @gen.coroutine
     def get(self, coll):
-        global connection
+        connection = get_connection()
         if connection is None:
             self.set_status(403)
             self.write({'msg': 'error'})
         else:
-            voronoi_gen = yield connection.getVoronoi(coll)
-            voronoi_list = yield voronoi_gen.to_list(length=1000000000)
+            voronoi_list = yield connection.getVoronoi(coll)
             voronoi_json = json.dumps(voronoi_list)
             self.set_status(200)
             self.set_header('Content-Type', 'application/json')
@@ -146,46 +261,105 @@ class voronoiHandler(IPythonHandler):
         self.finish()
 
 
-class healpixHandler(IPythonHandler):
-    """Handler for data request on healpix grid."""
+class healpixHandler(ProfiledHandler):
+    """Handler for tiled data request on healpix grid."""
     @gen.coroutine
-    def get(self, coll):
-        global connection
+    def get(self, grid, zoom, xc, yc):
+        connection = get_connection()
         if connection is None:
             self.set_status(403)
             self.write({'msg': 'error'})
         else:
-            healpix_gen = yield connection.getHealpix(coll)
-            healpix_list = yield healpix_gen.to_list(length=1000000000)
-            healpix_json = json.dumps(healpix_list[0]['data'])
+            healpix_list = yield connection.getHealpixTile(grid, xc, yc, zoom)
+            healpix_json = json.dumps(healpix_list)
             self.set_status(200)
             self.set_header('Content-Type', 'application/json')
             self.write(healpix_json)
 
-        self.flush()
-        self.finish()
-
 
-class circlesHandler(IPythonHandler):
+class circlesHandler(ProfiledHandler):
     """Handler for data request on CirclesOverLays."""
     @gen.coroutine
     def get(self, coll):
-        global connection
+        connection = get_connection()
         if connection is None:
             self.set_status(403)
             self.write({'msg': 'error'})
         else:
-            circles_gen = yield connection.getCircles(coll)
-            circles_list = yield circles_gen.to_list(length=1000000000)
-            circles_json = json.dumps(circles_list[0]['data'])
-            self.set_status(200)
-            self.set_header('Content-Type', 'application/json')
-            self.write(circles_json)
+            circles_data = yield connection.getCircles(coll)
+            if circles_data is None:
+                self.set_status(404)
+                self.write({'msg': 'not found'})
+            else:
+                self.set_status(200)
+                self.set_header('Content-Type', 'application/json')
+                self.write(json.dumps(circles_data))
 
         self.flush()
         self.finish()
 
 
+class profileHandler(IPythonHandler):
+    """Handler for on-demand profiling of the other handlers.
+
+    Requires an authenticated user. A POST starts a profiling session,
+    replacing the current one, for the next ``requests`` requests of the
+    comma separated ``handlers`` (all by default, e.g. ``tileHandler``), or
+    for ``seconds``. ``mode`` is ``cprofile`` (the default) or ``sample``,
+    sampling every ``interval`` milliseconds (5 by default). A GET returns
+    the per request timings and the aggregated profile of the session, the
+    ``limit`` (40) top functions by ``sort`` (``cumulative``). A DELETE ends
+    the session early.
+    """
+
+    @tornado.web.authenticated
+    def post(self):
+        arguments = {k.lower(): self.get_argument(k) for k in self.request.arguments}
+        handlers = [x for x in arguments.get('handlers', '').split(',') if x != '']
+        known = [c.__name__ for c in ProfiledHandler.__subclasses__()]
+        unknown = [x for x in handlers if x not in known]
+        if len(unknown) > 0:
+            self.set_status(400)
+            self.write({'msg': 'unknown handlers {}, use some of {}'.format(
+                ', '.join(unknown), ', '.join(sorted(known)))})
+            return
+        try:
+            session = ProfileSession(
+                handlers,
+                int(arguments['requests']) if 'requests' in arguments else None,
+                float(arguments['seconds']) if 'seconds' in arguments else None,
+                arguments.get('mode', 'cprofile'),
+                float(arguments.get('interval', 5))/1e3)
+        except Exception as e:
+            self.set_status(400)
+            self.write({'msg': str(e)})
+            return
+        if profiler.session is not None:
+            profiler.session.stop()
+        profiler.session = session
+        self.set_status(200)
+        self.write({'status': 'ok', 'mode': session.mode, 'handlers': sorted(session.handlers)})
+
+    @tornado.web.authenticated
+    def get(self):
+        if profiler.session is None:
+            self.set_status(404)
+            self.write({'msg': 'no profiling session'})
+            return
+        sort = self.get_argument('sort', 'cumulative')
+        limit = int(self.get_argument('limit', 40))
+        self.set_status(200)
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps(profiler.session.report(sort, limit)))
+
+    @tornado.web.authenticated
+    def delete(self):
+        if profiler.session is not None:
+            profiler.session.stop()
+        self.set_status(200)
+        self.write({'status': 'ok'})
+
+
 def load_jupyter_server_extension(nbapp):
     """nbapp is instance of Jupyter.notebook.notebookapp.NotebookApp.
 
@@ -198,20 +372,26 @@ def load_jupyter_server_extension(nbapp):
     route_pattern = url_path_join(web_app.settings['base_url'], '/tiles/(\S*)/(-?[0-9]+)/(-?[0-9]+)/(-?[0-9]+).json')
     db_pattern = url_path_join(web_app.settings['base_url'], '/connection/?')
     collection_pattern = url_path_join(web_app.settings['base_url'], '/rangeinfo/?')
+    composite_pattern = url_path_join(web_app.settings['base_url'], '/composite/?')
     popup_pattern = url_path_join(web_app.settings['base_url'], '/objectPop/?')
     selection_pattern = url_path_join(web_app.settings['base_url'], '/selection/?')
+    count_pattern = url_path_join(web_app.settings['base_url'], '/count/?')
     mst_pattern = url_path_join(web_app.settings['base_url'], '/mst/(\S*).json')
     circles_pattern = url_path_join(web_app.settings['base_url'], '/circles/(\S*).json')
-    healpix_pattern = url_path_join(web_app.settings['base_url'], '/healpix/(\S*).json')
+    healpix_pattern = url_path_join(web_app.settings['base_url'], '/healpix/(\S*)/(-?[0-9]+)/(-?[0-9]+)/(-?[0-9]+).json')
     voronoi_pattern = url_path_join(web_app.settings['base_url'], '/voronoi/(\S*).json')
+    profile_pattern = url_path_join(web_app.settings['base_url'], '/profile/?')
     web_app.add_handlers(host_pattern, [
         (route_pattern, tileHandler),
         (popup_pattern, popupHandler),
         (db_pattern, dbHandler),
         (collection_pattern, rangeHandler),
+        (composite_pattern, compositeHandler),
         (selection_pattern, selectionHandler),
+        (count_pattern, countHandler),
         (mst_pattern, mstHandler),
         (circles_pattern, circlesHandler),
         (healpix_pattern, healpixHandler),
-        (voronoi_pattern, voronoiHandler)
+        (voronoi_pattern, voronoiHandler),
+        (profile_pattern, profileHandler)
     ])
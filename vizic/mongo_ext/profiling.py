@@ -0,0 +1,273 @@
+import cProfile
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from notebook.base.handlers import IPythonHandler
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+MODES = ['cprofile', 'sample']
+
+
+class ProfileSession(object):
+    """Profiling of the next requests of some handlers.
+
+    With ``cprofile``, a ``cProfile.Profile`` runs in the server thread while
+    a profiled request is in flight. Requests served by coroutines overlap,
+    so the work of other requests interleaved with them is profiled too.
+    With ``sample``, the stacks of all threads, including the threads Motor
+    runs database calls on, are sampled every ``interval`` seconds while a
+    profiled request is in flight.
+
+    The session ends once ``requests`` profiled requests finished, or
+    ``seconds`` after it started, whichever comes first.
+
+    Attributes:
+        handlers(set): Names of the handlers profiled, all if empty.
+        mode(str): ``cprofile`` or ``sample``.
+        timings(list): Handler, method, URI, status and time taken of each
+            profiled request.
+        started(float): When the session started.
+        stopped(float): When the session ended, None while it runs.
+    """
+
+    def __init__(self, handlers=(), requests=None, seconds=None, mode='cprofile',
+                 interval=0.005):
+        """
+        Args:
+            handlers: Names of the handlers profiled, all by default.
+            requests(int): Number of requests profiled. Defaults to None, no
+                limit.
+            seconds(float): Length of the session. Defaults to None, no
+                limit.
+            mode(str): ``cprofile`` or ``sample``. Defaults to ``cprofile``.
+            interval(float): Seconds between samples. Defaults to 0.005.
+
+        Raises:
+            Exception: If the mode is unknown, or neither a number of
+                requests nor a length is given.
+        """
+        if mode not in MODES:
+            raise Exception('Unknown profiling mode {}, use cprofile or sample.'.format(mode))
+        if requests is None and seconds is None:
+            raise Exception('Give a number of requests or seconds to profile.')
+        self.handlers = set(handlers)
+        self.requests = requests
+        self.deadline = time.time() + seconds if seconds is not None else None
+        self.mode = mode
+        self.interval = interval
+        self.timings = []
+        self.started = time.time()
+        self.stopped = None
+        self._begun = 0
+        self._active = 0
+        self._profile = cProfile.Profile() if mode == 'cprofile' else None
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._sampling = threading.Event()
+        if mode == 'sample':
+            self._sampler = threading.Thread(target=self._sample)
+            self._sampler.daemon = True
+            self._sampler.start()
+
+    def wants(self, name):
+        """Whether to profile the next request of a handler."""
+        if self.stopped is None and self.deadline is not None and time.time() > self.deadline:
+            self.stop()
+        if self.stopped is not None:
+            return False
+        if len(self.handlers) > 0 and name not in self.handlers:
+            return False
+        return self.requests is None or self._begun < self.requests
+
+    def begin(self, handler):
+        """Start profiling a request."""
+        self._begun += 1
+        self._active += 1
+        handler._profiled = self
+        handler._profile_start = time.time()
+        if self._active == 1:
+            if self._profile is not None:
+                self._profile.enable()
+            else:
+                self._sampling.set()
+
+    def end(self, handler):
+        """Stop profiling a finished request."""
+        self._active -= 1
+        if self._active == 0:
+            self._pause()
+        request = handler.request
+        self.timings.append({
+            'handler': type(handler).__name__,
+            'method': request.method,
+            'uri': request.uri,
+            'status': handler.get_status(),
+            'start': handler._profile_start - self.started,
+            'ms': request.request_time()*1e3
+        })
+        if self.requests is not None and len(self.timings) >= self.requests:
+            self.stop()
+
+    def _pause(self):
+        """Private method pausing the profiler between requests."""
+        if self._profile is not None:
+            self._profile.disable()
+        else:
+            self._sampling.clear()
+
+    def stop(self):
+        """End the session."""
+        if self.stopped is None:
+            self._pause()
+            self.stopped = time.time()
+            self._sampling.set()
+
+    def _sample(self):
+        """Private method sampling stacks of all threads until stopped."""
+        own = threading.current_thread().ident
+        while self.stopped is None:
+            self._sampling.wait()
+            if self.stopped is not None:
+                break
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}({})'.format(code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                with self._lock:
+                    self._stacks[tuple(reversed(stack))] += 1
+            time.sleep(self.interval)
+            if self.deadline is not None and time.time() > self.deadline:
+                self.stop()
+
+    def report(self, sort='cumulative', limit=40):
+        """Aggregate the profile.
+
+        Args:
+            sort(str): The ``pstats`` sort key of the ``cprofile`` listing.
+                Defaults to ``cumulative``.
+            limit(int): Number of functions or stacks listed. Defaults to 40.
+
+        Returns:
+            A dictionary with the state of the session, the per request
+            timings and a summary per handler. With ``cprofile``, the
+            ``functions`` with most time by ``sort`` and the ``pstats``
+            listing under ``text``. With ``sample``, the ``functions``
+            found most often on top of a stack (``self``) or anywhere in it
+            (``total``), and the most frequent ``stacks`` in collapsed form,
+            frames separated by ``;``.
+        """
+        if self.stopped is None and self.deadline is not None and time.time() > self.deadline:
+            self.stop()
+        result = {'mode': self.mode, 'handlers': sorted(self.handlers),
+                  'done': self.stopped is not None,
+                  'elapsed': (self.stopped or time.time()) - self.started,
+                  'requests': len(self.timings), 'timings': self.timings,
+                  'summary': self._summary()}
+        if self._profile is not None:
+            result.update(self._cprofile_report(sort, limit))
+        else:
+            result.update(self._sample_report(limit))
+        return result
+
+    def _summary(self):
+        """Private method summarizing request times per handler."""
+        times = {}
+        for t in self.timings:
+            times.setdefault(t['handler'], []).append(t['ms'])
+        summary = {}
+        for name, ms in times.items():
+            ms = sorted(ms)
+            summary[name] = {'requests': len(ms), 'total_ms': sum(ms),
+                             'median_ms': ms[len(ms)//2],
+                             'p95_ms': ms[min(int(len(ms)*0.95), len(ms)-1)],
+                             'max_ms': ms[-1]}
+        return summary
+
+    def _cprofile_report(self, sort, limit):
+        """Private method listing the functions of a ``cprofile`` session."""
+        if self._active > 0:
+            # a snapshot needs the profiler off
+            self._profile.disable()
+        buf = StringIO()
+        try:
+            stats = pstats.Stats(self._profile, stream=buf)
+        except TypeError:
+            # nothing profiled yet
+            stats = None
+        if self._active > 0 and self.stopped is None:
+            self._profile.enable()
+        if stats is None:
+            return {'functions': [], 'text': ''}
+        stats.sort_stats(sort).print_stats(limit)
+        keys = {'cumulative': 3, 'cumtime': 3, 'time': 2, 'tottime': 2, 'calls': 1, 'ncalls': 1}
+        rows = sorted(stats.stats.items(), key=lambda x: x[1][keys.get(sort, 3)], reverse=True)
+        functions = [{'function': '{}:{}({})'.format(*func), 'calls': nc, 'primitive_calls': cc,
+                      'tottime': tt, 'cumtime': ct}
+                     for func, (cc, nc, tt, ct, _) in rows[:limit]]
+        return {'functions': functions, 'text': buf.getvalue()}
+
+    def _sample_report(self, limit):
+        """Private method listing the functions of a ``sample`` session."""
+        with self._lock:
+            stacks = self._stacks.copy()
+        own = Counter()
+        total = Counter()
+        for stack, n in stacks.items():
+            own[stack[-1]] += n
+            for func in set(stack):
+                total[func] += n
+        samples = sum(stacks.values())
+        functions = [{'function': func, 'self': own[func], 'total': n}
+                     for func, n in total.most_common(limit)]
+        return {'samples': samples, 'functions': functions,
+                'self': [{'function': f, 'samples': n} for f, n in own.most_common(limit)],
+                'stacks': ['{} {}'.format(';'.join(s), n) for s, n in stacks.most_common(limit)]}
+
+
+class Profiler(object):
+    """Holds the current profiling session of the server.
+
+    Attributes:
+        session: The current or last ``ProfileSession``, None if none was
+            started.
+    """
+
+    def __init__(self):
+        self.session = None
+
+    def begin(self, handler):
+        """Profile a request if the current session wants it."""
+        session = self.session
+        if session is not None and session.wants(type(handler).__name__):
+            session.begin(handler)
+
+    def end(self, handler):
+        """Stop profiling a request if it is profiled."""
+        session = getattr(handler, '_profiled', None)
+        if session is not None:
+            session.end(handler)
+
+
+profiler = Profiler()
+
+
+class ProfiledHandler(IPythonHandler):
+    """Base of the handlers which can be profiled on demand."""
+
+    def prepare(self):
+        super(ProfiledHandler, self).prepare()
+        profiler.begin(self)
+
+    def on_finish(self):
+        profiler.end(self)
+        super(ProfiledHandler, self).on_finish()
@@ -0,0 +1,409 @@
+import base64
+import math
+import zlib
+import numpy as np
+from .utils import tile_key, _tile_cell, _spread_bits
+
+# finest level of the count pyramid, and the most cells kept
+COUNT_LEVEL = 10
+MAX_COUNT_CELLS = 1 << 16
+# size classes are floor(log2(b)) within these
+B_CLASS_MIN = -40
+B_CLASS_MAX = 16
+
+
+class QuantileSketch(object):
+    """A mergeable sketch of the distribution of a numeric field.
+
+    Values are counted in bins of equal width anchored at zero, only bins
+    holding values are kept. The width is a power of two, chosen from the
+    spread of the first values added so that their central 99.8% span about
+    ``resolution`` bins, and doubled whenever more than ``max_bins`` bins
+    are held. Two sketches are merged by bringing the finer one to the width
+    of the other and adding counts, which is exact, so the sketch of a
+    catalog is kept up to date as data is added without reading it again.
+    Quantiles are interpolated within bins, they are off by less than a bin
+    width.
+
+    Attributes:
+        level(int): The bin width is ``2**level``, None until values are
+            added.
+        index: Sorted indices of the bins held, bin ``i`` covers
+            ``[i*2**level, (i+1)*2**level)``.
+        counts: Number of values in each bin held.
+        count(int): Number of values, NaN and infinite values left out.
+        min(float): The smallest value.
+        max(float): The largest value.
+    """
+
+    def __init__(self, resolution=256, max_bins=4096):
+        """
+        Args:
+            resolution(int): Number of bins across the bulk of the first
+                values added. Defaults to 256.
+            max_bins(int): The most bins held. Defaults to 4096.
+        """
+        self.resolution = resolution
+        self.max_bins = max_bins
+        self.level = None
+        self.index = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.count = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    @classmethod
+    def from_dict(cls, d):
+        """Rebuild a sketch saved with ``to_dict``."""
+        sketch = cls(d['resolution'], d['maxBins'])
+        sketch.level = d['level']
+        sketch.index = np.array(d['index'], dtype=np.int64)
+        sketch.counts = np.array(d['counts'], dtype=np.int64)
+        sketch.count = d['count']
+        (sketch.min, sketch.max) = (d['min'], d['max'])
+        return sketch
+
+    def to_dict(self):
+        """Return the sketch as a dictionary of plain types, for meta
+        information."""
+        return {'resolution': self.resolution, 'maxBins': self.max_bins,
+                'level': self.level, 'index': self.index.tolist(),
+                'counts': self.counts.tolist(), 'count': self.count,
+                'min': self.min, 'max': self.max}
+
+    def add(self, values, sample=100000):
+        """Add values to the sketch.
+
+        Args:
+            values(array): The values, NaN and infinite values are skipped.
+            sample(int): Number of values the bin width is chosen from.
+                Defaults to 100000.
+
+        Returns:
+            The sketch.
+        """
+        v = np.asarray(values, dtype=float)
+        v = v[np.isfinite(v)]
+        if len(v) == 0:
+            return self
+        (lo, hi) = (float(v.min()), float(v.max()))
+        if self.level is None:
+            bulk = np.percentile(v[::max(len(v)//sample, 1)], [0.1, 99.9])
+            span = bulk[1] - bulk[0]
+            if span <= 0:
+                span = max(abs(bulk[0]), 1.)
+            self.level = int(math.floor(math.log(span/self.resolution, 2)))
+        # keep bin indices well within int64
+        top = max(abs(lo), abs(hi))
+        if top > 0:
+            self._coarsen(int(math.ceil(math.log(top, 2))) - 60)
+        index, counts = np.unique(np.floor(v/2.**self.level).astype(np.int64),
+                                  return_counts=True)
+        self._combine(index, counts)
+        self.count += len(v)
+        self.min = min(self.min, lo)
+        self.max = max(self.max, hi)
+        return self
+
+    def merge(self, other):
+        """Add the values counted in another sketch.
+
+        Returns:
+            The sketch.
+        """
+        if other.level is None:
+            return self
+        if self.level is None:
+            self.level = other.level
+        self._coarsen(other.level)
+        shift = self.level - other.level
+        self._combine(other.index >> shift, other.counts)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def _coarsen(self, level):
+        """Private method widening bins to ``2**level`` if they are narrower."""
+        if level > self.level:
+            (index, counts) = (self.index >> (level - self.level), self.counts)
+            self.level = level
+            self.index = np.zeros(0, dtype=np.int64)
+            self.counts = np.zeros(0, dtype=np.int64)
+            self._combine(index, counts)
+
+    def _combine(self, index, counts):
+        """Private method adding counts to bins, then capping the bins held."""
+        index, inverse = np.unique(np.concatenate([self.index, index]), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts]),
+                                  minlength=len(index)).astype(np.int64)
+        self.index = index
+        while len(self.index) > self.max_bins:
+            self._coarsen(self.level + 1)
+
+    def _cdf(self):
+        """Private method returning the points of the piecewise linear
+        cumulative count, both edges of each bin held."""
+        width = 2.**self.level
+        cum = np.cumsum(self.counts)
+        x = np.column_stack([self.index*width, (self.index+1)*width]).ravel()
+        y = np.column_stack([cum - self.counts, cum]).ravel()
+        return x, y
+
+    def quantile(self, q):
+        """Return the value below which a fraction ``q`` of values lie.
+
+        Args:
+            q(float): The fraction, or an array of fractions, within 0 and 1.
+
+        Returns:
+            The value, or an array of values. NaN if the sketch is empty.
+        """
+        if self.count == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else float('nan')
+        x, y = self._cdf()
+        value = np.clip(np.interp(np.asarray(q, dtype=float)*self.count, y, x),
+                        self.min, self.max)
+        return value if np.ndim(value) else float(value)
+
+    def fraction(self, lower, upper):
+        """Return the fraction of values between two bounds."""
+        if self.count == 0:
+            return 0.
+        x, y = self._cdf()
+        return float(np.interp(upper, x, y) - np.interp(lower, x, y))/self.count
+
+    def percentile_range(self, lower=1., upper=99.):
+        """Return the values at two percentiles, as a list."""
+        return [float(x) for x in self.quantile([lower/100., upper/100.])]
+
+    def histogram(self, bins=64, range=None):
+        """Count values in bins of equal width.
+
+        Args:
+            bins(int): Number of bins. Defaults to 64.
+            range(list): The lower and upper edge of the bins. Defaults to
+                the 0.5 and 99.5 percentiles.
+
+        Returns:
+            A dictionary with the ``range`` and the ``counts`` in each bin,
+            and the number of values ``below`` and ``above`` the range.
+        """
+        if self.count == 0:
+            return {'range': [], 'counts': [], 'below': 0, 'above': 0}
+        if range is None:
+            range = self.percentile_range(0.5, 99.5)
+        x, y = self._cdf()
+        cdf = np.interp(np.linspace(range[0], range[1], bins+1), x, y)
+        return {'range': [float(range[0]), float(range[1])],
+                'counts': np.round(np.diff(cdf)).astype(int).tolist(),
+                'below': int(round(cdf[0])), 'above': int(round(self.count - cdf[-1]))}
+
+
+def _encode(a):
+    """Pack an int64 array into a string, for meta information."""
+    return base64.b64encode(zlib.compress(np.ascontiguousarray(a, dtype=np.int64).tobytes())).decode('ascii')
+
+
+def _decode(s, shape):
+    """Unpack an array packed by ``_encode``."""
+    return np.frombuffer(zlib.decompress(base64.b64decode(s)), dtype=np.int64).reshape(shape)
+
+
+class CountPyramid(object):
+    """Counts of objects per sky cell and size, for estimating query sizes.
+
+    Objects are counted in the cells of ``tile_key`` at ``level``, split in
+    size classes of semi-minor axis ``b``, class ``c`` holding ``b`` within
+    ``[2**c, 2**(c+1))``. Cells are kept in Morton order with cumulative
+    counts, so the count of any coarser cell, the pyramid above, is the
+    difference of two cumulative counts found by binary search. A box is
+    covered by at most ``max_query_cells`` cells at the finest level that
+    allows it, cells on its edges are counted for the part of their area
+    inside. Cells are merged four to one whenever more than ``max_cells``
+    are held, and two pyramids merge exactly after bringing them to the
+    same level, so the counts are kept up to date as data is added.
+
+    Attributes:
+        level(int): The level of the cells held.
+        class_min(int): The first size class.
+        keys: Sorted Morton keys of the cells holding objects.
+        counts: Number of objects in each cell (rows) and size class
+            (columns).
+    """
+
+    def __init__(self, level=COUNT_LEVEL, max_cells=MAX_COUNT_CELLS):
+        """
+        Args:
+            level(int): The finest level counted. Defaults to
+                ``COUNT_LEVEL``.
+            max_cells(int): The most cells held. Defaults to
+                ``MAX_COUNT_CELLS``.
+        """
+        self.level = level
+        self.max_cells = max_cells
+        self.class_min = 0
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+        self._cum = None
+
+    @classmethod
+    def from_dict(cls, d):
+        """Rebuild a pyramid saved with ``to_dict``."""
+        counts = cls(d['level'], d['maxCells'])
+        counts.class_min = d['classMin']
+        counts.keys = _decode(d['keys'], (-1,))
+        counts.counts = _decode(d['counts'], (len(counts.keys), d['nClass']))
+        return counts
+
+    def to_dict(self):
+        """Return the pyramid as a dictionary of plain types, for meta
+        information. Arrays are compressed into strings."""
+        return {'level': self.level, 'maxCells': self.max_cells,
+                'classMin': self.class_min, 'nClass': self.counts.shape[1],
+                'keys': _encode(self.keys), 'counts': _encode(self.counts)}
+
+    def total(self):
+        """Return the number of objects counted."""
+        return int(self.counts.sum())
+
+    def add(self, ra, dec, b):
+        """Count objects.
+
+        Args:
+            ra(array): RA of the objects in degrees.
+            dec(array): DEC of the objects in degrees.
+            b(array): Semi-minor axes of the objects in degrees.
+
+        Returns:
+            The pyramid.
+        """
+        if len(ra) == 0:
+            return self
+        keys = tile_key(ra, dec, self.level)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            size = np.floor(np.log2(np.asarray(b, dtype=float)))
+        size = np.where(np.isnan(size), B_CLASS_MIN, size)
+        size = np.clip(size, B_CLASS_MIN, B_CLASS_MAX).astype(np.int64)
+        class_min = int(size.min())
+        n_class = int(size.max()) - class_min + 1
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse*n_class + size - class_min,
+                             minlength=len(uniq)*n_class).reshape(len(uniq), n_class)
+        self._combine(self.level, class_min, uniq, counts)
+        return self
+
+    def merge(self, other):
+        """Add the objects counted in another pyramid.
+
+        Returns:
+            The pyramid.
+        """
+        self._combine(other.level, other.class_min, other.keys, other.counts)
+        return self
+
+    def _combine(self, level, class_min, keys, counts):
+        """Private method adding counts at a level, then capping the cells
+        held."""
+        if len(keys) == 0:
+            return
+        if len(self.keys) == 0:
+            (self.level, self.class_min) = (level, class_min)
+            (self.keys, self.counts) = (keys, counts)
+        else:
+            if level < self.level:
+                self._coarsen(level)
+            keys = keys >> 2*(level - self.level)
+            first = min(self.class_min, class_min)
+            last = max(self.class_min + self.counts.shape[1], class_min + counts.shape[1])
+            both = np.zeros((len(self.keys) + len(keys), last - first), dtype=np.int64)
+            both[:len(self.keys), self.class_min-first:self.class_min-first+self.counts.shape[1]] = self.counts
+            both[len(self.keys):, class_min-first:class_min-first+counts.shape[1]] = counts
+            self.class_min = first
+            self._aggregate(np.concatenate([self.keys, keys]), both)
+        while len(self.keys) > self.max_cells:
+            self._coarsen(self.level - 1)
+        self._cum = None
+
+    def _coarsen(self, level):
+        """Private method merging cells up to a coarser level."""
+        keys = self.keys >> 2*(self.level - level)
+        self.level = level
+        self._aggregate(keys, self.counts)
+
+    def _aggregate(self, keys, counts):
+        """Private method summing the counts of equal keys."""
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        uniq, start = np.unique(keys, return_index=True)
+        self.keys = uniq
+        self.counts = np.add.reduceat(counts[order], start, axis=0)
+
+    def _class_weights(self, min_b):
+        """Private method returning the fraction of each size class at least
+        ``min_b``, taking sizes as log-uniform within a class."""
+        size = self.class_min + np.arange(self.counts.shape[1])
+        if min_b <= 0:
+            return np.ones(len(size))
+        return np.clip(size + 1 - math.log(min_b, 2), 0., 1.)
+
+    def count(self, box, min_b=0., max_query_cells=4096):
+        """Estimate the number of objects in a box at least ``min_b`` in size.
+
+        Args:
+            box(tuple): The smallest and largest ``RA`` and ``DEC``.
+            min_b(float): The smallest semi-minor axis counted. Defaults to
+                0.
+            max_query_cells(int): The most cells used to cover the box.
+                Defaults to 4096.
+
+        Returns:
+            float: The estimated count.
+        """
+        if len(self.keys) == 0:
+            return 0.
+        if self._cum is None:
+            self._cum = np.vstack([np.zeros((1, self.counts.shape[1]), dtype=np.int64),
+                                   np.cumsum(self.counts, axis=0)])
+        (xMin, yMin, xMax, yMax) = box
+        for l in range(self.level, -1, -1):
+            x0, y0 = _tile_cell(xMin, yMin, l)
+            x1, y1 = _tile_cell(xMax, yMax, l)
+            if (x1-x0+1)*(y1-y0+1) <= max_query_cells:
+                break
+        xs, ys = np.meshgrid(np.arange(x0, x1+1), np.arange(y0, y1+1))
+        (xs, ys) = (xs.ravel(), ys.ravel())
+        (w, h) = (360./2**l, 180./2**l)
+        fx = np.clip((np.minimum((xs+1)*w, xMax) - np.maximum(xs*w, xMin))/w, 0., 1.)
+        fy = np.clip((np.minimum((ys+1)*h-90., yMax) - np.maximum(ys*h-90., yMin))/h, 0., 1.)
+        code = _spread_bits(xs) | (_spread_bits(ys) << 1)
+        shift = 2*(self.level - l)
+        lo = np.searchsorted(self.keys, code << shift)
+        hi = np.searchsorted(self.keys, (code+1) << shift)
+        cells = (self._cum[hi] - self._cum[lo]).dot(self._class_weights(min_b))
+        return float((cells*fx*fy).sum())
+
+
+def estimate_count(counts, sketches, box, min_b=0., filters=None):
+    """Estimate the number of objects in a box passing filters.
+
+    Filters are taken as independent of position and of each other, each
+    scaling the count by the fraction of objects within its range.
+
+    Args:
+        counts: The ``CountPyramid`` of the catalog.
+        sketches(dict): The ``QuantileSketch`` of each field.
+        box(tuple): The smallest and largest ``RA`` and ``DEC``.
+        min_b(float): The smallest semi-minor axis counted.
+        filters(dict): Lower and upper bound for fields, fields without a
+            sketch are ignored.
+
+    Returns:
+        float: The estimated count.
+    """
+    n = counts.count(box, min_b)
+    for field, (lower, upper) in (filters or {}).items():
+        sketch = sketches.get(field.upper())
+        if sketch is not None:
+            n *= sketch.fraction(lower, upper)
+    return n
@@ -0,0 +1,4 @@
+from .base import StorageBackend
+from .mongo import MongoBackend
+from .embedded import EmbeddedBackend, EmbeddedCatalog
+from .columnar import ColumnarBackend, ColumnarCatalog
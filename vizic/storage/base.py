@@ -0,0 +1,155 @@
+class StorageBackend(object):
+    """Interface for storing and querying catalogs.
+
+    A backend keeps the formatted catalog data and the meta information of
+    each catalog. ``Connection`` writes catalogs through it, and the server
+    extension reads tiles, selections, popups and full scans from it.
+
+    Meta information is a dictionary with the fields written by
+    ``Connection`` (``adjust``, ``xRange``, ``yRange``, ``minmax``,
+    ``radius``, ``point``, ``catCt``, ``index``), and the ingestion manifest
+    under ``ingest`` while an ingestion is unfinished.
+
+    Attributes:
+        name(str): The name of the backend.
+        db_name(str): The name of the database used.
+    """
+    name = None
+
+    def database(self, db):
+        """Return a backend of the same kind for another database."""
+        raise NotImplementedError
+
+    def catalogs(self):
+        """Return the names of the stored catalogs."""
+        raise NotImplementedError
+
+    def get_meta(self, name):
+        """Return the meta information of a catalog, or None."""
+        raise NotImplementedError
+
+    def update_meta(self, name, fields=None, unset=None):
+        """Set and remove fields of the meta information of a catalog.
+
+        The meta information is created if it doesn't exist.
+
+        Args:
+            name(str): The catalog name.
+            fields(dict): Fields to set, keys may be dotted paths into
+                nested dictionaries.
+            unset(list): Fields to remove.
+        """
+        raise NotImplementedError
+
+    def add_done(self, name, chunk_ids):
+        """Add landed chunks to the ingestion manifest of a catalog."""
+        manifest = self.get_meta(name)['ingest']
+        done = sorted(set(manifest['done']) | set(chunk_ids))
+        self.update_meta(name, {'ingest.done': done})
+
+    def save_composite(self, name, composite):
+        """Store a composite of catalogs served as one tile layer.
+
+        Args:
+            name(str): The name of the composite.
+            composite(dict): The ``members``, ``adjust``, ``xRange`` and
+                ``yRange`` of the composite.
+        """
+        raise NotImplementedError
+
+    def composites(self):
+        """Return the stored composites as a dictionary by name."""
+        raise NotImplementedError
+
+    def drop(self, name):
+        """Remove a catalog, its meta information and data derived from it."""
+        raise NotImplementedError
+
+    def delete_rank(self, name, cat_rank):
+        """Remove the objects of a catalog added with ``cat_rank``."""
+        raise NotImplementedError
+
+    def insert(self, name, chunk, cat_rank, first_id, strategy='2d', retries=3):
+        """Insert a chunk of a formatted catalog.
+
+        Inserting the same chunk again has no effect, so interrupted
+        ingestions can be resumed. May be called from several threads.
+
+        Args:
+            name(str): The catalog name.
+            chunk: A pandas dataframe with the formatted rows.
+            cat_rank(int): The ``cat_rank`` given to the inserted objects.
+            first_id(int): The id of the first row of the chunk, rows are
+                numbered consecutively.
+            strategy(str): The index strategy of the catalog.
+            retries(int): Number of retries after network errors.
+
+        Returns:
+            The number of rows inserted.
+        """
+        raise NotImplementedError
+
+    def finalize(self, name, strategy='2d'):
+        """Make the data inserted so far queryable, called once every chunk
+        of an ingestion landed."""
+        pass
+
+    def invalidate(self, name, boxes, extent=False):
+        """Invalidate data derived from a catalog after objects were added.
+
+        Nothing is derived from catalogs by default.
+
+        Args:
+            name(str): The catalog name.
+            boxes(list): The smallest and largest ``RA`` and ``DEC`` of
+                boxes holding all added objects.
+            extent(bool): Whether the extent of the catalog grew.
+        """
+        pass
+
+    def create_indexes(self, name, strategy, background=True):
+        """Create the indexes of a catalog for an index strategy."""
+        raise NotImplementedError
+
+    def index_size(self, name, strategy):
+        """Return the size in bytes of each index of a catalog."""
+        raise NotImplementedError
+
+    def count(self, name):
+        """Return the number of objects in a catalog."""
+        raise NotImplementedError
+
+    def scan(self, name, fields, dec_range=None):
+        """Read given fields for all objects of a catalog.
+
+        The ``_id`` of objects is read only if given in ``fields``. Given a
+        ``dec_range``, only objects with ``DEC`` from its lower bound up to,
+        but excluding, its upper bound are read.
+
+        Returns:
+            A pandas dataframe.
+        """
+        raise NotImplementedError
+
+    def box(self, name, box, min_b, strategy='2d', exclude=()):
+        """Find objects in a box at least ``min_b`` in size.
+
+        Args:
+            name(str): The catalog name.
+            box(tuple): The smallest and largest ``RA`` and ``DEC``.
+            min_b(float): The smallest semi-minor axis returned.
+            strategy(str): The index strategy of the catalog.
+            exclude(tuple): Fields left out of the results.
+
+        Returns:
+            A list of dictionaries.
+        """
+        raise NotImplementedError
+
+    def popup(self, name, ra, dec, exclude=()):
+        """Find objects at exactly a position.
+
+        Returns:
+            A list of dictionaries.
+        """
+        raise NotImplementedError
@@ -0,0 +1,277 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from .embedded import EmbeddedBackend, EmbeddedCatalog
+from ..utils import tile_key, tile_key_ranges, TILE_KEY_LEVEL
+
+# level of the cells in the offsets index, 4**OFFSET_LEVEL cells
+OFFSET_LEVEL = 8
+
+
+class ColumnarCatalog(EmbeddedCatalog):
+    """A catalog memory-mapped from per-column NumPy files.
+
+    Columns are stored in Morton order, with an offsets index giving where
+    the rows of each cell at level ``OFFSET_LEVEL`` start. A box query
+    binary-searches the keys within the cells it covers only, and reads
+    the selected rows straight from the mapped files, so only the pages
+    holding them are loaded.
+
+    Attributes:
+        path(str): The directory holding the column files.
+        offsets: The start row of each cell, followed by the row count.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path(str): The directory holding the column files.
+        """
+        self.path = path
+        with open(os.path.join(path, 'columns.json')) as f:
+            names = json.load(f)
+        columns = {k: np.load(os.path.join(path, 'c{}.npy'.format(i)), mmap_mode='r')
+                   for i, k in enumerate(names)}
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        super(ColumnarCatalog, self).__init__(columns)
+
+    def box_index(self, box):
+        (xMin, yMin, xMax, yMax) = box
+        shift = 2*(TILE_KEY_LEVEL-OFFSET_LEVEL)
+        slices = []
+        for lo, hi in tile_key_ranges(xMin, yMin, xMax, yMax):
+            a = int(self.offsets[lo >> shift])
+            b = int(self.offsets[((hi-1) >> shift)+1])
+            i0, i1 = a + np.searchsorted(self.keys[a:b], [lo, hi])
+            if i1 > i0:
+                slices.append(np.arange(i0, i1))
+        if len(slices) == 0:
+            return np.zeros(0, dtype=np.int64)
+        idx = np.concatenate(slices)
+        ra = self.columns['RA'][idx]
+        dec = self.columns['DEC'][idx]
+        inside = (ra >= xMin) & (ra <= xMax) & (dec >= yMin) & (dec <= yMax)
+        return idx[inside]
+
+
+class ColumnarBackend(EmbeddedBackend):
+    """Catalogs stored on disk as memory-mapped column files.
+
+    Meant for catalogs too big for memory. Each catalog is a directory of
+    ``.npy`` files, one per column, sorted by Morton key, plus an offsets
+    index per cell (see ``ColumnarCatalog``). Inserted chunks are saved as
+    they land, and merged by a bucket sort when the ingestion is finalized:
+    rows are scattered to their cells block by block, then each run of
+    cells is sorted on its own, so memory stays bounded by ``block`` rows.
+    Meta information is kept as in ``EmbeddedBackend``.
+
+    Attributes:
+        block(int): Number of rows sorted in memory at a time.
+    """
+    name = 'columnar'
+
+    def __init__(self, path, db='vis', block=1 << 22):
+        """
+        Args:
+            path(str): The directory holding the databases, created if
+                needed.
+            db(str): The database name. Defaults to ``vis``.
+            block(int): Number of rows sorted in memory at a time. Defaults
+                to 4194304.
+        """
+        super(ColumnarBackend, self).__init__(path, db)
+        self.block = block
+
+    def database(self, db):
+        return ColumnarBackend(self.path, db, self.block)
+
+    def drop(self, name):
+        super(ColumnarBackend, self).drop(name)
+        shutil.rmtree(self._file(name, '.cols'), ignore_errors=True)
+
+    def insert(self, name, chunk, cat_rank, first_id, strategy='2d', retries=3):
+        """Insert a chunk of a formatted catalog.
+
+        The chunk is saved as a directory of column files named after
+        ``first_id``. Text columns are stored as fixed width unicode, missing
+        values as empty strings.
+        """
+        parts = self._file(name, '.parts')
+        if not os.path.isdir(parts):
+            try:
+                os.makedirs(parts)
+            except OSError:
+                # made by another thread
+                pass
+        columns = {}
+        for k in chunk.columns:
+            col = chunk[k]
+            if col.dtype.kind == 'O' or pd.api.types.is_string_dtype(col.dtype):
+                # also pandas string arrays, which astype(str) leaves as they are
+                columns[k] = np.asarray(col.to_numpy(dtype=object, na_value=''), dtype=str)
+            else:
+                columns[k] = col.values
+        columns['cat_rank'] = np.full(chunk.shape[0], cat_rank, dtype=np.int64)
+        columns['_id'] = np.arange(first_id, first_id+chunk.shape[0], dtype=np.int64)
+        columns['_tilekey'] = tile_key(columns['RA'], columns['DEC'])
+        path = os.path.join(parts, str(first_id))
+        shutil.rmtree(path + '.tmp', ignore_errors=True)
+        self._save_columns(path + '.tmp', columns)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(path + '.tmp', path)
+        return chunk.shape[0]
+
+    def _save_columns(self, path, columns):
+        """Private method saving column arrays to a directory."""
+        os.makedirs(path)
+        names = list(columns.keys())
+        for i, k in enumerate(names):
+            np.save(os.path.join(path, 'c{}.npy'.format(i)), columns[k])
+        with open(os.path.join(path, 'columns.json'), 'w') as f:
+            json.dump(names, f)
+
+    def _load_columns(self, path):
+        """Private method memory-mapping the column files in a directory."""
+        with open(os.path.join(path, 'columns.json')) as f:
+            names = json.load(f)
+        return {k: np.load(os.path.join(path, 'c{}.npy'.format(i)), mmap_mode='r')
+                for i, k in enumerate(names)}
+
+    def finalize(self, name, strategy='2d'):
+        """Merge the inserted chunks into the catalog files."""
+        parts = self._file(name, '.parts')
+        if not os.path.isdir(parts):
+            return
+        sources = []
+        cat = self.catalog(name)
+        if cat is not None:
+            sources.append(cat.columns)
+        dirs = sorted((x for x in os.listdir(parts) if not x.endswith('.tmp')), key=int)
+        sources += [self._load_columns(os.path.join(parts, x)) for x in dirs]
+        self._write_sorted(name, sources)
+        shutil.rmtree(parts, ignore_errors=True)
+
+    def delete_rank(self, name, cat_rank):
+        shutil.rmtree(self._file(name, '.parts'), ignore_errors=True)
+        cat = self.catalog(name)
+        if cat is not None and (cat.columns['cat_rank'] == cat_rank).any():
+            self._write_sorted(name, [cat.columns], cat_rank)
+
+    def _write_sorted(self, name, sources, drop_rank=None):
+        """Private method writing sources as one catalog in Morton order.
+
+        Args:
+            name(str): The catalog name.
+            sources(list): Dictionaries of column arrays, each with
+                ``_tilekey``.
+            drop_rank(int): A ``cat_rank`` left out, if given.
+        """
+        shift = 2*(TILE_KEY_LEVEL-OFFSET_LEVEL)
+        n_cell = 4**OFFSET_LEVEL
+        block = self.block
+
+        def keep(src, i):
+            if drop_rank is None:
+                return slice(None)
+            return src['cat_rank'][i:i+block] != drop_rank
+
+        # column types over all sources, int columns missing somewhere become float
+        dtypes = {}
+        for src in sources:
+            for k, v in src.items():
+                dtypes[k] = np.promote_types(dtypes[k], v.dtype) if k in dtypes else v.dtype
+        for k in dtypes:
+            if any(k not in src for src in sources) and dtypes[k].kind in 'iu':
+                dtypes[k] = np.dtype(float)
+
+        # count rows per cell
+        counts = np.zeros(n_cell, dtype=np.int64)
+        for src in sources:
+            for i in range(0, len(src['_tilekey']), block):
+                key = src['_tilekey'][i:i+block][keep(src, i)]
+                counts += np.bincount(key >> shift, minlength=n_cell)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        total = int(offsets[-1])
+
+        out_path = self._file(name, '.cols.new')
+        shutil.rmtree(out_path, ignore_errors=True)
+        os.makedirs(out_path)
+        names = list(dtypes.keys())
+        out = {k: np.lib.format.open_memmap(os.path.join(out_path, 'c{}.npy'.format(i)),
+                                            mode='w+', dtype=dtypes[k], shape=(total,))
+               for i, k in enumerate(names)}
+
+        # scatter rows to their cells
+        pos = offsets[:-1].copy()
+        for src in sources:
+            for i in range(0, len(src['_tilekey']), block):
+                sel = keep(src, i)
+                cell = src['_tilekey'][i:i+block][sel] >> shift
+                order = np.argsort(cell, kind='mergesort')
+                cell = cell[order]
+                uniq, first, cnt = np.unique(cell, return_index=True, return_counts=True)
+                dest = pos[cell] + np.arange(len(cell)) - np.repeat(first, cnt)
+                pos[uniq] += cnt
+                for k in names:
+                    if k in src:
+                        out[k][dest] = src[k][i:i+block][sel][order]
+                    else:
+                        out[k][dest] = self._fill(dtypes[k])
+
+        # sort runs of cells by the full key
+        keys = out['_tilekey']
+        start = 0
+        while start < total:
+            c = np.searchsorted(offsets, start+block, side='right')-1
+            end = int(offsets[c]) if offsets[c] > start else \
+                int(offsets[np.searchsorted(offsets, start, side='right')])
+            order = np.argsort(keys[start:end], kind='mergesort')
+            for k in names:
+                out[k][start:end] = out[k][start:end][order]
+            start = end
+
+        for k in names:
+            out[k].flush()
+        del out
+        np.save(os.path.join(out_path, 'offsets.npy'), offsets)
+        with open(os.path.join(out_path, 'columns.json'), 'w') as f:
+            json.dump(names, f)
+
+        path = self._file(name, '.cols')
+        shutil.rmtree(path + '.old', ignore_errors=True)
+        if os.path.isdir(path):
+            os.rename(path, path + '.old')
+        os.rename(out_path, path)
+        shutil.rmtree(path + '.old', ignore_errors=True)
+        self._cache.pop(name, None)
+
+    def _fill(self, dtype):
+        """Private method returning the value filling missing columns."""
+        if dtype.kind == 'f':
+            return np.nan
+        if dtype.kind == 'M':
+            return np.datetime64('NaT')
+        if dtype.kind in 'US':
+            return ''
+        return 0
+
+    def catalog(self, name):
+        """Return the mapped catalog, or None if nothing is stored yet."""
+        path = self._file(name, '.cols')
+        index = os.path.join(path, 'columns.json')
+        if not os.path.exists(index):
+            return None
+        mtime = os.path.getmtime(index)
+        cached = self._cache.get(name)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, ColumnarCatalog(path))
+            self._cache[name] = cached
+        return cached[1]
+
+    def index_size(self, name, strategy):
+        cat = self.catalog(name)
+        if cat is None:
+            return {'_tilekey': 0, 'offsets': 0}
+        return {'_tilekey': int(cat.keys.nbytes), 'offsets': int(cat.offsets.nbytes)}
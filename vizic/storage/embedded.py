@@ -0,0 +1,282 @@
+import json
+import os
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from .base import StorageBackend
+from ..utils import tile_key, tile_key_ranges
+
+# columns kept for the engine, never returned
+INTERNAL = ['_tilekey', '_id']
+
+
+class EmbeddedCatalog(object):
+    """A catalog held in memory as NumPy column arrays.
+
+    Rows are sorted by the Morton key of their position (see
+    ``vizic.utils.tile_key``), so the objects in a box are found as a few
+    contiguous slices located by binary search on the keys, before an exact
+    cut on position and size.
+
+    Attributes:
+        columns(dict): Column arrays, all in Morton order.
+        keys: The sorted Morton keys.
+    """
+
+    def __init__(self, columns):
+        """
+        Args:
+            columns(dict): Column arrays, with ``_tilekey`` sorted.
+        """
+        self.columns = columns
+        self.keys = columns['_tilekey']
+
+    @classmethod
+    def load(cls, path):
+        """Load a catalog saved with ``save``."""
+        with np.load(path, allow_pickle=True) as data:
+            return cls({k: data[k] for k in data.files})
+
+    @classmethod
+    def build(cls, columns):
+        """Sort column arrays by Morton key into a new catalog."""
+        columns = dict(columns)
+        keys = tile_key(columns['RA'], columns['DEC'])
+        order = np.argsort(keys, kind='mergesort')
+        columns = {k: v[order] for k, v in columns.items()}
+        columns['_tilekey'] = keys[order]
+        return cls(columns)
+
+    def save(self, path):
+        """Save the catalog to an uncompressed ``.npz`` file, atomically."""
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **self.columns)
+        os.rename(tmp, path)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def box_index(self, box):
+        """Return the row numbers of objects in a box, in Morton order."""
+        (xMin, yMin, xMax, yMax) = box
+        slices = []
+        for lo, hi in tile_key_ranges(xMin, yMin, xMax, yMax):
+            i0, i1 = np.searchsorted(self.keys, [lo, hi])
+            if i1 > i0:
+                slices.append(np.arange(i0, i1))
+        if len(slices) == 0:
+            return np.zeros(0, dtype=np.int64)
+        idx = np.concatenate(slices)
+        ra = self.columns['RA'][idx]
+        dec = self.columns['DEC'][idx]
+        inside = (ra >= xMin) & (ra <= xMax) & (dec >= yMin) & (dec <= yMax)
+        return idx[inside]
+
+    def records(self, idx, exclude=()):
+        """Return the given rows as a list of dictionaries."""
+        keys = [k for k in self.columns.keys() if k not in INTERNAL and k not in exclude]
+        cols = [self.columns[k][idx].tolist() for k in keys]
+        return [dict(zip(keys, row)) for row in zip(*cols)]
+
+
+class EmbeddedBackend(StorageBackend):
+    """Catalogs stored in process, without a database service.
+
+    Each catalog is saved in a directory as a ``.npz`` file of Morton sorted
+    column arrays (see ``EmbeddedCatalog``) next to a JSON file of meta
+    information, so that both the kernel and the server extension can load
+    it. Chunks are saved as they are inserted and merged into the catalog
+    when the ingestion is finalized. Loaded catalogs are kept in memory
+    until their file changes.
+
+    Attributes:
+        path(str): The directory holding the databases.
+        db_name(str): The database, a sub directory of ``path``.
+    """
+    name = 'embedded'
+
+    def __init__(self, path, db='vis'):
+        """
+        Args:
+            path(str): The directory holding the databases, created if
+                needed.
+            db(str): The database name. Defaults to ``vis``.
+        """
+        self.path = os.path.abspath(path)
+        self.db_name = db
+        self.root = os.path.join(self.path, db)
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def database(self, db):
+        return EmbeddedBackend(self.path, db)
+
+    def _file(self, name, ext):
+        return os.path.join(self.root, name + ext)
+
+    def catalogs(self):
+        return sorted(x[:-len('.meta.json')] for x in os.listdir(self.root)
+                      if x.endswith('.meta.json'))
+
+    def get_meta(self, name):
+        path = self._file(name, '.meta.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            meta = json.load(f)
+        meta['_id'] = name
+        return meta
+
+    def update_meta(self, name, fields=None, unset=None):
+        with self._lock:
+            meta = self.get_meta(name) or {}
+            meta.pop('_id', None)
+            for k, v in (fields or {}).items():
+                node = meta
+                path = k.split('.')
+                for p in path[:-1]:
+                    node = node.setdefault(p, {})
+                node[path[-1]] = v
+            for k in (unset or []):
+                meta.pop(k, None)
+            tmp = self._file(name, '.meta.json.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(meta, f)
+            os.rename(tmp, self._file(name, '.meta.json'))
+
+    def save_composite(self, name, composite):
+        # in one file, so composites aren't listed as catalogs
+        with self._lock:
+            composites = self.composites()
+            composites[name] = composite
+            path = os.path.join(self.root, 'composites.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(composites, f)
+            os.rename(path + '.tmp', path)
+
+    def composites(self):
+        path = os.path.join(self.root, 'composites.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def drop(self, name):
+        for ext in ['.npz', '.meta.json']:
+            if os.path.exists(self._file(name, ext)):
+                os.remove(self._file(name, ext))
+        shutil.rmtree(self._file(name, '.parts'), ignore_errors=True)
+        self._cache.pop(name, None)
+
+    def delete_rank(self, name, cat_rank):
+        shutil.rmtree(self._file(name, '.parts'), ignore_errors=True)
+        cat = self.catalog(name)
+        if cat is not None and (cat.columns['cat_rank'] == cat_rank).any():
+            keep = cat.columns['cat_rank'] != cat_rank
+            EmbeddedCatalog({k: v[keep] for k, v in cat.columns.items()}).save(self._file(name, '.npz'))
+
+    def insert(self, name, chunk, cat_rank, first_id, strategy='2d', retries=3):
+        """Insert a chunk of a formatted catalog.
+
+        The chunk is saved on its own, named after ``first_id``, and is only
+        queryable once the ingestion is finalized.
+        """
+        parts = self._file(name, '.parts')
+        if not os.path.isdir(parts):
+            try:
+                os.makedirs(parts)
+            except OSError:
+                # made by another thread
+                pass
+        columns = {k: chunk[k].values for k in chunk.columns}
+        columns['cat_rank'] = np.full(chunk.shape[0], cat_rank, dtype=np.int64)
+        columns['_id'] = np.arange(first_id, first_id+chunk.shape[0], dtype=np.int64)
+        path = os.path.join(parts, '{}.npz'.format(first_id))
+        np.savez(path + '.tmp.npz', **columns)
+        os.rename(path + '.tmp.npz', path)
+        return chunk.shape[0]
+
+    def finalize(self, name, strategy='2d'):
+        """Merge the inserted chunks into the catalog and sort it."""
+        parts = self._file(name, '.parts')
+        if not os.path.isdir(parts):
+            return
+        frames = []
+        cat = self.catalog(name)
+        if cat is not None:
+            frames.append({k: v for k, v in cat.columns.items() if k != '_tilekey'})
+        files = sorted((x for x in os.listdir(parts) if x.endswith('.npz') and '.tmp' not in x),
+                       key=lambda x: int(x.split('.')[0]))
+        for x in files:
+            with np.load(os.path.join(parts, x), allow_pickle=True) as data:
+                frames.append({k: data[k] for k in data.files})
+        keys = []
+        for f in frames:
+            keys += [k for k in f.keys() if k not in keys]
+        columns = {}
+        for k in keys:
+            columns[k] = np.concatenate([f[k] if k in f else self._missing(f, frames, k)
+                                         for f in frames])
+        EmbeddedCatalog.build(columns).save(self._file(name, '.npz'))
+        shutil.rmtree(parts, ignore_errors=True)
+        self._cache.pop(name, None)
+
+    def _missing(self, frame, frames, key):
+        """Private method filling a column missing from part of a catalog."""
+        n = len(frame['_id'])
+        kind = [f[key].dtype.kind for f in frames if key in f][0]
+        if kind in 'fiub':
+            return np.full(n, np.nan)
+        return np.full(n, None, dtype=object)
+
+    def catalog(self, name):
+        """Return the loaded catalog, or None if nothing is stored yet."""
+        path = self._file(name, '.npz')
+        if not os.path.exists(path):
+            return None
+        mtime = os.path.getmtime(path)
+        cached = self._cache.get(name)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, EmbeddedCatalog.load(path))
+            self._cache[name] = cached
+        return cached[1]
+
+    def create_indexes(self, name, strategy, background=True):
+        # Morton order is the index, built when finalizing
+        pass
+
+    def index_size(self, name, strategy):
+        cat = self.catalog(name)
+        return {'_tilekey': int(cat.keys.nbytes) if cat is not None else 0}
+
+    def count(self, name):
+        cat = self.catalog(name)
+        return 0 if cat is None else len(cat)
+
+    def scan(self, name, fields, dec_range=None):
+        cat = self.catalog(name)
+        if cat is None:
+            return pd.DataFrame(columns=list(fields))
+        if dec_range is None:
+            return pd.DataFrame({k: cat.columns[k] for k in fields if k in cat.columns})
+        dec = cat.columns['DEC']
+        idx = np.flatnonzero((dec >= dec_range[0]) & (dec < dec_range[1]))
+        return pd.DataFrame({k: cat.columns[k][idx] for k in fields if k in cat.columns})
+
+    def box(self, name, box, min_b, strategy='2d', exclude=()):
+        cat = self.catalog(name)
+        if cat is None:
+            return []
+        idx = cat.box_index(box)
+        idx = idx[cat.columns['b'][idx] >= min_b]
+        return cat.records(idx, exclude)
+
+    def popup(self, name, ra, dec, exclude=()):
+        cat = self.catalog(name)
+        if cat is None:
+            return []
+        idx = cat.box_index((ra, dec, ra, dec))
+        return cat.records(idx, exclude)
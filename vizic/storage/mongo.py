@@ -0,0 +1,342 @@
+import math
+import time
+import numpy as np
+import pandas as pd
+import pymongo as pmg
+import gridfs
+from pymongo.errors import AutoReconnect, BulkWriteError
+from .base import StorageBackend
+from ..utils import (
+    tile_key, min_zoom, tile_key_ranges, migrate_meta, META_COLLECTION,
+    get_pix_bbox, get_vert, bin_healpix, healpix_docs
+)
+
+# indexes built for each index strategy
+INDEXES = {
+    '2d': [([('loc', pmg.GEO2D)], {'name': 'geo_loc_2d', 'min': -90, 'max': 360}),
+           ([('b', pmg.ASCENDING)], {'name': 'semi_axis'})],
+    '2d_compound': [([('loc', pmg.GEO2D), ('b', pmg.ASCENDING)],
+                     {'name': 'geo_loc_2d_b', 'min': -90, 'max': 360})],
+    '2dsphere': [([('sky', pmg.GEOSPHERE), ('b', pmg.ASCENDING)],
+                  {'name': 'geo_sky_2dsphere_b'})],
+    'tilekey': [([('tilekey', pmg.ASCENDING), ('minzoom', pmg.ASCENDING)],
+                 {'name': 'tilekey_minzoom'})]
+}
+
+# fields added for indexing, never returned
+INDEX_FIELDS = ['loc', 'sky', 'tilekey', 'minzoom']
+
+
+def box_query(strategy, box, min_b):
+    """Build the query for objects in a box at least ``min_b`` in size.
+
+    The shape of the query follows the index strategy of the catalog.
+
+    Args:
+        strategy(str): The index strategy of the catalog.
+        box(tuple): The smallest and largest coordinate in both x and y
+            direction.
+        min_b(float): The smallest semi-minor axis returned.
+
+    Returns:
+        A dictionary for ``find``.
+    """
+    (xMin, yMin, xMax, yMax) = box
+    exact = [
+        {'RA': {'$gte': xMin, '$lte': xMax}},
+        {'DEC': {'$gte': yMin, '$lte': yMax}},
+        {'b': {'$gte': min_b}}
+    ]
+    if strategy == '2dsphere':
+        return {'$and': [{'$or': [
+            {'sky': {'$geoWithin': {'$geometry': poly}}}
+            for poly in sky_polygons(box)]}] + exact}
+    elif strategy == 'tilekey':
+        return {'$and': [{'$or': [
+            {'tilekey': {'$gte': lo, '$lt': hi}}
+            for lo, hi in tile_key_ranges(xMin, yMin, xMax, yMax)]},
+            {'minzoom': {'$lte': int(min_zoom(min_b))}}] + exact}
+    return {'$and':[
+        {
+            'loc': {
+                '$geoWithin':{
+                    '$box': [
+                        [xMin,yMin],
+                        [xMax,yMax]
+                    ]
+                }
+            }
+        },
+        {'b': {'$gte': min_b}}
+    ]}
+
+
+def sky_polygons(box, max_width=90.):
+    """Cover a box with GeoJSON polygons for a 2dsphere query.
+
+    Polygon edges are great circles, so the box is split in strips at most
+    ``max_width`` degrees wide, with edges of constant DEC sampled every
+    degree at most and padded to contain the box.
+
+    Args:
+        box(tuple): The smallest and largest RA and DEC of the box.
+        max_width(float): The widest strip in degrees.
+
+    Returns:
+        A list of GeoJSON polygons.
+    """
+    (xMin, yMin, xMax, yMax) = box
+    pad = 0.01
+    lo = max(yMin-pad, -89.9999)
+    hi = min(yMax+pad, 89.9999)
+    n_strip = max(int(math.ceil((xMax-xMin)/max_width)), 1)
+    width = (xMax-xMin)/n_strip
+    polys = []
+    for i in range(n_strip):
+        x0 = xMin+i*width
+        n = max(int(math.ceil(width)), 1)
+        ras = [x0+width*j/n for j in range(n+1)]
+        ring = [[r, lo] for r in ras] + [[r, hi] for r in reversed(ras)]
+        ring.append(ring[0])
+        ring = [[(r+180.) % 360.-180., d] for r, d in ring]
+        polys.append({'type': 'Polygon', 'coordinates': [ring]})
+    return polys
+
+
+class MongoBackend(StorageBackend):
+    """Catalogs stored in MongoDB.
+
+    Each catalog is a collection with one document per object, meta
+    information is kept in the ``meta`` collection.
+
+    Attributes:
+        db: The pymongo database.
+    """
+    name = 'mongo'
+
+    def __init__(self, db):
+        """
+        Args:
+            db: A pymongo database.
+        """
+        self.db = db
+        self.db_name = db.name
+
+    def database(self, db):
+        return MongoBackend(self.db.client[db])
+
+    def catalogs(self):
+        # reserved for other use
+        reserved = ['mst', 'circles', 'healpix', 'healpix_pix',
+                    'mst_index.files', 'mst_index.chunks', META_COLLECTION]
+        catalogs = self.db.collection_names(include_system_collections=False)
+        return [x for x in catalogs if x not in reserved]
+
+    def get_meta(self, name):
+        return migrate_meta(self.db, name)
+
+    def update_meta(self, name, fields=None, unset=None):
+        update = {}
+        if fields:
+            update['$set'] = fields
+        if unset:
+            update['$unset'] = {k: '' for k in unset}
+        self.db[META_COLLECTION].update_one({'_id': name}, update, upsert=True)
+
+    def add_done(self, name, chunk_ids):
+        self.db[META_COLLECTION].update_one({'_id': name}, {'$addToSet': {'ingest.done': {'$each': list(chunk_ids)}}})
+
+    def save_composite(self, name, composite):
+        # kept with the meta information, without ``adjust`` at the top so
+        # it isn't taken for a catalog
+        self.update_meta(name, {'composite': composite})
+
+    def composites(self):
+        return {x['_id']: x['composite']
+                for x in self.db[META_COLLECTION].find({'composite': {'$exists': True}})}
+
+    def drop(self, name):
+        db = self.db
+        db.drop_collection(name)
+        db[META_COLLECTION].delete_one({'_id':name})
+        db['mst'].delete_one({'_id':name})
+        fs = gridfs.GridFS(db, collection='mst_index')
+        for grid_out in fs.find({'filename': name}):
+            fs.delete(grid_out._id)
+        grids = [x['_id'] for x in db['healpix'].find({'coll':name}, {'_id':1})]
+        db['healpix_pix'].delete_many({'grid':{'$in':grids}})
+        db['healpix'].delete_many({'coll':name})
+
+    def invalidate(self, name, boxes, extent=False):
+        """Invalidate the MST and Healpix grids of a catalog after objects
+        were added.
+
+        The MST is dropped, as new objects change it everywhere, and is
+        computed again when next displayed. Outline grids cover the extent
+        of the catalog and are dropped only if it grew. Pixels of density
+        grids overlapping ``boxes`` are binned again from the stored
+        objects, the other pixels are kept as they are.
+        """
+        db = self.db
+        db['mst'].delete_one({'_id':name})
+        fs = gridfs.GridFS(db, collection='mst_index')
+        for grid_out in fs.find({'filename': name}):
+            fs.delete(grid_out._id)
+        for grid in list(db['healpix'].find({'coll':name})):
+            if 'field' in grid:
+                self._rebin(name, grid, boxes)
+            elif extent:
+                db['healpix_pix'].delete_many({'grid':grid['_id']})
+                db['healpix'].delete_one({'_id':grid['_id']})
+
+    def _rebin(self, name, grid, boxes):
+        """Private method binning again the pixels of a density grid
+        overlapping given boxes.
+
+        The objects read are those within the vertices of the pixels, padded
+        by a pixel radius, so that the pixels are binned in full.
+        """
+        import healpy as hp
+        db = self.db
+        (nside, nest, field) = (grid['nside'], grid['nest'], grid['field'])
+        meta = self.get_meta(name)
+        strategy = meta.get('index', {}).get('strategy', '2d')
+        pad = math.degrees(hp.max_pixrad(nside))
+        pixels = []
+        queries = []
+        for (xMin, yMin, xMax, yMax) in boxes:
+            pix = get_pix_bbox(xMin, yMin, xMax, yMax, nside, nest, centers=False)
+            if len(pix) == 0:
+                continue
+            pixels.append(pix)
+            ra, dec = get_vert(pix, nside, nest)
+            lo = max(dec.min()-pad, -90.)
+            hi = min(dec.max()+pad, 90.)
+            ra_pad = min(pad/max(math.cos(math.radians(max(abs(lo), abs(hi)))), 1e-3), 180.)
+            (left, right) = (ra.min()-ra_pad, ra.max()+ra_pad)
+            # pixels over RA = 0 are read from both sides
+            for (a, b) in [(left, right), (left+360., right+360.), (left-360., right-360.)]:
+                if b >= 0 and a <= 360:
+                    queries.append(box_query(strategy, (max(a, 0.), lo, min(b, 360.), hi), 0))
+        if len(pixels) == 0:
+            return
+        pixels = np.unique(np.concatenate(pixels))
+
+        proj = {'_id': 1, 'RA': 1, 'DEC': 1}
+        if field != '':
+            proj[field] = 1
+        df = pd.DataFrame(list(db[name].find({'$or': queries}, proj)))
+        docs = []
+        if df.shape[0] > 0:
+            values = df[field].values if field != '' else None
+            agg = bin_healpix(df['RA'].values, df['DEC'].values, nside, nest, values)
+            keep = np.in1d(agg['pix'], pixels)
+            agg = {k: v[keep] for k, v in agg.items()}
+            docs = healpix_docs(grid['_id'], nside, nest, agg)
+
+        pix_coll = db['healpix_pix']
+        pix_coll.delete_many({'grid':grid['_id'], 'pix':{'$in':pixels.tolist()}})
+        if len(docs) > 0:
+            pix_coll.insert_many(docs, ordered=False)
+
+        stats = list(grid['range'].keys())
+        group = {'_id': None}
+        for x in stats:
+            group[x+'Min'] = {'$min': '$'+x}
+            group[x+'Max'] = {'$max': '$'+x}
+        result = list(pix_coll.aggregate([{'$match': {'grid':grid['_id']}}, {'$group': group}]))
+        if len(result) > 0:
+            ranges = {x: [float(result[0][x+'Min']), float(result[0][x+'Max'])] for x in stats}
+            levels = [nside]
+        else:
+            ranges = {x: [0, 1] for x in stats}
+            levels = []
+        db['healpix'].update_one({'_id':grid['_id']}, {'$set': {'range':ranges, 'levels':levels}})
+
+    def delete_rank(self, name, cat_rank):
+        self.db[name].delete_many({'cat_rank': cat_rank})
+
+    def insert(self, name, chunk, cat_rank, first_id, strategy='2d', retries=3):
+        """Insert a chunk of a formatted catalog.
+
+        Documents are built straight from the column arrays and given
+        consecutive integer ``_id`` from ``first_id``, so the same row always
+        gets the same ``_id``. Documents that already landed, in an earlier
+        attempt after a network error or in an interrupted ingestion, are
+        skipped as duplicates. Fields needed by the index strategy are added.
+        """
+        keys = list(chunk.columns)
+        cols = [self._column_list(chunk[x]) for x in keys]
+        ra = chunk['RA'].values
+        dec = chunk['DEC'].values
+        # assign 'loc' for geoIndex in Mongo
+        cols.append([[x, y] for x, y in zip(ra.tolist(), dec.tolist())])
+        cols.append([cat_rank]*chunk.shape[0])
+        cols.append(range(first_id, first_id+chunk.shape[0]))
+        keys += ['loc', 'cat_rank', '_id']
+        if strategy == '2dsphere':
+            # GeoJSON longitudes are within [-180, 180)
+            lon = (ra+180.) % 360. - 180.
+            cols.append([{'type': 'Point', 'coordinates': [x, y]}
+                         for x, y in zip(lon.tolist(), dec.tolist())])
+            keys.append('sky')
+        elif strategy == 'tilekey':
+            cols.append(tile_key(ra, dec).tolist())
+            cols.append(min_zoom(chunk['b'].values).tolist())
+            keys += ['tilekey', 'minzoom']
+        docs = [dict(zip(keys, row)) for row in zip(*cols)]
+
+        collection = self.db[name]
+        for attempt in range(retries+1):
+            try:
+                collection.insert_many(docs, ordered=False)
+                break
+            except BulkWriteError as err:
+                # only duplicates of documents that landed before
+                if any(x['code'] != 11000 for x in err.details['writeErrors']):
+                    raise
+                break
+            except AutoReconnect:
+                if attempt == retries:
+                    raise
+                time.sleep(0.5*2**attempt)
+        return len(docs)
+
+    def _column_list(self, series):
+        """Private method converting a column to a list of Python objects."""
+        if series.dtype.kind == 'M':
+            return list(series.dt.to_pydatetime())
+        return series.values.tolist()
+
+    def create_indexes(self, name, strategy, background=True):
+        for keys, kwargs in INDEXES[strategy]:
+            self.db[name].create_index(keys, background=background, **kwargs)
+
+    def index_size(self, name, strategy):
+        sizes = self.db.command('collstats', name)['indexSizes']
+        return {kwargs['name']: sizes.get(kwargs['name'], 0) for _, kwargs in INDEXES[strategy]}
+
+    def count(self, name):
+        return self.db[name].count()
+
+    def scan(self, name, fields, dec_range=None):
+        proj = {x: 1 for x in fields}
+        proj['_id'] = 1 if '_id' in fields else 0
+        query = {}
+        if dec_range is not None:
+            (lo, hi) = dec_range
+            strategy = (self.get_meta(name) or {}).get('index', {}).get('strategy', '2d')
+            # the box lets the position index find the zone, the bounds are exact
+            box = box_query(strategy, (0., max(lo, -90.), 360., min(hi, 90.)), 0)
+            query = {'$and': [box, {'DEC': {'$gte': lo, '$lt': hi}}]}
+        return pd.DataFrame(list(self.db[name].find(query, proj)))
+
+    def box(self, name, box, min_b, strategy='2d', exclude=()):
+        proj = {x: 0 for x in INDEX_FIELDS + list(exclude)}
+        proj['_id'] = 0
+        return list(self.db[name].find(box_query(strategy, box, min_b), proj))
+
+    def popup(self, name, ra, dec, exclude=()):
+        proj = {x: 0 for x in INDEX_FIELDS + list(exclude)}
+        proj['_id'] = 0
+        return list(self.db[name].find({'$and':[{'RA':ra},{'DEC':dec}]}, proj))
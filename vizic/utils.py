@@ -1,11 +1,16 @@
-import healpy as hp
+import io
+import os
+import sys
+import threading
 import numpy as np
 import pandas as pd
-from scipy.sparse.csgraph import minimum_spanning_tree as mst
-from sklearn.neighbors import kneighbors_graph as kng
-from scipy.sparse import find
-from scipy.sparse.csgraph import connected_components as cp
-from scipy.sparse import csr_matrix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# healpy, scipy and sklearn are imported where used, so that importing vizic
+# stays fast for sessions not drawing MSTs or Healpix grids
 
 
 def get_mst(df, neighbors):
@@ -26,6 +31,9 @@ def get_mst(df, neighbors):
         storing the indexes and values of non-zero elements in the MST sparse
         matrix.
     """
+    from scipy.sparse import find
+    from scipy.sparse.csgraph import minimum_spanning_tree as mst
+    from sklearn.neighbors import kneighbors_graph as kng
     df = df[['RA', 'DEC']]
     numA = df.as_matrix(columns=['RA','DEC'])
     G = kng(numA,n_neighbors=neighbors,mode='distance')
@@ -54,11 +62,78 @@ def get_m_index(df):
         A tuple of arrays storing the indexes and values of non-zero elements
         in the MST sparse matrix.
     """
+    from scipy.sparse import csr_matrix, find
     node_num = df.shape[0]+1
     index_mtx = csr_matrix((df['edges'].values,(df['index1'].values, df['index2'].values)), shape=(node_num, node_num))
     return find(index_mtx)
 
 
+def dump_m_index(mst_index):
+    """Serialize the index of a MST sparse matrix to ``.npy`` bytes.
+
+    Args:
+        mst_index: A tuple of arrays indicating the indexes and values for the
+            MST sparse matrix.
+
+    Returns:
+        A bytes object holding a structured array with ``row``, ``col`` and
+        ``val`` fields in NumPy ``.npy`` format.
+    """
+    row, col, val = mst_index
+    arr = np.empty(row.shape[0], dtype=[('row', '<i4'), ('col', '<i4'), ('val', '<f8')])
+    arr['row'] = row
+    arr['col'] = col
+    arr['val'] = val
+    buf = io.BytesIO()
+    np.save(buf, arr, allow_pickle=False)
+    return buf.getvalue()
+
+
+def load_m_index(data):
+    """Load the index of a MST sparse matrix from ``.npy`` bytes.
+
+    Args:
+        data: Bytes written by ``dump_m_index``.
+
+    Returns:
+        A tuple of arrays storing the indexes and values of non-zero elements
+        in the MST sparse matrix.
+    """
+    arr = np.load(io.BytesIO(data), allow_pickle=False)
+    return arr['row'], arr['col'], arr['val']
+
+
+def cut_mask(mst_index, length, member):
+    """Find the mask of saved edges after a cut.
+
+    Args:
+        mst_index: A tuple of arrays indicating the indexes and values for the
+            MST sparse matrix.
+        length(float): The maximum length for edges in a trimmed tree. All edges
+            above are cutted off.
+        member(int): Minimum number of edges required in a saved branch. All
+            branches having less members are removed in the final tree.
+
+    Returns:
+        A boolean numpy array, one entry per edge in the order of
+        ``mst_index``, which is True for saved edges.
+    """
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components as cp
+    row, col, val = mst_index
+    node_num = row.shape[0]+1
+
+    keep = val < length  # get lines after cut
+    # make csr matrix for finding connected components
+    ccm = csr_matrix((val[keep], (row[keep], col[keep])), shape=(node_num, node_num))
+    labels = cp(ccm, directed=False)[1]  # find connected components and get labels
+
+    # groups with less than member+1 nodes are discarded, and so are the
+    # lines ending at one of their nodes
+    small = np.bincount(labels) < member+1
+    return ~small[labels][col]
+
+
 def cut_tree(mst_index, length, member):
     """Find the index for saved edges after a cut.
 
@@ -77,84 +152,314 @@ def cut_tree(mst_index, length, member):
     Returns:
         A list of integers representing the index for saved edges.
     """
-    index = mst_index
-    node_num = index[0].shape[0]+1
-    lines = pd.DataFrame({'row':index[0], 'col':index[1], 'val':index[2]})
+    return np.flatnonzero(cut_mask(mst_index, length, member)).tolist()
 
-    cutted = lines[lines.val < length]  # get lines after cut
-    # make csr matrix for finding connected components
-    ccm = csr_matrix((cutted['val'].values,(cutted['row'].values, cutted['col'].values)),shape=(node_num, node_num))
-    labels = cp(ccm, directed=False)[1]  # find connected components and get labels
 
-    # sort out labels with small group members
-    s = pd.Series(labels)
-    df_s = s.reset_index(name='group')  # make label groups, make integer index one column and refer to node id
-    gb = df_s.groupby('group')  # group by groups(labels)
-    df_rt = gb.count()  # ordered by group labels, value is the counts, this is actually a dataframe
-    label_cnts = df_rt['index']  # index is the column name
-    label_cnts = label_cnts[label_cnts < member+1]  # find groups with less than n+1 node,
-    # member is the provided min branch count
+def pack_mask(mask):
+    """Pack a boolean edge mask into bytes for binary syncing.
 
-    rm_gps = label_cnts.index.values.tolist()  # groups with labels discarded
-    node_ls = df_s[df_s.group.isin(rm_gps)]['index'].tolist()  # the list of nodes that will be discarded
-    lines_rt = lines[(~lines.col.isin(node_ls))]  # remove line pairs that include node in node_ls
-    saved_index = lines_rt.index.values.tolist()
+    Bit ``i`` of the result (most significant bit first within each byte)
+    is set if edge ``i`` is saved.
 
-    # return the wanted lines in the form of index
-    return saved_index
+    Args:
+        mask: A boolean numpy array.
+
+    Returns:
+        A bytes object of ``ceil(len(mask)/8)`` bytes.
+    """
+    return np.packbits(np.asarray(mask, dtype=bool)).tobytes()
 
 
 # Functions for Healpix
 def get_vert(pixel, nside, nest):
-    """Get the coordinates for the vertices for a single Healpix index for a given
+    """Get the coordinates for the vertices of Healpix pixels for a given
     resolution (nside) and schema (nest)
 
     Args:
         * All arguments are required
-        pixel(int): Healpix index
+        pixel(int or array): Healpix index or an array of indexes
         nside(int) : Healpix resolution given by nside parameters for the input pixel
         nest(bool): Pixelization schema, True: Nested Schema, False: Ring Schema
     Returns:
-        Two lists with the RA and DEC positions for the vertices for the given pixel.
+        Two flat arrays with the RA and DEC positions for the vertices, four
+        consecutive entries for each given pixel.
     """
-    # Get vertices in radian coordinates for a given pixel
-    vertices = np.array(hp.vec2ang(np.transpose(hp.boundaries(nside,pixel,nest=nest))))
+    import healpy as hp
+    pixel = np.atleast_1d(pixel)
+    # Get vertices as vectors for all pixels at once, (npix, 3, 4)
+    vec = np.asarray(hp.boundaries(nside, pixel, nest=nest)).reshape(-1, 3, 4)
+    th, phi = hp.vec2ang(np.transpose(vec, (0, 2, 1)).reshape(-1, 3))
     # To degrees
-    vertices = vertices*180./np.pi
-    diff = vertices[1] - vertices[1][0]  # RA = 0
+    ra_vert = np.degrees(phi).reshape(-1, 4)
+    dec_vert = 90.0 - np.degrees(th)
+    # keep vertices of a pixel on the same side of RA = 0
+    diff = ra_vert - ra_vert[:, :1]
     diff[diff > 180] -= 360
     diff[diff < -180] += 360
-    ra_vert = vertices[1][0] + diff
-    ra_vert = np.append(ra_vert,ra_vert[0])
-    dec_vert = 90.0 - vertices[0]
-    dec_vert = np.append(dec_vert,dec_vert[0])
-    return ra_vert,dec_vert
+    ra_vert = ra_vert[:, :1] + diff
+    return ra_vert.ravel(), dec_vert
+
+
+def get_center(pixel, nside, nest):
+    """Get the RA and DEC of Healpix pixel centers.
+
+    Args:
+        pixel(int or array): Healpix index or an array of indexes
+        nside(int) : Healpix resolution given by nside.
+        nest(bool): Pixelization schema, True: Nested Schema, False: Ring Schema
+
+    Returns:
+        Two arrays with the RA and DEC of the pixel centers in degrees.
+    """
+    import healpy as hp
+    th, phi = hp.pix2ang(nside, pixel, nest)
+    return np.degrees(phi), 90.-np.degrees(th)
+
+
+def bin_healpix(ra, dec, nside, nest, values=None):
+    """Bin positions into Healpix pixels and aggregate a property per pixel.
+
+    Args:
+        ra(array): Right ascension of the objects in degrees.
+        dec(array): Declination of the objects in degrees.
+        nside(int) : Healpix resolution given by nside.
+        nest(bool): Pixelization schema, True: Nested Schema, False: Ring Schema
+        values(array): Optional property values of the objects. Objects with
+            a NaN value are left out.
+
+    Returns:
+        A dictionary with the sorted non-empty ``pix`` and the ``count`` of
+        objects in each, plus the ``mean`` and ``median`` of ``values`` per
+        pixel if given.
+    """
+    import healpy as hp
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    if values is not None:
+        values = np.asarray(values, dtype=float)
+        keep = ~np.isnan(values)
+        ra, dec, values = ra[keep], dec[keep], values[keep]
+    pix = hp.ang2pix(nside, np.radians(90.-dec), np.radians(ra), nest)
+    uniq, inv = np.unique(pix, return_inverse=True)
+    counts = np.bincount(inv)
+    result = {'pix': uniq, 'count': counts}
+    if values is None:
+        return result
+
+    result['mean'] = np.bincount(inv, weights=values)/counts
+    result['median'] = _pixel_medians(inv, values, counts)
+    return result
+
+
+def _pixel_medians(inv, values, counts):
+    """Median of the values in each pixel, given the pixel index of each."""
+    # sort by pixel then value, the median sits in the middle of each run
+    order = np.lexsort((values, inv))
+    sorted_v = values[order]
+    start = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return (sorted_v[start+(counts-1)//2]+sorted_v[start+counts//2])/2.
+
+
+def bin_healpix_chunks(chunks, nside, nest, field=''):
+    """Bin a catalog read in chunks into Healpix pixels, see ``bin_healpix``.
+
+    Counts and sums are added up chunk by chunk. The median needs all values
+    in a pixel, so with a field the pixel and value of each object are kept,
+    as two arrays rather than the rows read.
+
+    Args:
+        chunks: An iterable of pandas dataframes with ``RA``, ``DEC`` and the
+            field.
+        nside(int) : Healpix resolution given by nside.
+        nest(bool): Pixelization schema, True: Nested Schema, False: Ring Schema
+        field(str): The property aggregated. Defaults to none, counts only.
+
+    Returns:
+        A dictionary as returned by ``bin_healpix``.
+    """
+    import healpy as hp
+    (pix_l, count_l, sum_l, obj_pix, obj_val) = ([], [], [], [], [])
+    for chunk in chunks:
+        if chunk.shape[0] == 0:
+            continue
+        ra = np.asarray(chunk['RA'].values, dtype=float)
+        dec = np.asarray(chunk['DEC'].values, dtype=float)
+        if field != '':
+            values = np.asarray(chunk[field].values, dtype=float)
+            keep = ~np.isnan(values)
+            ra, dec, values = ra[keep], dec[keep], values[keep]
+        pix = hp.ang2pix(nside, np.radians(90.-dec), np.radians(ra), nest)
+        uniq, inv = np.unique(pix, return_inverse=True)
+        pix_l.append(uniq)
+        count_l.append(np.bincount(inv))
+        if field != '':
+            sum_l.append(np.bincount(inv, weights=values))
+            obj_pix.append(pix)
+            obj_val.append(values)
+
+    stats = ['count'] if field == '' else ['count', 'mean', 'median']
+    if len(pix_l) == 0:
+        result = {x: np.zeros(0) for x in stats}
+        result['pix'] = np.zeros(0, dtype=np.int64)
+        result['count'] = np.zeros(0, dtype=np.int64)
+        return result
+    uniq, inv = np.unique(np.concatenate(pix_l), return_inverse=True)
+    counts = np.bincount(inv, weights=np.concatenate(count_l)).astype(np.int64)
+    result = {'pix': uniq, 'count': counts}
+    if field == '':
+        return result
+
+    result['mean'] = np.bincount(inv, weights=np.concatenate(sum_l))/counts
+    obj_pix = np.concatenate(obj_pix)
+    result['median'] = _pixel_medians(np.searchsorted(uniq, obj_pix), np.concatenate(obj_val), counts)
+    return result
+
+
+def healpix_docs(grid, nside, nest, agg):
+    """Build the pixel documents of a Healpix aggregate grid.
+
+    Args:
+        grid(str): The ID of the grid.
+        nside(int) : Healpix resolution given by nside.
+        nest(bool): Pixelization schema, True: Nested Schema, False: Ring Schema
+        agg(dict): Pixels and their aggregates, as returned by
+            ``bin_healpix``.
+
+    Returns:
+        A list of dictionaries, one per pixel, with its vertices and
+        aggregates.
+    """
+    pix = agg['pix']
+    ra, dec = get_vert(pix, nside, nest)
+    ra_c, dec_c = get_center(pix, nside, nest)
+    stats = [x for x in ['count', 'mean', 'median'] if x in agg]
+    cols = [agg[x].tolist() for x in stats]
+    docs = [{'grid':grid, 'nside':nside, 'pix':p, 'loc':[x, y],
+             'ra':r, 'dec':d}
+            for p, x, y, r, d in zip(pix.tolist(), ra_c.tolist(), dec_c.tolist(),
+                                     ra.reshape(-1, 4).tolist(), dec.reshape(-1, 4).tolist())]
+    for i, doc in enumerate(docs):
+        for stat, col in zip(stats, cols):
+            doc[stat] = col[i]
+    return docs
+
+
+def unit_vectors(ra, dec):
+    """Convert positions in degrees to unit vectors, one per row."""
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    return np.column_stack([np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)])
+
+
+def match_positions(ra_a, dec_a, ra_b, dec_b, radius, nearest=True):
+    """Match two sets of positions on the sky.
+
+    A KD-tree is built on the unit vectors of the positions, where the chord
+    between two vectors gives their exact separation.
+
+    Args:
+        ra_a(array): RA of the first positions in degrees.
+        dec_a(array): DEC of the first positions in degrees.
+        ra_b(array): RA of the second positions in degrees.
+        dec_b(array): DEC of the second positions in degrees.
+        radius(float): The largest separation matched, in degrees.
+        nearest(bool): Keep only the nearest match of each first position,
+            otherwise all pairs within ``radius``. Defaults to True.
+
+    Returns:
+        A tuple of the row numbers of matched first and second positions
+        and their separations in degrees.
+    """
+    from scipy.spatial import cKDTree
+    if len(ra_a) == 0 or len(ra_b) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+    chord = 2*np.sin(np.radians(radius)/2)
+    tree_b = cKDTree(unit_vectors(ra_b, dec_b))
+    if nearest:
+        dist, ib = tree_b.query(unit_vectors(ra_a, dec_a), k=1, distance_upper_bound=chord)
+        ia = np.nonzero(np.isfinite(dist))[0]
+        (ib, dist) = (ib[ia], dist[ia])
+    else:
+        tree_a = cKDTree(unit_vectors(ra_a, dec_a))
+        pairs = tree_a.sparse_distance_matrix(tree_b, chord, output_type='ndarray')
+        (ia, ib, dist) = (pairs['i'], pairs['j'], pairs['v'])
+    sep = np.degrees(2*np.arcsin(np.clip(dist/2, 0, 1)))
+    return (ia.astype(np.int64), ib.astype(np.int64), sep)
 
 
 def is_inside_bbox(ra,dec,llra,lldec,urra,urdec):
-    """Find whether a point is inside a bounding box.
+    """Find whether points are inside a bounding box.
 
     Args:
-        ra(float): Right ascension of the query point.
-        dec(float): Declination of the query point.
+        ra(float or array): Right ascension of the query points.
+        dec(float or array): Declination of the query points.
         llra(float): Lower left RA for the bounding box.
         lldec(float): Lower left DEC for the bounding box.
         urra(float): Upper right RA for the bounding box.
         urdec(float): Upper right DEC for the bounding box.
 
     Returns:
-        A Bool whether the point is inside the bounding box.
+        A Bool, or a boolean array, whether the points are inside the
+        bounding box.
 
     TODO: Use ray tracing for any polygon shape
     """
-    if (ra <= urra) & (ra >= llra) & (dec <= urdec) & (dec >= lldec):
-        return True
-    else:
-        return False
+    return (ra <= urra) & (ra >= llra) & (dec <= urdec) & (dec >= lldec)
+
+
+def get_pix_bbox(llra,lldec,urra,urdec,nside,nest,centers=True):
+    """Get all Healpix pixels with centers inside a given bounding box.
+
+    The bounding box is split into RA strips of at most 30 degrees, each
+    strip is searched with ``hp.query_polygon`` and the found pixels are
+    filtered by their centers, unless ``centers`` is False.
+
+    Args:
+        llra(float): Lower left RA for the bounding box.
+        lldec(float): Lower left DEC for the bounding box.
+        urra(float): Upper right RA for the bounding box.
+        urdec(float): Upper right DEC for the bounding box.
+        nside(int) : Healpix resolution given by nside.
+        nest(bool): Pixelization schema, True: Nested Schema, False: Ring Schema
+        centers(bool): Keep pixels with centers inside the box only,
+            otherwise keep all pixels overlapping it, and possibly a few
+            neighbours. Defaults to True.
+
+    Returns:
+        A sorted array of pixel indexes.
+    """
+    import healpy as hp
+    eps = 1e-6
+    n_strip = max(int(np.ceil((urra-llra)/30.)), 1)
+    ra_edges = np.linspace(llra, urra, n_strip+1)
+    half_w = np.radians((urra-llra)/n_strip/2.)
+    lo = np.clip(lldec, -90+eps, 90-eps)
+    hi = np.clip(urdec, -90+eps, 90-eps)
+    # great circles between two vertices bow towards the nearer pole, move
+    # the edges bowing into the box outwards so that the polygons cover it
+    if lo > 0:
+        lo = np.degrees(np.arctan(np.tan(np.radians(lo))*np.cos(half_w)))
+    if hi < 0:
+        hi = np.degrees(np.arctan(np.tan(np.radians(hi))*np.cos(half_w)))
+
+    found = []
+    for i in range(n_strip):
+        ra = np.array([ra_edges[i], ra_edges[i+1], ra_edges[i+1], ra_edges[i]])
+        dec = np.array([lo, lo, hi, hi])
+        vertices = hp.ang2vec(np.radians(90.-dec), np.radians(ra))
+        found.append(hp.query_polygon(nside, vertices, inclusive=True, nest=nest))
+    pix = np.unique(np.concatenate(found))
+    if not centers:
+        return pix
+
+    # Check which centers are inside the bbox
+    ra_c, dec_c = get_center(pix, nside, nest)
+    inside = is_inside_bbox(ra_c, dec_c, llra, lldec, urra, urdec)
+    return pix[inside]
 
 
 def get_vert_bbox(llra,lldec,urra,urdec,nside,nest):
-    """Get a list of the vertices for all Healpix pixels inside a given bounding
+    """Get the vertices for all Healpix pixels inside a given bounding
     box, resolution and pixelization schema.
 
     Args:
@@ -166,46 +471,304 @@ def get_vert_bbox(llra,lldec,urra,urdec,nside,nest):
         nest(bool): Pixelization schema, True: Nested Schema, False: Ring Schema
 
     Returns:
-        A list with the vertices for all pixels inside the bounding box.
-    """
-    # Find central point for the bbox
-    mid_ra = (urra+llra)/2.
-    mid_dec = (urdec + lldec)/2.
-    # Convert to radians
-    phi = mid_ra/180.*np.pi
-    th = (90.-mid_dec)/180.*np.pi
-    pix = hp.ang2pix(nside,th,phi,nest)  # Pixel at center
-    neig = hp.get_all_neighbours(nside,pix,None,nest)  # Get initial 8 neighbors
-    # Create a set
-    allp = set(neig)
-    checked_big = set()
-    checked_all = set()
-    k = 0
-    # Find all pixels inside bounding box by looking at all the neighbors'
-    # neighbors recursively using a set to speed up the process.
-    while True:
-        if k == 10000:
-            raise RuntimeError('Did not converge, increase k limit')
-        # Create a copy of the intial set of neighbors
-        temp = allp.copy()
-        for i in temp.copy().difference(checked_big):
-            ntemp = set(hp.get_all_neighbours(nside,i,None,nest))
-            for j in ntemp.difference(checked_all):
-                th2,phi2 = hp.pix2ang(nside,j,nest)
-                # Check if given neighbor is inside the bbox
-                if is_inside_bbox(phi2*180./np.pi,90-th2*180./np.pi,llra,lldec,urra,urdec):
-                    temp.add(j)
-            # Update set to keep track of checked pixels
-            checked_all.update(ntemp)
-            checked_big.add(i)
-        if temp == allp:
+        The array of pixels inside the bounding box, and two flat arrays with
+        the RA and DEC for their vertices, four entries per pixel.
+    """
+    pix = get_pix_bbox(llra, lldec, urra, urdec, nside, nest)
+    ra_vert, dec_vert = get_vert(pix, nside, nest)
+    return pix, ra_vert, dec_vert
+
+
+TILE_KEY_LEVEL = 16
+# level of the cells recording where data was added
+CHANGE_LEVEL = 8
+
+
+def _spread_bits(v):
+    """Spread the lower 16 bits of integers to the even bit positions."""
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+
+def _tile_cell(ra, dec, level):
+    """Global cell coordinates of positions on a ``2**level`` square grid
+    spanning RA 0 to 360 and DEC -90 to 90."""
+    n = 2**level
+    x = np.clip(np.floor(np.asarray(ra, dtype=float)/360.*n), 0, n-1).astype(np.int64)
+    y = np.clip(np.floor((np.asarray(dec, dtype=float)+90.)/180.*n), 0, n-1).astype(np.int64)
+    return x, y
+
+
+def tile_key(ra, dec, level=TILE_KEY_LEVEL):
+    """Compute the Morton (Z-order) key of positions on a global grid.
+
+    Positions close on the sky get close keys, so a range of keys covers a
+    compact patch of sky.
+
+    Args:
+        ra(array): RA of the positions in degrees.
+        dec(array): DEC of the positions in degrees.
+        level(int): Number of bits per axis, at most 16. Defaults to
+            ``TILE_KEY_LEVEL``.
+
+    Returns:
+        An int64 array of keys.
+    """
+    x, y = _tile_cell(ra, dec, level)
+    return _spread_bits(x) | (_spread_bits(y) << 1)
+
+
+def _compact_bits(v):
+    """Gather the even bits of integers into the lower 16 bits, the inverse
+    of ``_spread_bits``."""
+    v = v & 0x55555555
+    v = (v | (v >> 1)) & 0x33333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF
+    v = (v | (v >> 8)) & 0x0000FFFF
+    return v
+
+
+def tile_key_boxes(keys, level, max_boxes=256):
+    """Find the boxes on the sky of cells given by their tile keys.
+
+    Cells are merged up to coarser levels until at most ``max_boxes`` are
+    left.
+
+    Args:
+        keys(array): Tile keys of the cells.
+        level(int): The level of the keys, see ``tile_key``.
+        max_boxes(int): The most boxes returned.
+
+    Returns:
+        A list of ``(xMin, yMin, xMax, yMax)`` boxes in RA and DEC.
+    """
+    keys = np.unique(np.asarray(keys, dtype=np.int64))
+    while len(keys) > max_boxes and level > 0:
+        keys = np.unique(keys >> 2)
+        level -= 1
+    x = _compact_bits(keys)
+    y = _compact_bits(keys >> 1)
+    (w, h) = (360./2**level, 180./2**level)
+    return [(i*w, j*h-90., (i+1)*w, (j+1)*h-90.) for i, j in zip(x.tolist(), y.tolist())]
+
+
+def hilbert_key(ra, dec, level=TILE_KEY_LEVEL):
+    """Compute the Hilbert curve index of positions on a global grid.
+
+    Unlike the Morton curve, consecutive Hilbert indices are always
+    adjacent cells, so sorting by it keeps objects close on the sky closer
+    in the sort order.
+
+    Args:
+        ra(array): RA of the positions in degrees.
+        dec(array): DEC of the positions in degrees.
+        level(int): Number of bits per axis, at most 16. Defaults to
+            ``TILE_KEY_LEVEL``.
+
+    Returns:
+        An int64 array of indices.
+    """
+    x, y = _tile_cell(ra, dec, level)
+    n = 2**level
+    d = np.zeros(x.shape, dtype=np.int64)
+    s = n//2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s*s*((3*rx.astype(np.int64)) ^ ry.astype(np.int64))
+        # rotate the quadrant
+        flip = rx & ~ry
+        x = np.where(flip, n-1-x, x)
+        y = np.where(flip, n-1-y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s //= 2
+    return d
+
+
+def cluster_order(ra, dec, order):
+    """Find the permutation sorting positions along a space filling curve.
+
+    Args:
+        ra(array): RA of the positions in degrees.
+        dec(array): DEC of the positions in degrees.
+        order(str): ``hilbert`` or ``morton``.
+
+    Returns:
+        An array of row numbers, the sort is stable.
+    """
+    if order == 'hilbert':
+        key = hilbert_key(ra, dec)
+    elif order == 'morton':
+        key = tile_key(ra, dec)
+    else:
+        raise Exception('Unknown order {}, use hilbert or morton.'.format(order))
+    return np.argsort(key, kind='mergesort')
+
+
+def min_zoom(b):
+    """Compute the first zoom level at which objects are drawn.
+
+    Zoom levels are given for a map 180 degrees tall, where an object is
+    drawn once its semi-minor axis ``b`` is at least 0.3 pixels.
+
+    Args:
+        b(array): Semi-minor axes in degrees.
+
+    Returns:
+        An int array of zoom levels between 0 and 32.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.ceil(np.log2(0.3*180./(256*np.asarray(b, dtype=float))))
+    z = np.where(np.isfinite(z), z, 32)
+    return np.clip(z, 0, 32).astype(int)
+
+
+def tile_key_ranges(xMin, yMin, xMax, yMax, max_cells=64, level=TILE_KEY_LEVEL):
+    """Find ranges of tile keys covering a box on the sky.
+
+    The box is covered by cells at the finest level where at most
+    ``max_cells`` are needed, and the key ranges of adjacent cells are
+    merged.
+
+    Args:
+        xMin(float): Lower RA of the box.
+        yMin(float): Lower DEC of the box.
+        xMax(float): Upper RA of the box.
+        yMax(float): Upper DEC of the box.
+        max_cells(int): Maximum number of cells used to cover the box.
+        level(int): The level used for keys, see ``tile_key``.
+
+    Returns:
+        A list of ``(low, high)`` tuples, keys are in ``[low, high)``.
+    """
+    for l in range(level, -1, -1):
+        x0, y0 = _tile_cell(xMin, yMin, l)
+        x1, y1 = _tile_cell(xMax, yMax, l)
+        if (x1-x0+1)*(y1-y0+1) <= max_cells:
             break
+    xs, ys = np.meshgrid(np.arange(x0, x1+1), np.arange(y0, y1+1))
+    codes = np.sort((_spread_bits(xs) | (_spread_bits(ys) << 1)).ravel())
+    shift = 2*(level-l)
+    ranges = []
+    for c in codes.tolist():
+        if ranges and ranges[-1][1] == c << shift:
+            ranges[-1][1] = (c+1) << shift
         else:
-            allp.update(temp)
-            k += 1
-    all_verts = []
-    # Get vertices for pixels inside bounding box
-    for i in allp:
-        all_verts.append(get_vert(i, nside,nest))
-    # Return complete list
-    return all_verts
+            ranges.append([c << shift, (c+1) << shift])
+    return [tuple(r) for r in ranges]
+
+
+META_COLLECTION = 'meta'
+
+
+def _rss():
+    """Resident memory of the process in bytes, None if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class MemoryMonitor(object):
+    """Track the resident memory of the process over a block of code.
+
+    Used as a context manager. Resident memory is sampled every
+    ``interval`` seconds in a background thread. Where it can't be read,
+    as outside Linux, only the peak over the lifetime of the process is
+    known, from ``resource``.
+
+    Attributes:
+        start(int): Resident memory in bytes when entering, or None.
+        peak(int): The highest resident memory in bytes, or None.
+        end(int): Resident memory in bytes when leaving, or None.
+    """
+
+    def __init__(self, interval=0.01):
+        """
+        Args:
+            interval(float): Seconds between samples. Defaults to 0.01.
+        """
+        self.interval = interval
+        self.start = self.peak = self.end = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start = self.peak = _rss()
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._sample)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        """Private method sampling resident memory until stopped."""
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.end = _rss()
+        if self.end is not None:
+            self.peak = max(self.peak, self.end)
+        elif resource is not None:
+            # kilobytes on Linux, bytes on macOS
+            unit = 1 if sys.platform == 'darwin' else 1024
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*unit
+        return False
+
+    def report(self):
+        """Return the start, peak and end memory as a dictionary."""
+        return {'start': self.start, 'peak': self.peak, 'end': self.end}
+
+
+def url_path_join(*pieces):
+    """Join components of url into a relative url.
+
+    The same as ``notebook.utils.url_path_join``, which is not imported so
+    that the notebook isn't loaded in kernels. Leading and trailing slashes
+    of the first and last pieces are kept, repeated slashes are removed.
+    """
+    initial = pieces[0].startswith('/')
+    final = pieces[-1].endswith('/')
+    stripped = [s.strip('/') for s in pieces]
+    result = '/'.join(s for s in stripped if s)
+    if initial:
+        result = '/' + result
+    if final:
+        result = result + '/'
+    if result == '//':
+        result = '/'
+    return result
+
+
+def migrate_meta(db, coll_name):
+    """Move the meta information of a catalog to the meta collection.
+
+    Catalogs imported by earlier versions keep it as the ``_id: 'meta'``
+    document of their own collection.
+
+    Args:
+        db: A pymongo database.
+        coll_name(str): The name of the catalog collection.
+
+    Returns:
+        The meta document, or None if the catalog has none.
+    """
+    meta = db[META_COLLECTION].find_one({'_id': coll_name})
+    if meta is not None:
+        return meta
+    meta = db[coll_name].find_one({'_id': 'meta'})
+    if meta is None:
+        return None
+    meta['_id'] = coll_name
+    db[META_COLLECTION].replace_one({'_id': coll_name}, meta, upsert=True)
+    db[coll_name].delete_one({'_id': 'meta'})
+    return meta